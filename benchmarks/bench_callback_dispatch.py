@@ -0,0 +1,118 @@
+# Микробенчмарк стоимости диспетчеризации нажатия кнопки (callback_query).
+#
+# Хендлеры из handlers_user и handlers_admin перерегистрируются с теми же
+# фильтрами, но с пустыми колбэками — в обычные Router и в IndexedRouter.
+# Измеряется полный dp.feed_update для callback_data каждого хендлера,
+# т.е. ровно то, что aiogram тратит до вызова хендлера.
+#
+# Запуск: python benchmarks/bench_callback_dispatch.py [повторов]
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("DB_FILE_PATH", os.path.join(tempfile.mkdtemp(prefix="sd_bot_bench_"), "bench.db"))
+os.environ.setdefault("TOKEN", "42:FAKE")
+os.environ.setdefault("ADMIN_IDS", "900000")
+
+from aiogram import Bot, Dispatcher, Router  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import handlers_admin  # noqa: E402
+import handlers_user  # noqa: E402
+from callbacks import (  # noqa: E402
+    AddressCallback,
+    AdminCategoryCallback,
+    CategoryCallback,
+    DishCallback,
+    OrdersPageCallback,
+    PromoCallback,
+    PromoCategoryCallback,
+    PromoItemCallback,
+)
+from indexed_router import IndexedRouter  # noqa: E402
+
+# По одной callback_data на каждый хендлер — от первых зарегистрированных к последним
+SAMPLES = [
+    "user_back_to_categories",
+    CategoryCallback(category_id=3).pack(),
+    DishCallback(item_id=42).pack(),
+    "user_cart",
+    "delivery_type_delivery",
+    AddressCallback(index=0).pack(),
+    "prep_time_12:30",
+    "payment_card",
+    "profile_orders",
+    "phone_manual",
+    "admin_back",
+    AdminCategoryCallback(action="del_dish", category_id=3).pack(),
+    "orders_filter_week",
+    OrdersPageCallback(page=2).pack(),
+    PromoCallback(action="stats", promo_id=1).pack(),
+    "admin_promo_type_item",
+    PromoCategoryCallback(category_id=3).pack(),
+    PromoItemCallback(item_id=42).pack(),
+    "admin_promo_categories",
+]
+
+
+def copy_router(source: Router, router_cls) -> Router:
+    router = router_cls()
+    for handler in source.callback_query.handlers:
+        async def noop(*args, **kwargs):
+            return None
+        # f.magic — исходный F-фильтр (f.callback у него уже заменён на .resolve)
+        router.callback_query.register(noop, *(f.magic or f.callback for f in handler.filters), flags=handler.flags)
+    return router
+
+
+def make_dispatcher(router_cls) -> Dispatcher:
+    dp = Dispatcher()
+    dp.include_router(copy_router(handlers_user.router, router_cls))
+    dp.include_router(copy_router(handlers_admin.router, router_cls))
+    return dp
+
+
+def make_update(update_id: int, data: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "chat_instance": "1", "data": data,
+            "from": {"id": 900000, "is_bot": False, "first_name": "A"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": 900000, "type": "private"}, "text": "x"},
+        },
+    })
+
+
+async def measure(dp: Dispatcher, bot: Bot, repeats: int) -> dict:
+    results = {}
+    for data in SAMPLES:
+        update = make_update(1, data)
+        await dp.feed_update(bot, update)  # прогрев
+        started = time.perf_counter()
+        for _ in range(repeats):
+            await dp.feed_update(bot, update)
+        results[data] = (time.perf_counter() - started) / repeats * 1e6
+    return results
+
+
+async def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    bot = Bot("42:FAKE")
+    before = await measure(make_dispatcher(Router), bot, repeats)
+    after = await measure(make_dispatcher(IndexedRouter), bot, repeats)
+
+    print(f"{'callback_data':<28} {'Router, мкс':>12} {'Indexed, мкс':>13}")
+    for data in SAMPLES:
+        print(f"{data:<28} {before[data]:>12.1f} {after[data]:>13.1f}")
+    avg_before = sum(before.values()) / len(before)
+    avg_after = sum(after.values()) / len(after)
+    print(f"{'среднее':<28} {avg_before:>12.1f} {avg_after:>13.1f}")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
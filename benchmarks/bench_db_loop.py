@@ -0,0 +1,93 @@
+# Бенчмарк блокировки event loop при параллельных оформлениях заказов.
+#
+# Режим "sync" — функции db.py вызываются прямо в event loop (как было раньше),
+# режим "async" — через поток БД (await db.func()).
+#
+# Запуск: python benchmarks/bench_db_loop.py [кол-во_оформлений]
+import asyncio
+import gc
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp_dir = tempfile.mkdtemp(prefix="sd_bot_bench_")
+os.environ["DB_FILE_PATH"] = os.path.join(_tmp_dir, "bench.db")
+
+import db  # noqa: E402
+
+ARRIVAL_INTERVAL = 0.0005
+
+# (функция для режима async, запрос к БД для режима sync, аргументы). Профиль
+# пользователя читается и пишется через кэш — у обёрток нет .sync, в режиме
+# sync вызываются сами запросы под ними
+CHECKOUT_CALLS = [
+    ("get_user_addresses", "_fetch_user", lambda uid: (uid,)),
+    ("get_promo_by_code", "get_promo_by_code", lambda uid: ("BENCH",)),
+    ("is_promo_used_by_user", "is_promo_used_by_user", lambda uid: (uid, "BENCH")),
+    ("save_user_addresses", "_save_user_addresses", lambda uid: (uid, ["ул. Тестовая, 1"])),
+]
+
+
+async def checkout(uid: str, mode: str):
+    for name, sync_name, args in CHECKOUT_CALLS:
+        if mode == "sync":
+            getattr(db, sync_name).sync(*args(uid))
+            await asyncio.sleep(0)
+        else:
+            await getattr(db, name)(*args(uid))
+
+    append = db.append_order.sync if mode == "sync" else db.append_order
+    items = [{"category": "Супы", "name": "Борщ", "qty": 1, "price": 250, "is_promo": False}]
+    result = append(items, "79000000000", "delivery", "ул. Тестовая, 1", user_id=uid)
+    if mode != "sync":
+        await result
+
+
+async def monitor_loop(stop: asyncio.Event, interval: float = 0.001):
+    # Суммарное и максимальное опоздание тика — время, когда loop был занят
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - start - interval))
+    return lags
+
+
+async def run(mode: str, checkouts: int):
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop(stop))
+    started = time.perf_counter()
+    tasks = []
+    for i in range(checkouts):
+        # Клиенты приходят потоком, а не одной пачкой
+        tasks.append(asyncio.create_task(checkout(str(100000 + i), mode)))
+        await asyncio.sleep(ARRIVAL_INTERVAL)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    lags = await monitor
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    print(f"{mode:>5}: {checkouts} оформлений за {elapsed * 1000:.1f} мс, "
+          f"блокировка loop: сумма {sum(lags) * 1000:.1f} мс, "
+          f"p99 {p99 * 1000:.2f} мс, макс {max(lags, default=0) * 1000:.2f} мс")
+
+
+def main():
+    checkouts = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    db.init_db()
+    db.migrate_db()
+    # Объекты, созданные при импорте (aiogram через metrics), — в постоянное поколение:
+    # иначе полная сборка мусора посреди прогона даёт паузу ~80 мс, не связанную с БД
+    gc.collect()
+    gc.freeze()
+    asyncio.run(run("sync", checkouts))
+    asyncio.run(run("async", checkouts))
+    db.close_db()
+
+
+if __name__ == "__main__":
+    main()
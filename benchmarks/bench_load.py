@@ -0,0 +1,242 @@
+# Нагрузочный тест всего бота: настоящие роутеры handlers_user/handlers_admin,
+# Dispatcher из bot.create_dispatcher (SQLite FSM, фоновые сервисы) и long polling
+# против benchmarks/fake_telegram.py.
+#
+# Каждый виртуальный покупатель проходит сценарий: /start → номер телефона →
+# категория → два блюда → корзина → промокод → оформление → самовывоз или
+# доставка на новый адрес → время → оплата → комментарий. Кнопки берутся из
+# клавиатур, которые бот реально прислал этому пользователю.
+#
+# Задержка шага — от отправки обновления в фейковый Telegram до завершения
+# хендлера (включая ожидание getUpdates, очередь диспетчера и вызовы Bot API).
+# В конце — пропускная способность и p50/p95/p99 по каждому хендлеру.
+#
+# Запуск: python benchmarks/bench_load.py [--users 2000] [--rate 50] [--think 0.5] [--rtt 0.0]
+#
+# Покупатели без пауз (--think 0) упираются в ограничение частоты действий
+# (throttling.py) — для такого прогона поднимите THROTTLE_CALLBACK_RATE/BURST.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("DB_FILE_PATH", os.path.join(tempfile.mkdtemp(prefix="sd_bot_load_"), "load.db"))
+os.environ.setdefault("TOKEN", "42:FAKE")
+os.environ.setdefault("ADMIN_IDS", "900000")
+
+from aiogram import BaseMiddleware  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+
+from fake_telegram import FakeTelegram  # noqa: E402
+
+FAKE_PORT = 8084
+PROMO_CODE = "LOAD100"
+STEP_TIMEOUT = 60
+FIRST_USER_ID = 2_000_000
+
+
+def seed():
+    import db
+    db.init_db()
+    db.migrate_db()
+    for c in range(6):
+        category_id = db.add_category.sync(f"Категория {c + 1}")
+        for d in range(12):
+            db.add_dish.sync(category_id, f"Блюдо {c + 1}.{d + 1}", str(200 + d * 10), "Описание блюда, 300 гр.")
+    db.create_promo.sync("Нагрузка", PROMO_CODE, 0, "discount", discount=100)
+
+
+class Tracker:
+    # Сопоставляет обновления с хендлерами и считает задержки
+    def __init__(self):
+        self.sent_at: dict[int, float] = {}
+        self.waiters: dict[int, asyncio.Future] = {}
+        self.handler_names: dict[int, str] = {}
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def expect(self, update_id: int) -> asyncio.Future:
+        self.sent_at[update_id] = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[update_id] = future
+        return future
+
+    def done(self, update_id: int, failed: bool):
+        name = self.handler_names.pop(update_id, "(не обработано)")
+        started = self.sent_at.pop(update_id, None)
+        if started is not None:
+            self.latencies[name].append(time.perf_counter() - started)
+        if failed:
+            self.errors[name] += 1
+        future = self.waiters.pop(update_id, None)
+        if future and not future.done():
+            future.set_result(name)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    def __init__(self, tracker: Tracker):
+        self.tracker = tracker
+
+    async def __call__(self, handler, event, data):
+        self.tracker.handler_names[data["event_update"].update_id] = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+class UpdateDoneMiddleware(BaseMiddleware):
+    def __init__(self, tracker: Tracker):
+        self.tracker = tracker
+
+    async def __call__(self, handler, event, data):
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.tracker.done(event.update_id, failed)
+
+
+class Customer:
+    def __init__(self, user_id: int, fake: FakeTelegram, tracker: Tracker, markups: dict, rng: random.Random,
+                 think: float):
+        self.user_id = user_id
+        self.fake = fake
+        self.tracker = tracker
+        self.markups = markups
+        self.rng = rng
+        self.think = think
+
+    async def send(self, update: dict):
+        future = self.tracker.expect(update["update_id"])
+        await self.fake.push_update(update)
+        await asyncio.wait_for(future, STEP_TIMEOUT)
+        await asyncio.sleep(self.rng.uniform(0, self.think))
+
+    async def message(self, text: str):
+        await self.send(self.fake.message_update(self.user_id, text))
+
+    async def press(self, data: str):
+        await self.send(self.fake.callback_update(self.user_id, data))
+
+    def buttons(self, prefix: str) -> list[str]:
+        markup = self.markups.get(self.user_id) or {}
+        return [button["callback_data"] for row in markup.get("inline_keyboard", []) for button in row
+                if button.get("callback_data", "").startswith(prefix)]
+
+    async def run(self) -> bool:
+        await self.message("/start")
+        await self.send(self.fake.contact_update(self.user_id, f"+7900{self.user_id:07d}"))
+        await self.press(self.rng.choice(self.buttons("c:")))
+        dishes = self.buttons("d:")
+        for _ in range(2):
+            await self.press(self.rng.choice(dishes))
+        await self.press("user_cart")
+        await self.press("user_enter_promo")
+        await self.message(PROMO_CODE)
+        await self.press("user_checkout")
+
+        delivery = self.rng.random() < 0.5
+        if delivery:
+            await self.press("delivery_type_delivery")
+            await self.press("new_address")
+            await self.message(f"ул. Нагрузочная, {self.user_id}")
+        else:
+            await self.press("delivery_type_pickup")
+        slots = self.buttons("prep_time_")
+        if not slots:
+            return False
+        await self.press(slots[0])
+        if delivery:
+            await self.press("payment_card")
+        await self.message("нет")
+        return True
+
+
+def percentile(values: list[float], p: float) -> float:
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def report(tracker: Tracker, elapsed: float, finished: int, failed: int, api_calls: int):
+    updates = sum(len(v) for v in tracker.latencies.values())
+    print(f"\nСценариев: {finished} завершено, {failed} прервано за {elapsed:.1f} с")
+    print(f"Обновлений: {updates} ({updates / elapsed:.0f}/с), заказов: {finished / elapsed:.1f}/с, "
+          f"вызовов Bot API: {api_calls} ({api_calls / elapsed:.0f}/с)")
+    print(f"\n{'хендлер':<28} {'шт.':>6} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} {'max, мс':>8} {'ошибок':>7}")
+    for name, values in sorted(tracker.latencies.items(), key=lambda kv: -len(kv[1])):
+        values.sort()
+        print(f"{name:<28} {len(values):>6} {percentile(values, 50) * 1000:>8.1f} {percentile(values, 95) * 1000:>8.1f} "
+              f"{percentile(values, 99) * 1000:>8.1f} {values[-1] * 1000:>8.1f} {tracker.errors.get(name, 0):>7}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000, help="виртуальных покупателей")
+    parser.add_argument("--rate", type=float, default=50, help="новых покупателей в секунду")
+    parser.add_argument("--think", type=float, default=0.5, help="максимальная пауза между шагами, с")
+    parser.add_argument("--rtt", type=float, default=0.0, help="имитация задержки сети до Telegram, с")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    seed()
+    from bot import create_dispatcher
+
+    fake = FakeTelegram(rtt=args.rtt, port=FAKE_PORT)
+    markups: dict[int, dict] = {}
+
+    def remember_markup(method: str, params: dict):
+        if "reply_markup" in params and "chat_id" in params:
+            markup = json.loads(params["reply_markup"])
+            if "inline_keyboard" in markup:
+                markups[int(params["chat_id"])] = markup
+
+    fake.on_call = remember_markup
+    await fake.start()
+
+    tracker = Tracker()
+    bot = fake.make_bot(default=DefaultBotProperties(parse_mode="HTML"))
+    dp = create_dispatcher()
+    dp.update.outer_middleware(UpdateDoneMiddleware(tracker))
+    dp.message.middleware(HandlerNameMiddleware(tracker))
+    dp.callback_query.middleware(HandlerNameMiddleware(tracker))
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+
+    rng = random.Random(args.seed)
+    results = {"finished": 0, "failed": 0}
+
+    async def customer(user_id: int):
+        try:
+            ok = await Customer(user_id, fake, tracker, markups, random.Random(rng.random()), args.think).run()
+        except (asyncio.TimeoutError, IndexError):
+            ok = False
+        results["finished" if ok else "failed"] += 1
+
+    print(f"Покупателей: {args.users}, {args.rate:g}/с, пауза до {args.think:g} с, rtt {args.rtt * 1000:.0f} мс")
+    started = time.perf_counter()
+    calls_before = len(fake.calls)
+    tasks = []
+    for i in range(args.users):
+        tasks.append(asyncio.create_task(customer(FIRST_USER_ID + i)))
+        await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    report(tracker, elapsed, results["finished"], results["failed"], len(fake.calls) - calls_before)
+
+    await dp.stop_polling()
+    await polling
+    await bot.session.close()
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
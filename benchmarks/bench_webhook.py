@@ -0,0 +1,110 @@
+# Бенчмарк задержки "обновление создано → хендлер начал работу": long polling против вебхука.
+#
+# Оба режима работают против benchmarks/fake_telegram.py с имитацией сетевой задержки
+# до Telegram (--rtt). Вебхук поднимается тем же webhook.build_app, что и в бою.
+#
+# Запуск: python benchmarks/bench_webhook.py [--updates 2000] [--rate 200] [--rtt 0.05]
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("TOKEN", "42:FAKE")
+
+from aiogram import Dispatcher  # noqa: E402
+from aiogram.types import Message, Update  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+from fake_telegram import FakeTelegram  # noqa: E402
+from webhook import build_app  # noqa: E402
+
+WEBHOOK_PORT = 8082
+WEBHOOK_SECRET = "bench-secret"
+HANDLER_WORK = 0.002  # имитация работы хендлера (await к БД и т.п.)
+
+
+def make_dispatcher(latencies: list, sent_at: dict) -> Dispatcher:
+    dp = Dispatcher()
+
+    @dp.message()
+    async def handler(message: Message, event_update: Update):
+        latencies.append(time.perf_counter() - sent_at.pop(event_update.update_id))
+        await asyncio.sleep(HANDLER_WORK)
+
+    return dp
+
+
+async def produce(fake: FakeTelegram, count: int, rate: float, sent_at: dict, deliver):
+    tasks = []
+    for i in range(count):
+        update = fake.message_update(1000 + i % 500, "ping")
+        sent_at[update["update_id"]] = time.perf_counter()
+        tasks.append(asyncio.create_task(deliver(update)))
+        await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+
+
+async def wait_handled(sent_at: dict, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while sent_at and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def run_polling(count: int, rate: float, rtt: float) -> list:
+    fake = FakeTelegram(rtt=rtt)
+    await fake.start()
+    latencies, sent_at = [], {}
+    dp = make_dispatcher(latencies, sent_at)
+    bot = fake.make_bot()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+    await asyncio.sleep(0.2)
+    await produce(fake, count, rate, sent_at, fake.push_update)
+    await wait_handled(sent_at)
+    await dp.stop_polling()
+    await polling
+    await fake.stop()
+    return latencies
+
+
+async def run_webhook(count: int, rate: float, rtt: float) -> list:
+    fake = FakeTelegram(rtt=rtt)
+    await fake.start()
+    latencies, sent_at = [], {}
+    dp = make_dispatcher(latencies, sent_at)
+    bot = fake.make_bot()
+    runner = web.AppRunner(build_app(dp, bot, path="/webhook", secret=WEBHOOK_SECRET, max_concurrent=100))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", WEBHOOK_PORT).start()
+    await bot.set_webhook(f"http://127.0.0.1:{WEBHOOK_PORT}/webhook", secret_token=WEBHOOK_SECRET)
+    await produce(fake, count, rate, sent_at, fake.post_update)
+    await wait_handled(sent_at)
+    await runner.cleanup()
+    await fake.stop()
+    return latencies
+
+
+def report(name: str, latencies: list):
+    ms = sorted(x * 1000 for x in latencies)
+    q = statistics.quantiles(ms, n=100)
+    print(f"{name:>8}: n={len(ms)}  p50={q[49]:.1f} ms  p95={q[94]:.1f} ms  p99={q[98]:.1f} ms  max={ms[-1]:.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=200, help="обновлений в секунду")
+    parser.add_argument("--rtt", type=float, default=0.05, help="сетевая задержка до Telegram, сек")
+    args = parser.parse_args()
+
+    print(f"{args.updates} обновлений, {args.rate:.0f}/с, RTT {args.rtt * 1000:.0f} мс")
+    report("polling", await run_polling(args.updates, args.rate, args.rtt))
+    report("webhook", await run_webhook(args.updates, args.rate, args.rtt))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+# Бенчмарк пропускной способности режима нескольких процессов (WORKERS=1/2/4).
+#
+# Ingress забирает обновления через getUpdates у benchmarks/fake_telegram.py и
+# раздаёт их воркерам по user id. Нагрузка — смесь клиентов, открывающих категории
+# меню, и админов, открывающих "Все заказы" (первая страница из тысяч заказов).
+# Каждое обновление заканчивается одним editMessageText — по ним считаем готовность.
+#
+# Запуск: python benchmarks/bench_workers.py [--updates 2000] [--workers 1 2 4]
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# setdefault: воркеры (spawn) импортируют этот модуль заново и должны получить те же значения
+os.environ.setdefault("DB_FILE_PATH", os.path.join(tempfile.mkdtemp(prefix="sd_bot_bench_"), "bench.db"))
+os.environ.setdefault("FAKE_TELEGRAM_URL", "http://127.0.0.1:8083")
+os.environ.setdefault("TOKEN", "42:FAKE")
+
+ADMINS = list(range(900000, 900010))
+os.environ.setdefault("ADMIN_IDS", ",".join(map(str, ADMINS)))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+
+from callbacks import CategoryCallback  # noqa: E402
+from fake_telegram import BOT_TOKEN, FakeTelegram  # noqa: E402
+
+CUSTOMERS = list(range(1000, 1500))
+ADMIN_SHARE = 0.1
+ORDERS = 3000
+
+
+def create_bot() -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(os.environ["FAKE_TELEGRAM_URL"]))
+    return Bot(BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+
+
+def create_dispatcher(background_jobs: bool = True):
+    from bot import create_dispatcher as create
+    return create(background_jobs)
+
+
+def seed() -> list[int]:
+    import db
+    db.init_db()
+    db.migrate_db()
+    categories = []
+    for c in range(6):
+        name = f"Категория {c + 1}"
+        category_id = db.add_category.sync(name)
+        for d in range(12):
+            db.add_dish.sync(category_id, f"Блюдо {c + 1}.{d + 1}", str(200 + d * 10), "Описание блюда, 300 гр.")
+        categories.append(category_id)
+    items = [
+        {"category": "Супы", "name": "Борщ", "qty": 2, "price": 250, "is_promo": False},
+        {"category": "Горячее", "name": "Плов", "qty": 1, "price": 350, "is_promo": False},
+    ]
+    for i in range(ORDERS):
+        db.append_order.sync(items, "79000000000", "delivery", "ул. Тестовая, 1", user_id=str(CUSTOMERS[i % len(CUSTOMERS)]))
+    return categories
+
+
+def make_updates(fake: FakeTelegram, count: int, categories: list[int]) -> list[dict]:
+    rng = random.Random(1)
+    updates = []
+    for _ in range(count):
+        if rng.random() < ADMIN_SHARE:
+            updates.append(fake.callback_update(rng.choice(ADMINS), "orders_filter_all"))
+        else:
+            updates.append(fake.callback_update(rng.choice(CUSTOMERS), CategoryCallback(category_id=rng.choice(categories)).pack()))
+    return updates
+
+
+async def wait_edits(edits: list, expected: int, timeout: float = 300):
+    deadline = time.monotonic() + timeout
+    while edits[0] < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def run(fake: FakeTelegram, workers: int, count: int, categories: list[int]) -> float:
+    from workers import Ingress, _poll_updates
+
+    edits = [0]
+    fake.on_call = lambda method, params: edits.__setitem__(0, edits[0] + (method == "editmessagetext"))
+
+    ingress = Ingress(workers, create_bot, create_dispatcher)
+    ingress.start()
+    bot = create_bot()
+    stop = asyncio.Event()
+    poller = asyncio.create_task(_poll_updates(bot, ingress, ["callback_query"], stop))
+
+    # Прогрев: по одному обновлению на каждый воркер (user id % workers)
+    for uid in range(CUSTOMERS[0], CUSTOMERS[0] + workers):
+        await fake.push_update(fake.callback_update(uid, CategoryCallback(category_id=categories[0]).pack()))
+    await wait_edits(edits, workers)
+
+    edits[0] = 0
+    updates = make_updates(fake, count, categories)
+    started = time.perf_counter()
+    for update in updates:
+        await fake.push_update(update)
+    await wait_edits(edits, count)
+    elapsed = time.perf_counter() - started
+
+    poller.cancel()
+    await asyncio.gather(poller, return_exceptions=True)
+    await asyncio.to_thread(ingress.stop)
+    await bot.session.close()
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    categories = seed()
+    port = int(os.environ["FAKE_TELEGRAM_URL"].rsplit(":", 1)[1])
+    fake = FakeTelegram(port=port)
+    await fake.start()
+
+    print(f"{args.updates} обновлений, {ADMIN_SHARE:.0%} — админ смотрит {ORDERS} заказов, CPU: {os.cpu_count()}")
+    for workers in args.workers:
+        elapsed = await run(fake, workers, args.updates, categories)
+        print(f"WORKERS={workers}: {elapsed:.2f} с, {args.updates / elapsed:.0f} обновлений/с")
+
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,174 @@
+# Фейковый Telegram Bot API для локальных бенчмарков и нагрузочных тестов.
+#
+# Поднимает aiohttp-сервер, который отвечает на методы Bot API так, чтобы
+# aiogram считал их успешными: getUpdates (long polling из очереди),
+# sendMessage / editMessageText / sendPhoto и т.п. возвращают правдоподобный
+# Message, остальные методы — True. Обновления можно отдавать через getUpdates
+# или отправлять POST-запросом на вебхук бота (с секретным токеном).
+#
+# rtt — имитация сетевой задержки до Telegram: половина на запрос, половина на ответ.
+import asyncio
+import itertools
+import json
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import ClientSession, web
+
+BOT_TOKEN = "42:FAKE"
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+MESSAGE_METHODS = {"sendmessage", "editmessagetext", "sendphoto", "senddocument", "editmessagecaption"}
+
+
+class FakeTelegram:
+    def __init__(self, rtt: float = 0.0, host: str = "127.0.0.1", port: int = 8081):
+        self.rtt = rtt
+        self.host = host
+        self.port = port
+        self.calls: list[tuple[str, dict, float]] = []   # (метод, параметры, время ответа)
+        self.on_call = None                              # колбэк (метод, параметры) для бенчмарков
+        self.webhook_url: str | None = None
+        self.webhook_secret: str | None = None
+        self._updates: list[dict] = []
+        self._new_update = asyncio.Condition()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(100000)
+        self._runner: web.AppRunner | None = None
+        self._client: ClientSession | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def make_bot(self, **kwargs) -> Bot:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.base_url))
+        return Bot(BOT_TOKEN, session=session, **kwargs)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._client = ClientSession()
+
+    async def stop(self):
+        if self._client:
+            await self._client.close()
+        if self._runner:
+            await self._runner.cleanup()
+
+    # --- Обновления ---
+
+    def message_update(self, user_id: int, text: str) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "User", "username": f"user{user_id}"},
+                "text": text,
+            },
+        }
+
+    def contact_update(self, user_id: int, phone: str) -> dict:
+        # Пользователь поделился своим номером (кнопка request_contact)
+        update = self.message_update(user_id, "")
+        message = update["message"]
+        del message["text"]
+        message["contact"] = {"phone_number": phone, "first_name": "User", "user_id": user_id}
+        return update
+
+    def callback_update(self, user_id: int, data: str, message_id: int = 1) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "chat_instance": str(user_id),
+                "data": data,
+                "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "…",
+                },
+            },
+        }
+
+    async def push_update(self, update: dict):
+        # Для getUpdates: обновление ждёт, пока бот его заберёт
+        async with self._new_update:
+            self._updates.append(update)
+            self._new_update.notify_all()
+
+    async def post_update(self, update: dict) -> int:
+        # Для вебхука: Telegram сам отправляет обновление на адрес бота
+        await asyncio.sleep(self.rtt / 2)
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret} if self.webhook_secret else {}
+        async with self._client.post(self.webhook_url, json=update, headers=headers) as response:
+            await response.read()
+            return response.status
+
+    # --- Bot API ---
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.rtt / 2)
+        method = request.match_info["method"].lower()
+        try:
+            params = dict(await request.post())
+        except ConnectionResetError:
+            return web.Response(status=499)  # бот закрыл соединение (остановка polling)
+        if method == "getupdates":
+            result = await self._get_updates(params)
+        else:
+            result = self._call(method, params)
+        self.calls.append((method, params, time.perf_counter()))
+        if self.on_call:
+            self.on_call(method, params)
+        await asyncio.sleep(self.rtt / 2)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            async with self._new_update:
+                try:
+                    await asyncio.wait_for(self._new_update.wait_for(lambda: self._updates), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return self._updates[:limit]
+
+    def _call(self, method: str, params: dict):
+        if method == "getme":
+            return BOT_USER
+        if method == "setwebhook":
+            self.webhook_url = params.get("url")
+            self.webhook_secret = params.get("secret_token")
+            return True
+        if method == "deletewebhook":
+            self.webhook_url = None
+            return True
+        if method in MESSAGE_METHODS:
+            chat_id = int(params.get("chat_id") or 0)
+            message = {
+                "message_id": int(params.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                message["text"] = params["text"]
+            markup = json.loads(params.get("reply_markup") or "{}")
+            if "inline_keyboard" in markup:
+                message["reply_markup"] = markup
+            return message
+        return True
@@ -1,27 +1,75 @@
 import asyncio
+import logging
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 
-from config import TOKEN
+from config import TOKEN, BOT_MODE, WORKERS, ADMIN_IDS
 from handlers_user import router as user_router
 from handlers_admin import router as admin_router
-from db import init_db, migrate_db
+from db import init_db, migrate_db, close_db
+from fsm_storage import SQLiteStorage
+from broadcast import resume_broadcasts, stop_broadcasts
+from notifications import stop_notifications
+from message_cleanup import stop_cleanup
+from metrics import setup_metrics
+from logs import setup_logging, stop_logging, setup_log_context
+from profiler import setup_profiler
+from throttling import setup_throttling
+from webhook import run_webhook
+from workers import run_ingress
+
+logger = logging.getLogger(__name__)
 
 init_db()
 
-async def main():
-    bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-    
-    dp = Dispatcher()
+
+def create_bot() -> Bot:
+    return Bot(token=TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
+
+
+def create_dispatcher(background_jobs: bool = True) -> Dispatcher:
+    # background_jobs=False — для дополнительных воркеров: прерванные рассылки
+    # продолжает только один процесс
+    dp = Dispatcher(storage=SQLiteStorage())
+    setup_log_context(dp)
+    setup_profiler(dp)
+    setup_metrics(dp)
+    setup_throttling(dp)
 
     dp.include_router(user_router)
     dp.include_router(admin_router)
 
+    if background_jobs:
+        dp.startup.register(resume_broadcasts)
+    dp.shutdown.register(stop_broadcasts)
+    dp.shutdown.register(stop_notifications)
+    dp.shutdown.register(stop_cleanup)
+    return dp
+
+
+async def main():
+    setup_logging()
+    logger.info("Запуск: режим %s, воркеров %d, администраторов %d", BOT_MODE, WORKERS, len(ADMIN_IDS))
     migrate_db()
 
-    await dp.start_polling(bot)
+    try:
+        if WORKERS > 1:
+            await run_ingress(WORKERS, create_bot, create_dispatcher)
+            return
+
+        bot = create_bot()
+        dp = create_dispatcher()
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # getUpdates не работает, пока установлен вебхук (например, после запуска в режиме webhook)
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        close_db()
+        stop_logging()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from db import create_broadcast, get_unfinished_broadcasts, get_broadcast_recipients, update_broadcast
+
+logger = logging.getLogger(__name__)
+
+# Telegram допускает ~30 сообщений в секунду в разные чаты — держимся чуть ниже
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_CHUNK = 100          # получателей между сохранениями прогресса
+BROADCAST_MAX_ATTEMPTS = 4
+PROGRESS_EDIT_INTERVAL = 3     # секунд между обновлениями сообщения о прогрессе
+FAILURE_LOG_SAMPLE = 0.1       # доля недоставленных сообщений, попадающих в лог
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        # RetryAfter касается всего бота — останавливаем всех отправителей
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+_limiter = TokenBucket(BROADCAST_RATE, BROADCAST_RATE)
+_running: dict[int, asyncio.Task] = {}
+
+
+async def _deliver(bot: Bot, job: dict, user_id: str) -> bool:
+    for attempt in range(BROADCAST_MAX_ATTEMPTS):
+        await _limiter.acquire()
+        try:
+            if job["photo"]:
+                await bot.send_photo(int(user_id), photo=job["photo"], caption=job["text"] or None)
+            else:
+                await bot.send_message(int(user_id), job["text"])
+            return True
+        except TelegramRetryAfter as e:
+            _limiter.pause(e.retry_after)
+        except (TelegramNetworkError, TelegramServerError):
+            await asyncio.sleep(2 ** attempt)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Пользователь заблокировал бота или чат недоступен — повтор не поможет
+            logger.info("Ошибка отправки пользователю %s: %s", user_id, e,
+                        extra={"broadcast_id": job["id"], "sample": FAILURE_LOG_SAMPLE})
+            return False
+    logger.warning("Не удалось отправить пользователю %s после %d попыток", user_id, BROADCAST_MAX_ATTEMPTS,
+                   extra={"broadcast_id": job["id"]})
+    return False
+
+
+def _progress_text(job: dict, finished: bool = False) -> str:
+    done = job["sent"] + job["failed"]
+    header = "✅ Рассылка завершена" if finished else "📤 Идёт рассылка"
+    return f"{header}: {done}/{job['total']}\nДоставлено: {job['sent']}, ошибок: {job['failed']}"
+
+
+async def _show_progress(bot: Bot, job: dict, finished: bool = False):
+    if not job["progress_message_id"]:
+        return
+    try:
+        await bot.edit_message_text(_progress_text(job, finished), chat_id=job["admin_chat_id"],
+                                    message_id=job["progress_message_id"])
+    except TelegramBadRequest:
+        pass  # текст не изменился или сообщение удалено
+
+
+async def _run(bot: Bot, job: dict):
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def send_one(user_id: str) -> bool:
+        async with semaphore:
+            return await _deliver(bot, job, user_id)
+
+    last_edit = time.monotonic()
+    try:
+        while True:
+            recipients = await get_broadcast_recipients(job["last_rowid"], BROADCAST_CHUNK)
+            if not recipients:
+                break
+            results = await asyncio.gather(*(send_one(user_id) for _, user_id in recipients))
+            job["sent"] += sum(results)
+            job["failed"] += len(results) - sum(results)
+            job["last_rowid"] = recipients[-1][0]
+            # Прогресс сохраняется по пачкам: после перезапуска повторится максимум одна пачка
+            await update_broadcast(job["id"], last_rowid=job["last_rowid"], sent=job["sent"], failed=job["failed"])
+            if time.monotonic() - last_edit >= PROGRESS_EDIT_INTERVAL:
+                await _show_progress(bot, job)
+                last_edit = time.monotonic()
+
+        await update_broadcast(job["id"], status="done")
+        await _show_progress(bot, job, finished=True)
+    finally:
+        _running.pop(job["id"], None)
+
+
+def _start(bot: Bot, job: dict):
+    _running[job["id"]] = asyncio.create_task(_run(bot, job))
+
+
+async def start_broadcast(bot: Bot, admin_chat_id: int, text: str, photo: str | None = None) -> dict:
+    job = await create_broadcast(text, photo, admin_chat_id)
+    progress = await bot.send_message(admin_chat_id, _progress_text(job))
+    job["progress_message_id"] = progress.message_id
+    await update_broadcast(job["id"], progress_message_id=progress.message_id)
+    _start(bot, job)
+    return job
+
+
+async def resume_broadcasts(bot: Bot):
+    # Вызывается при старте бота: продолжаем рассылки, прерванные перезапуском
+    for job in await get_unfinished_broadcasts():
+        if job["id"] not in _running:
+            logger.info("Продолжаем рассылку #%s с позиции %d/%d", job["id"], job["sent"] + job["failed"], job["total"])
+            _start(bot, job)
+
+
+async def stop_broadcasts():
+    # При остановке бота: прогресс уже сохранён по пачкам, продолжим после запуска
+    tasks = list(_running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,47 @@
+from aiogram.filters.callback_data import CallbackData
+
+# Компактные callback_data: короткий префикс и числовые id вместо названий.
+# Telegram ограничивает callback_data 64 байтами, а кириллица занимает
+# по 2 байта на символ — названия категорий и адреса туда не помещаются.
+
+
+# Пользователь
+
+class CategoryCallback(CallbackData, prefix="c"):
+    category_id: int
+
+
+class DishCallback(CallbackData, prefix="d"):
+    item_id: int
+
+
+class AddressCallback(CallbackData, prefix="a"):
+    index: int  # позиция в списке сохранённых адресов пользователя
+
+
+# Админ
+
+class AdminCategoryCallback(CallbackData, prefix="ac"):
+    action: str       # "del", "add_dish" или "del_dish"
+    category_id: int  # 0 — «Новая категория» (только для add_dish)
+
+
+class PromoCallback(CallbackData, prefix="p"):
+    action: str  # "view", "stats" или "del"
+    promo_id: int
+
+
+class PromoCategoryCallback(CallbackData, prefix="pc"):
+    category_id: int
+
+
+class PromoItemCallback(CallbackData, prefix="pi"):
+    item_id: int
+
+
+class OrdersPageCallback(CallbackData, prefix="op"):
+    page: int
+
+
+class StatsCallback(CallbackData, prefix="st"):
+    period: str  # ключ из STATS_PERIODS
@@ -0,0 +1,141 @@
+from db import read_menu, lookup_menu_item
+
+# Корзина в FSM хранится компактно: {"<id блюда>": {"qty": 2, "price": 250}}.
+# Цена запоминается при первом добавлении, названия и описания берутся
+# из снимка меню при отрисовке. Бесплатная позиция по промокоду хранится
+# отдельно — в promo_item_id.
+#
+# Рядом с корзиной лежат готовые итоги: cart_subtotal (сумма позиций),
+# promo_discount (скидка по промокоду) и delivery_cost (стоимость доставки
+# при таком заказе). Они обновляются при каждом изменении корзины или
+# промокода, поэтому экраны корзины и оформления не пересчитывают корзину
+# заново и не могут разойтись в суммах.
+
+# Стоимость доставки
+FREE_DELIVERY_MIN = 1500
+DELIVERY_COST = 250
+
+
+def get_cart(data: dict) -> dict:
+    cart = data.get("cart") or {}
+    if isinstance(cart, list):
+        # Старый формат — список полных копий блюд
+        compact = {}
+        for item in cart:
+            if item.get("is_promo") or "id" not in item:
+                continue
+            entry = compact.setdefault(str(item["id"]), {"qty": 0, "price": int(item["price"])})
+            entry["qty"] += 1
+        return compact
+    return cart
+
+
+def add_item(cart: dict, item: dict) -> dict:
+    cart = dict(cart)
+    key = str(item["id"])
+    entry = cart.get(key)
+    if entry:
+        cart[key] = {"qty": entry["qty"] + 1, "price": entry["price"]}
+    else:
+        cart[key] = {"qty": 1, "price": int(item["price"])}
+    return cart
+
+
+def delivery_cost_for(subtotal: int, discount: int = 0) -> int:
+    return 0 if subtotal - discount >= FREE_DELIVERY_MIN else DELIVERY_COST
+
+
+def _totals(subtotal: int, discount: int) -> dict:
+    return {"cart_subtotal": subtotal, "delivery_cost": delivery_cost_for(subtotal, discount)}
+
+
+def cart_subtotal(data: dict) -> int:
+    subtotal = data.get("cart_subtotal")
+    if subtotal is None:
+        # Состояние, сохранённое до появления итогов в FSM
+        subtotal = sum(entry["qty"] * entry["price"] for entry in get_cart(data).values())
+    return subtotal
+
+
+def cart_totals(data: dict) -> dict:
+    # Итоги корзины из FSM — без прохода по позициям
+    subtotal = cart_subtotal(data)
+    discount = data.get("promo_discount") or 0
+    if "cart_subtotal" in data:
+        delivery_cost = data.get("delivery_cost", DELIVERY_COST)
+    else:
+        delivery_cost = delivery_cost_for(subtotal, discount)
+    return {
+        "subtotal": subtotal,
+        "discount": discount,
+        "delivery_cost": delivery_cost,
+        "total": subtotal - discount + delivery_cost,
+    }
+
+
+def empty_cart() -> dict:
+    # Поля FSM для пустой корзины без промокода
+    return {"cart": {}, "applied_promo": None, "promo_discount": 0, "promo_item_id": None, **_totals(0, 0)}
+
+
+def with_item(data: dict, item: dict) -> dict:
+    # Поля FSM после добавления блюда: итог сдвигается на цену одной позиции
+    cart = add_item(get_cart(data), item)
+    subtotal = cart_subtotal(data) + cart[str(item["id"])]["price"]
+    return {"cart": cart, **_totals(subtotal, data.get("promo_discount") or 0)}
+
+
+def with_discount(data: dict, discount: int) -> dict:
+    return {"promo_discount": discount, **_totals(cart_subtotal(data), discount)}
+
+
+def cart_count(cart: dict) -> int:
+    return sum(entry["qty"] for entry in cart.values())
+
+
+async def cart_lines(cart: dict, promo_item_id: int | None = None) -> list[dict]:
+    # Позиции корзины с названиями из меню; удалённые из меню блюда пропускаются
+    await read_menu()  # снимок меню должен быть загружен
+    lines = []
+    for key, entry in cart.items():
+        found = lookup_menu_item(int(key))
+        if not found:
+            continue
+        category, item = found
+        lines.append({
+            "id": int(key),
+            "category": category,
+            "name": item["name"],
+            "desc": item["desc"],
+            "qty": entry["qty"],
+            "price": entry["price"],
+            "is_promo": False
+        })
+    if promo_item_id:
+        found = lookup_menu_item(promo_item_id)
+        if found:
+            item = found[1]
+            lines.append({
+                "id": promo_item_id,
+                "category": "Промо",
+                "name": item["name"],
+                "desc": item["desc"],
+                "qty": 1,
+                "price": 0,
+                "is_promo": True
+            })
+    return lines
+
+
+async def load_cart(data: dict) -> tuple[list[dict], dict]:
+    # Позиции корзины и поля FSM, которые нужно сохранить. Полный пересчёт
+    # итогов — только если их ещё нет в состоянии или блюдо удалили из меню
+    cart = get_cart(data)
+    lines = await cart_lines(cart, data.get("promo_item_id"))
+    kept = {str(line["id"]) for line in lines if not line["is_promo"]}
+    if "cart_subtotal" in data and len(kept) == len(cart):
+        return lines, {}
+    cart = {key: entry for key, entry in cart.items() if key in kept}
+    subtotal = sum(entry["qty"] * entry["price"] for entry in cart.values())
+    return lines, {"cart": cart, **_totals(subtotal, data.get("promo_discount") or 0)}
+
@@ -9,7 +9,40 @@ TOKEN = os.getenv("TOKEN")
 # Парсим ADMIN_IDS из строки в список int
 ADMIN_IDS_STR = os.getenv("ADMIN_IDS", "")
 ADMIN_IDS: List[int] = [int(x.strip()) for x in ADMIN_IDS_STR.split(",") if x.strip()]
-print(ADMIN_IDS)
 
-WELCOME_PHOTO_PATH = "png/logo.jpg"  
-    
\ No newline at end of file
+WELCOME_PHOTO_PATH = "png/logo.jpg"
+
+# Режим получения обновлений: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Webhook: Telegram шлёт обновления на WEBHOOK_URL + WEBHOOK_PATH,
+# встроенный aiohttp-сервер слушает WEBAPP_HOST:WEBAPP_PORT (обычно за nginx)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "100"))
+
+# Количество процессов-обработчиков. При WORKERS > 1 главный процесс только
+# принимает обновления (polling или webhook) и раздаёт их воркерам по user id
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics
+# (у воркера N — порт METRICS_PORT + N). METRICS_PORT=0 — без HTTP-эндпоинта
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Логи: LOG_LEVEL — DEBUG/INFO/WARNING/ERROR, LOG_FORMAT — "json" (по умолчанию) или
+# "text" для чтения глазами. LOG_UPDATE_SAMPLE — доля записей aiogram об обработке
+# каждого обновления, попадающих в лог (ошибки пишутся всегда)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_UPDATE_SAMPLE = float(os.getenv("LOG_UPDATE_SAMPLE", "0.01"))
+
+# Ограничение частоты действий пользователя (token bucket): сообщений/нажатий
+# в секунду и запас для коротких серий. Лимиты отдельных хендлеров — в throttling.py
+THROTTLE_MESSAGE_RATE = float(os.getenv("THROTTLE_MESSAGE_RATE", "1"))
+THROTTLE_MESSAGE_BURST = int(os.getenv("THROTTLE_MESSAGE_BURST", "5"))
+THROTTLE_CALLBACK_RATE = float(os.getenv("THROTTLE_CALLBACK_RATE", "2"))
+THROTTLE_CALLBACK_BURST = int(os.getenv("THROTTLE_CALLBACK_BURST", "8"))
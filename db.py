@@ -1,15 +1,103 @@
 import sqlite3
 import datetime
 import os
+import csv
 import json
+import logging
+import asyncio
+import functools
+import threading
+import time
+import pathlib
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from order_format import render_order, items_subtotal, parse_order_text
+from metrics import observe_db, register_gauges
+
+logger = logging.getLogger(__name__)
 
 DB_FILE = os.getenv("DB_FILE_PATH", "bot.db")
 
 # Часовой пояс ресторана: UTC+8 (Иркутск)
 LOCAL_TZ_OFFSET = datetime.timedelta(hours=8)
 
+# Формат orders.timestamp (UTC), совпадает с datetime('now') в SQLite
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Все запросы выполняются в одном выделенном потоке через одно долгоживущее
+# соединение: event loop aiogram не блокируется, а SQLite не ловит
+# "database is locked" от конкурирующих соединений внутри процесса.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+_conn = None
+_conn_lock = threading.Lock()
+
+
+def get_connection() -> sqlite3.Connection:
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            # cached_statements — кэш подготовленных выражений sqlite3 на соединение
+            _conn = sqlite3.connect(DB_FILE, check_same_thread=False, cached_statements=256)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=NORMAL")
+            _conn.execute("PRAGMA busy_timeout=5000")
+        return _conn
+
+
+def timed(query: bool = False):
+    # Время каждого вызова корутины db.py — в метрики. query=True — вызов идёт в БД
+    # и учитывается в числе запросов хендлера; False — обёртки над кэшами.
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            failed = False
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                observe_db(func.__name__, time.perf_counter() - started, failed, query)
+        return wrapper
+    return decorator
+
+
+def db_call(func):
+    # Превращает синхронную функцию работы с БД в корутину, выполняемую в потоке БД.
+    # Исходная функция доступна как .sync (для миграций и бенчмарков).
+    # Время вызова в метриках включает ожидание очереди потока БД.
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(_run_safely, func, args, kwargs))
+
+    wrapper.sync = func
+    return timed(query=True)(wrapper)
+
+
+def _run_safely(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        # Соединение общее — нельзя оставлять его в недописанной транзакции
+        if _conn is not None and _conn.in_transaction:
+            _conn.rollback()
+        raise
+
+
+def close_db():
+    global _conn
+    _executor.shutdown(wait=True)
+    with _conn_lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cur = conn.cursor()
 
     cur.execute('''CREATE TABLE IF NOT EXISTS users
@@ -42,6 +130,55 @@ def init_db():
     if not column_exists('orders', 'cash_amount'):
         cur.execute("ALTER TABLE orders ADD COLUMN cash_amount INTEGER")
 
+    # Промокод и суммы заказа — чтобы отрисовывать и считать заказ без разбора order_text
+    if not column_exists('orders', 'promo_code'):
+        cur.execute("ALTER TABLE orders ADD COLUMN promo_code TEXT")
+
+    if not column_exists('orders', 'discount'):
+        cur.execute("ALTER TABLE orders ADD COLUMN discount INTEGER DEFAULT 0")
+
+    if not column_exists('orders', 'total'):
+        cur.execute("ALTER TABLE orders ADD COLUMN total INTEGER")
+
+    # Состав заказа: название, категория и цена — на момент заказа
+    cur.execute('''CREATE TABLE IF NOT EXISTS order_items
+                   (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    order_id INTEGER NOT NULL,
+                    menu_item_id INTEGER,
+                    category TEXT,
+                    name TEXT,
+                    price INTEGER,
+                    quantity INTEGER,
+                    is_promo INTEGER DEFAULT 0,
+                    FOREIGN KEY (order_id) REFERENCES orders (id))''')
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)")
+
+    # Аналитика: итоги по местным суткам, обновляются вместе с каждым заказом.
+    # Отчёты за любой период читают только эти таблицы, а не заказы.
+    cur.execute('''CREATE TABLE IF NOT EXISTS daily_sales
+                   (day TEXT PRIMARY KEY,                -- местная дата ГГГГ-ММ-ДД
+                    orders INTEGER DEFAULT 0,
+                    revenue INTEGER DEFAULT 0,           -- к оплате: позиции - скидка + доставка
+                    items_revenue INTEGER DEFAULT 0,
+                    delivery_revenue INTEGER DEFAULT 0,
+                    discount INTEGER DEFAULT 0,
+                    delivery_orders INTEGER DEFAULT 0,
+                    pickup_orders INTEGER DEFAULT 0,
+                    promo_orders INTEGER DEFAULT 0)''')
+    cur.execute('''CREATE TABLE IF NOT EXISTS daily_dish_sales
+                   (day TEXT,
+                    name TEXT,
+                    quantity INTEGER DEFAULT 0,          -- все порции, включая бесплатные
+                    free_quantity INTEGER DEFAULT 0,     -- бесплатные по промокоду
+                    revenue INTEGER DEFAULT 0,
+                    PRIMARY KEY (day, name))''')
+    cur.execute('''CREATE TABLE IF NOT EXISTS daily_promo_usage
+                   (day TEXT,
+                    promo_code TEXT,
+                    uses INTEGER DEFAULT 0,
+                    discount INTEGER DEFAULT 0,
+                    PRIMARY KEY (day, promo_code))''')
+
     if not column_exists('users', 'addresses'):
         cur.execute("ALTER TABLE users ADD COLUMN addresses TEXT DEFAULT '[]'")
 
@@ -56,6 +193,15 @@ def init_db():
                     price TEXT,
                     desc TEXT,
                     FOREIGN KEY (category_id) REFERENCES categories (id))''')
+
+    # Порядок отображения: позволяет переставлять категории и блюда без смены id
+    if not column_exists('categories', 'position'):
+        cur.execute("ALTER TABLE categories ADD COLUMN position INTEGER DEFAULT 0")
+
+    if not column_exists('menu_items', 'position'):
+        cur.execute("ALTER TABLE menu_items ADD COLUMN position INTEGER DEFAULT 0")
+
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_menu_items_category ON menu_items (category_id, position)")
     
     # Новое: таблица промокодов
     cur.execute('''CREATE TABLE IF NOT EXISTS promos
@@ -76,34 +222,116 @@ def init_db():
                     order_id INTEGER,
                     FOREIGN KEY (order_id) REFERENCES orders (id))''')
 
+    # Состояния FSM (корзина, шаг оформления) — переживают перезапуск контейнера
+    cur.execute('''CREATE TABLE IF NOT EXISTS fsm_storage
+                   (key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT,
+                    updated_at REAL)''')
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage (updated_at)")
+
+    # Рассылки: last_rowid — докуда по users.rowid дошли, чтобы продолжить после перезапуска
+    cur.execute('''CREATE TABLE IF NOT EXISTS broadcasts
+                   (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT,
+                    photo TEXT,
+                    admin_chat_id INTEGER,
+                    progress_message_id INTEGER,
+                    status TEXT DEFAULT 'running',
+                    total INTEGER DEFAULT 0,
+                    last_rowid INTEGER DEFAULT 0,
+                    sent INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    created_at DATETIME)''')
+
+    # Служебные счётчики, общие для всех процессов бота (версия меню и т.п.)
+    cur.execute('''CREATE TABLE IF NOT EXISTS meta
+                   (key TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)''')
+    cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('menu_version', 0)")
+    cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('orders_version', 0)")
+
     conn.commit()
-    conn.close()
 
 
-def get_user_addresses(user_id: str):
-    conn = sqlite3.connect(DB_FILE)
+# Небольшой LRU-кэш профилей по Telegram id с TTL. Кэшируется и отсутствие
+# профиля (None), поэтому /start нового пользователя не ходит в БД дважды.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "2048"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))  # секунд
+
+_user_cache = OrderedDict()  # user_id -> (expires_at, profile)
+_user_cache_hits = 0
+_user_cache_misses = 0
+
+
+@db_call
+def _fetch_user(user_id: str):
+    conn = get_connection()
     cur = conn.cursor()
-    cur.execute("SELECT addresses FROM users WHERE user_id = ?", (user_id,))
+    cur.execute("SELECT phone, addresses FROM users WHERE user_id = ?", (user_id,))
     row = cur.fetchone()
-    conn.close()
-    if row and row[0]:
-        return json.loads(row[0])
-    return []
+    if not row:
+        return None
+    return {
+        "user_id": user_id,
+        "phone": row[0],
+        "addresses": json.loads(row[1]) if row[1] else []
+    }
+
+
+@timed()
+async def get_user(user_id: str):
+    # Профиль общий для всех вызывающих — изменять его нельзя
+    global _user_cache_hits, _user_cache_misses
+    now = time.monotonic()
+    entry = _user_cache.get(user_id)
+    if entry and entry[0] > now:
+        _user_cache.move_to_end(user_id)
+        _user_cache_hits += 1
+        return entry[1]
+
+    _user_cache_misses += 1
+    profile = await _fetch_user(user_id)
+    _user_cache[user_id] = (now + USER_CACHE_TTL, profile)
+    _user_cache.move_to_end(user_id)
+    while len(_user_cache) > USER_CACHE_SIZE:
+        _user_cache.popitem(last=False)
+    return profile
+
+
+def user_cache_stats() -> dict:
+    return {"hits": _user_cache_hits, "misses": _user_cache_misses, "size": len(_user_cache)}
 
 
-def save_user_phone(user_id: str, phone: str):
-    conn = sqlite3.connect(DB_FILE)
+register_gauges("user_cache", user_cache_stats)
+
+
+@timed()
+async def get_user_addresses(user_id: str):
+    user = await get_user(user_id)
+    return list(user["addresses"]) if user else []
+
+
+@db_call
+def _save_user_phone(user_id: str, phone: str):
+    conn = get_connection()
     cur = conn.cursor()
     cur.execute("""
         INSERT INTO users (user_id, phone) VALUES (?, ?)
         ON CONFLICT(user_id) DO UPDATE SET phone = excluded.phone
     """, (user_id, phone))
     conn.commit()
-    conn.close()
 
 
-def save_user_addresses(user_id: str, addresses: list):
-    conn = sqlite3.connect(DB_FILE)
+@timed()
+async def save_user_phone(user_id: str, phone: str):
+    await _save_user_phone(user_id, phone)
+    # Сбрасываем после записи: чтение, запущенное до неё, завершится раньше
+    _user_cache.pop(user_id, None)
+
+
+@db_call
+def _save_user_addresses(user_id: str, addresses: list):
+    conn = get_connection()
     cur = conn.cursor()
     addresses_json = json.dumps(addresses, ensure_ascii=False)
     cur.execute("""
@@ -111,131 +339,451 @@ def save_user_addresses(user_id: str, addresses: list):
         ON CONFLICT(user_id) DO UPDATE SET addresses = excluded.addresses
     """, (user_id, addresses_json))
     conn.commit()
-    conn.close()
 
 
-def read_menu():
-    conn = sqlite3.connect(DB_FILE)
+@timed()
+async def save_user_addresses(user_id: str, addresses: list):
+    await _save_user_addresses(user_id, addresses)
+    _user_cache.pop(user_id, None)
+
+
+# Снимок меню в памяти процесса. Строится одним запросом при первом обращении
+# и пересобирается в потоке БД сразу после коммита любого изменения меню,
+# поэтому просмотр меню не ходит в БД. Снимок общий — изменять его нельзя.
+# Меню могут менять и другие процессы (WORKERS > 1): каждое изменение
+# увеличивает meta.menu_version, и не чаще раза в MENU_REVALIDATE_INTERVAL
+# секунд снимок сверяется с этой версией.
+MENU_REVALIDATE_INTERVAL = float(os.getenv("MENU_REVALIDATE_INTERVAL", "1"))
+
+_menu_snapshot = None
+_menu_index = {}
+_menu_categories = {}
+_menu_version = 0
+_menu_db_version = None   # meta.menu_version, из которой собран снимок
+_menu_checked_at = 0.0
+
+
+def _fetch_menu(conn):
     cur = conn.cursor()
+    cur.execute("""
+        SELECT c.id, c.name, m.id, m.name, m.price, m.desc
+        FROM categories c
+        LEFT JOIN menu_items m ON m.category_id = c.id
+        ORDER BY c.position, c.id, m.position, m.id
+    """)
     menu_list = []
+    by_category = {}
+    for cat_id, cat_name, item_id, name, price, desc in cur.fetchall():
+        cat_dict = by_category.get(cat_id)
+        if cat_dict is None:
+            cat_dict = {"id": cat_id, "category": cat_name, "items": []}
+            by_category[cat_id] = cat_dict
+            menu_list.append(cat_dict)
+        if item_id is not None:
+            cat_dict["items"].append({"id": item_id, "name": name, "price": price, "desc": desc if desc else ""})
+    return menu_list
+
+
+def _get_menu_db_version(conn) -> int:
+    row = conn.execute("SELECT value FROM meta WHERE key = 'menu_version'").fetchone()
+    return row[0] if row else 0
+
 
-    cur.execute("SELECT id, name FROM categories ORDER BY id")
-    categories = cur.fetchall()
+def _bump_menu_version(cur):
+    # В той же транзакции, что и изменение меню
+    cur.execute("UPDATE meta SET value = value + 1 WHERE key = 'menu_version'")
 
-    for cat_id, cat_name in categories:
-        cur.execute("SELECT id, name, price, desc FROM menu_items WHERE category_id = ? ORDER BY id", (cat_id,))
-        items = [{"id": row[0], "name": row[1], "price": row[2], "desc": row[3] if row[3] else ""} for row in cur.fetchall()]
-        menu_list.append({"category": cat_name, "items": items})
 
-    conn.close()
+def _refresh_menu(conn):
+    # Вызывается только из потока БД после коммита
+    global _menu_snapshot, _menu_index, _menu_categories, _menu_version, _menu_db_version
+    _menu_db_version = _get_menu_db_version(conn)
+    menu_list = _fetch_menu(conn)
+    _menu_index = {item["id"]: (cat_dict["category"], item) for cat_dict in menu_list for item in cat_dict["items"]}
+    _menu_categories = {cat_dict["id"]: cat_dict for cat_dict in menu_list}
+    _menu_snapshot = menu_list
+    _menu_version += 1
+
+
+@db_call
+def _revalidate_menu():
+    conn = get_connection()
+    if _menu_snapshot is None or _get_menu_db_version(conn) != _menu_db_version:
+        _refresh_menu(conn)
+    return _menu_snapshot
+
+
+@timed()
+async def read_menu():
+    global _menu_checked_at
+    menu_list = _menu_snapshot
+    now = time.monotonic()
+    if menu_list is None or now - _menu_checked_at >= MENU_REVALIDATE_INTERVAL:
+        _menu_checked_at = now
+        menu_list = await _revalidate_menu()
     return menu_list
 
 
-def write_menu(menu_list):
-    conn = sqlite3.connect(DB_FILE)
+def menu_version() -> int:
+    return _menu_version
+
+
+def lookup_menu_item(item_id: int):
+    # (название категории, блюдо) из загруженного снимка или None
+    return _menu_index.get(item_id)
+
+
+def lookup_menu_category(category_id: int):
+    # Категория {"id", "category", "items"} из загруженного снимка или None
+    return _menu_categories.get(category_id)
+
+
+# Точечные изменения меню: каждая функция трогает только свои строки в одной
+# транзакции, id категорий и блюд не меняются (на них ссылаются promos.item_id).
+
+@db_call
+def add_category(name: str) -> int:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM categories WHERE name = ?", (name,))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+    cur.execute("""
+        INSERT INTO categories (name, position)
+        VALUES (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM categories))
+    """, (name,))
+    category_id = cur.lastrowid
+    _bump_menu_version(cur)
+    conn.commit()
+    _refresh_menu(conn)
+    return category_id
+
+
+@db_call
+def rename_category(category_id: int, name: str):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("UPDATE categories SET name = ? WHERE id = ?", (name, category_id))
+    _bump_menu_version(cur)
+    conn.commit()
+    _refresh_menu(conn)
+
+
+@db_call
+def delete_category(category_id: int) -> bool:
+    # Непустую категорию не удаляем — сначала нужно удалить блюда
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM menu_items WHERE category_id = ? LIMIT 1", (category_id,))
+    if cur.fetchone():
+        return False
+    cur.execute("DELETE FROM categories WHERE id = ?", (category_id,))
+    _bump_menu_version(cur)
+    conn.commit()
+    _refresh_menu(conn)
+    return True
+
+
+@db_call
+def reorder_categories(category_ids: list):
+    conn = get_connection()
     cur = conn.cursor()
+    cur.executemany("UPDATE categories SET position = ? WHERE id = ?",
+                    [(position, category_id) for position, category_id in enumerate(category_ids, 1)])
+    _bump_menu_version(cur)
+    conn.commit()
+    _refresh_menu(conn)
+
 
-    cur.execute("DELETE FROM menu_items")
-    cur.execute("DELETE FROM categories")
+@db_call
+def add_dish(category_id: int, name: str, price: str, desc: str = "") -> int:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO menu_items (category_id, name, price, desc, position)
+        VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM menu_items WHERE category_id = ?))
+    """, (category_id, name, price, desc, category_id))
+    item_id = cur.lastrowid
+    _bump_menu_version(cur)
+    conn.commit()
+    _refresh_menu(conn)
+    return item_id
 
-    for cat_dict in menu_list:
-        cur.execute("INSERT INTO categories (name) VALUES (?)", (cat_dict["category"],))
-        cat_id = cur.lastrowid
-        for item in cat_dict["items"]:
-            cur.execute("INSERT INTO menu_items (category_id, name, price, desc) VALUES (?, ?, ?, ?)",
-                        (cat_id, item["name"], item["price"], item.get("desc", "")))
 
+@db_call
+def update_dish(item_id: int, name: str | None = None, price: str | None = None,
+                desc: str | None = None, category_id: int | None = None):
+    fields = {"name": name, "price": price, "desc": desc, "category_id": category_id}
+    updates = {column: value for column, value in fields.items() if value is not None}
+    if not updates:
+        return
+    conn = get_connection()
+    cur = conn.cursor()
+    assignments = ", ".join(f"{column} = ?" for column in updates)
+    cur.execute(f"UPDATE menu_items SET {assignments} WHERE id = ?", (*updates.values(), item_id))
+    _bump_menu_version(cur)
     conn.commit()
-    conn.close()
+    _refresh_menu(conn)
 
 
-def append_order(order_text: str, phone: str, delivery_type: str, delivery_address: str,
+@db_call
+def delete_dish(item_id: int) -> bool:
+    # Блюдо, которое выдаёт промокод, не удаляем — сначала нужно удалить промокод
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM promos WHERE type = 'item' AND item_id = ? LIMIT 1", (item_id,))
+    if cur.fetchone():
+        return False
+    cur.execute("DELETE FROM menu_items WHERE id = ?", (item_id,))
+    _bump_menu_version(cur)
+    conn.commit()
+    _refresh_menu(conn)
+    return True
+
+
+@db_call
+def reorder_dishes(category_id: int, item_ids: list):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.executemany("UPDATE menu_items SET position = ? WHERE id = ? AND category_id = ?",
+                    [(position, item_id, category_id) for position, item_id in enumerate(item_ids, 1)])
+    _bump_menu_version(cur)
+    conn.commit()
+    _refresh_menu(conn)
+
+
+def _insert_order_items(cur, order_id: int, items: list):
+    cur.executemany('''INSERT INTO order_items (order_id, menu_item_id, category, name, price, quantity, is_promo)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                    [(order_id, item.get("id"), item["category"], item["name"], item["price"], item["qty"],
+                      int(item["is_promo"])) for item in items])
+
+
+@db_call
+def append_order(items: list, phone: str, delivery_type: str, delivery_address: str,
                 comment: str = "Без комментария", username: str = "Скрыт",
                 prep_time: str = "Не указано", delivery_cost: int = 0,
                 payment_method: str = "Не указано", cash_amount: int | None = None,
-                user_id: str | None = None):  # новый параметр
-    conn = sqlite3.connect('bot.db')
+                user_id: str | None = None, promo_code: str | None = None,
+                discount: int = 0, total: int | None = None):
+    # items — позиции заказа (как в cart.cart_lines); текст заказа не хранится,
+    # он собирается из order_items при чтении
+    if total is None:
+        total = items_subtotal(items) - discount + delivery_cost
+    now = datetime.datetime.utcnow()
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
         INSERT INTO orders 
-        (order_text, phone, delivery_type, delivery_address, comment, username, 
-         prep_time, delivery_cost, payment_method, cash_amount, user_id, timestamp)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+        (phone, delivery_type, delivery_address, comment, username, 
+         prep_time, delivery_cost, payment_method, cash_amount, user_id,
+         promo_code, discount, total, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
-        order_text, phone, delivery_type, delivery_address, comment, username,
-        prep_time, delivery_cost, payment_method, cash_amount, user_id
+        phone, delivery_type, delivery_address, comment, username,
+        prep_time, delivery_cost, payment_method, cash_amount, user_id,
+        promo_code, discount, total, now.strftime(TIMESTAMP_FORMAT)
     ))
     
     order_id = cursor.lastrowid  # Получаем ID только что вставленного заказа
+    _insert_order_items(cursor, order_id, items)
+    _rollup_order(cursor, (now + LOCAL_TZ_OFFSET).date().isoformat(), items, delivery_type,
+                  delivery_cost, promo_code, discount, total)
+    cursor.execute("UPDATE meta SET value = value + 1 WHERE key = 'orders_version'")
     
-    conn.commit()
-    conn.close()
+    conn.commit()  # заказ, его позиции и суточные итоги — одной транзакцией
     
     return order_id
 
 
-def read_users():
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT user_id, phone FROM users")
-    users = {row[0]: row[1] for row in cur.fetchall()}
-    conn.close()
-    return users
+def _rollup_order(cur, day: str, items: list, delivery_type: str, delivery_cost: int,
+                  promo_code: str | None, discount: int, total: int):
+    is_delivery = delivery_type == "delivery"
+    cur.execute('''INSERT INTO daily_sales
+                   (day, orders, revenue, items_revenue, delivery_revenue, discount,
+                    delivery_orders, pickup_orders, promo_orders)
+                   VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(day) DO UPDATE SET
+                    orders = orders + 1,
+                    revenue = revenue + excluded.revenue,
+                    items_revenue = items_revenue + excluded.items_revenue,
+                    delivery_revenue = delivery_revenue + excluded.delivery_revenue,
+                    discount = discount + excluded.discount,
+                    delivery_orders = delivery_orders + excluded.delivery_orders,
+                    pickup_orders = pickup_orders + excluded.pickup_orders,
+                    promo_orders = promo_orders + excluded.promo_orders''',
+                (day, total, items_subtotal(items), delivery_cost if is_delivery else 0, discount,
+                 int(is_delivery), int(not is_delivery), int(bool(promo_code))))
+
+    dishes = {}  # name -> [порции, бесплатные, выручка]
+    for item in items:
+        dish = dishes.setdefault(item["name"], [0, 0, 0])
+        dish[0] += item["qty"]
+        if item["is_promo"]:
+            dish[1] += item["qty"]
+        else:
+            dish[2] += item["qty"] * item["price"]
+    cur.executemany('''INSERT INTO daily_dish_sales (day, name, quantity, free_quantity, revenue)
+                       VALUES (?, ?, ?, ?, ?)
+                       ON CONFLICT(day, name) DO UPDATE SET
+                        quantity = quantity + excluded.quantity,
+                        free_quantity = free_quantity + excluded.free_quantity,
+                        revenue = revenue + excluded.revenue''',
+                    [(day, name, *counts) for name, counts in dishes.items()])
+
+    if promo_code:
+        cur.execute('''INSERT INTO daily_promo_usage (day, promo_code, uses, discount)
+                       VALUES (?, ?, 1, ?)
+                       ON CONFLICT(day, promo_code) DO UPDATE SET
+                        uses = uses + 1,
+                        discount = discount + excluded.discount''', (day, promo_code, discount))
+
 
+# Версия суточных итогов: если поменялась — migrate_db пересобирает их по всем заказам
+SALES_ROLLUP_VERSION = 1
 
-def get_orders_filtered(period=None, date_from=None, date_to=None, limit=1000):
-    conn = sqlite3.connect(DB_FILE)
+
+def _rebuild_sales_rollups(cur):
+    cur.execute("DELETE FROM daily_sales")
+    cur.execute("DELETE FROM daily_dish_sales")
+    cur.execute("DELETE FROM daily_promo_usage")
+    cur.execute('''INSERT INTO daily_sales
+                   (day, orders, revenue, items_revenue, delivery_revenue, discount,
+                    delivery_orders, pickup_orders, promo_orders)
+                   SELECT date(o.timestamp, '+8 hours') AS day,
+                          COUNT(*),
+                          SUM(COALESCE(o.total, 0)),
+                          SUM((SELECT COALESCE(SUM(i.price * i.quantity), 0) FROM order_items i
+                               WHERE i.order_id = o.id AND NOT i.is_promo)),
+                          SUM(CASE WHEN o.delivery_type = 'delivery' THEN COALESCE(o.delivery_cost, 0) ELSE 0 END),
+                          SUM(COALESCE(o.discount, 0)),
+                          SUM(o.delivery_type = 'delivery'),
+                          SUM(o.delivery_type IS NOT 'delivery'),
+                          SUM(o.promo_code IS NOT NULL)
+                   FROM orders o WHERE o.timestamp IS NOT NULL
+                   GROUP BY day''')
+    cur.execute('''INSERT INTO daily_dish_sales (day, name, quantity, free_quantity, revenue)
+                   SELECT date(o.timestamp, '+8 hours') AS day, i.name,
+                          SUM(i.quantity),
+                          SUM(CASE WHEN i.is_promo THEN i.quantity ELSE 0 END),
+                          SUM(CASE WHEN i.is_promo THEN 0 ELSE i.price * i.quantity END)
+                   FROM order_items i JOIN orders o ON o.id = i.order_id
+                   WHERE o.timestamp IS NOT NULL
+                   GROUP BY day, i.name''')
+    cur.execute('''INSERT INTO daily_promo_usage (day, promo_code, uses, discount)
+                   SELECT date(timestamp, '+8 hours') AS day, promo_code, COUNT(*), SUM(COALESCE(discount, 0))
+                   FROM orders WHERE timestamp IS NOT NULL AND promo_code IS NOT NULL
+                   GROUP BY day, promo_code''')
+    cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sales_rollup_version', ?)", (SALES_ROLLUP_VERSION,))
+
+
+@db_call
+def get_sales_report(day_from: datetime.date | None, day_to: datetime.date, top: int = 10) -> dict:
+    # Итоги за местные даты day_from..day_to включительно (day_from=None — с начала)
+    conn = get_connection()
     cur = conn.cursor()
+    bounds = ((day_from or datetime.date.min).isoformat(), day_to.isoformat())
+    cur.execute('''SELECT COALESCE(SUM(orders), 0), COALESCE(SUM(revenue), 0), COALESCE(SUM(items_revenue), 0),
+                          COALESCE(SUM(delivery_revenue), 0), COALESCE(SUM(discount), 0),
+                          COALESCE(SUM(delivery_orders), 0), COALESCE(SUM(pickup_orders), 0),
+                          COALESCE(SUM(promo_orders), 0), COUNT(*)
+                   FROM daily_sales WHERE day BETWEEN ? AND ?''', bounds)
+    columns = ["orders", "revenue", "items_revenue", "delivery_revenue", "discount",
+               "delivery_orders", "pickup_orders", "promo_orders", "days"]
+    report = dict(zip(columns, cur.fetchone()))
+    cur.execute('''SELECT name, SUM(quantity), SUM(free_quantity), SUM(revenue) FROM daily_dish_sales
+                   WHERE day BETWEEN ? AND ?
+                   GROUP BY name ORDER BY SUM(quantity) DESC, SUM(revenue) DESC LIMIT ?''', (*bounds, top))
+    report["dishes"] = [dict(zip(["name", "quantity", "free_quantity", "revenue"], row)) for row in cur.fetchall()]
+    cur.execute('''SELECT promo_code, SUM(uses), SUM(discount) FROM daily_promo_usage
+                   WHERE day BETWEEN ? AND ?
+                   GROUP BY promo_code ORDER BY SUM(uses) DESC''', bounds)
+    report["promos"] = [dict(zip(["code", "uses", "discount"], row)) for row in cur.fetchall()]
+    return report
 
-    query = """SELECT order_text, order_time, phone, delivery_address, username, comment, delivery_type, prep_time, delivery_cost, payment_method, cash_amount 
-               FROM orders"""
-    params = []
 
+def _load_order_items(cur, order_ids: list) -> dict:
+    # order_id -> позиции, в порядке добавления
+    items = defaultdict(list)
+    for start in range(0, len(order_ids), 500):
+        chunk = order_ids[start:start + 500]
+        cur.execute(f"""SELECT order_id, category, name, price, quantity, is_promo FROM order_items
+                        WHERE order_id IN ({",".join("?" * len(chunk))}) ORDER BY id""", chunk)
+        for order_id, category, name, price, quantity, is_promo in cur.fetchall():
+            items[order_id].append({"category": category, "name": name, "price": price,
+                                    "qty": quantity, "is_promo": bool(is_promo)})
+    return items
+
+
+def _order_text(order_text, items, promo_code, discount, delivery_type, delivery_cost, total) -> str:
+    # Старые заказы, чей текст не удалось точно восстановить, показываются как есть
+    if order_text is not None:
+        return order_text.strip()
+    if not items:
+        return ""
+    return render_order({"items": items, "promo_code": promo_code, "discount": discount,
+                         "delivery_type": delivery_type, "delivery_cost": delivery_cost, "total": total})
+
+
+def _local_day_start_utc(local_date: datetime.date) -> str:
+    # Начало местных суток в формате orders.timestamp
+    return (datetime.datetime.combine(local_date, datetime.time.min) - LOCAL_TZ_OFFSET).strftime(TIMESTAMP_FORMAT)
+
+
+_ORDER_COLUMNS = """id, order_text, timestamp, phone, delivery_address, username, comment, delivery_type, prep_time,
+                    delivery_cost, payment_method, cash_amount, promo_code, discount, total"""
+
+
+def _orders_filter(period=None, date_from=None, date_to=None) -> tuple[list, list]:
+    # Условия WHERE по orders.timestamp (индекс idx_orders_timestamp) и их параметры
     where_clauses = []
+    params = []
 
+    local_today = (datetime.datetime.utcnow() + LOCAL_TZ_OFFSET).date()
     if period == "today":
-        today = (datetime.datetime.utcnow() + LOCAL_TZ_OFFSET).strftime("%d.%m.%Y")
-        where_clauses.append("order_time LIKE ?")
-        params.append(f"{today}%")
+        where_clauses.append("timestamp >= ?")
+        params.append(_local_day_start_utc(local_today))
     elif period == "3days":
-        since = (datetime.datetime.utcnow() + LOCAL_TZ_OFFSET - datetime.timedelta(days=3)).strftime("%d.%m.%Y")
-        where_clauses.append("order_time >= ?")
-        params.append(f"{since} 00:00")
+        where_clauses.append("timestamp >= ?")
+        params.append(_local_day_start_utc(local_today - datetime.timedelta(days=3)))
     elif period == "week":
-        since = (datetime.datetime.utcnow() + LOCAL_TZ_OFFSET - datetime.timedelta(days=7)).strftime("%d.%m.%Y")
-        where_clauses.append("order_time >= ?")
-        params.append(f"{since} 00:00")
+        where_clauses.append("timestamp >= ?")
+        params.append(_local_day_start_utc(local_today - datetime.timedelta(days=7)))
 
-    if date_from and date_to:
-        where_clauses.append("order_time BETWEEN ? AND ?")
-        params.extend([f"{date_from} 00:00", f"{date_to} 23:59"])
-    elif date_from:
-        where_clauses.append("order_time >= ?")
-        params.append(f"{date_from} 00:00")
-    elif date_to:
-        where_clauses.append("order_time <= ?")
-        params.append(f"{date_to} 23:59")
+    # date_from / date_to — местные даты "дд.мм.ГГГГ" включительно
+    if date_from:
+        where_clauses.append("timestamp >= ?")
+        params.append(_local_day_start_utc(datetime.datetime.strptime(date_from, "%d.%m.%Y").date()))
+    if date_to:
+        next_day = datetime.datetime.strptime(date_to, "%d.%m.%Y").date() + datetime.timedelta(days=1)
+        where_clauses.append("timestamp < ?")
+        params.append(_local_day_start_utc(next_day))
 
-    if where_clauses:
-        query += " WHERE " + " AND ".join(where_clauses)
+    return where_clauses, params
 
-    query += " ORDER BY id ASC LIMIT ?"
-    params.append(limit)
 
-    cur.execute(query, params)
-    rows = cur.fetchall()
+def _orders_from_rows(cur, rows) -> list:
+    items = _load_order_items(cur, [row[0] for row in rows])
 
     orders = []
     for row in rows:
-        text, time_str, phone, delivery_address, username, comment, delivery_type, prep_time, delivery_cost, payment_method, cash_amount = row
+        (order_id, order_text, timestamp, phone, delivery_address, username, comment, delivery_type, prep_time,
+         delivery_cost, payment_method, cash_amount, promo_code, discount, total) = row
+        text = _order_text(order_text, items[order_id], promo_code, discount, delivery_type, delivery_cost, total)
         dt = None
+        time_str = None
         try:
-            dt = datetime.datetime.strptime(time_str, "%d.%m.%Y %H:%M")
-        except:
+            dt = datetime.datetime.strptime(timestamp, TIMESTAMP_FORMAT) + LOCAL_TZ_OFFSET
+            time_str = dt.strftime("%d.%m.%Y %H:%M")
+        except (TypeError, ValueError):
             pass
         orders.append({
-            "text": text.strip() if text else "",
+            "id": order_id,
+            "timestamp": timestamp,
+            "text": text,
+            "items": items[order_id],
             "time": time_str,
             "datetime": dt,
             "phone": phone,
@@ -246,23 +794,123 @@ def get_orders_filtered(period=None, date_from=None, date_to=None, limit=1000):
             "prep_time": prep_time or "Не указано",
             "delivery_cost": delivery_cost or 0,
             "payment_method": payment_method or "Не указано",
-            "cash_amount": cash_amount
+            "cash_amount": cash_amount,
+            "promo_code": promo_code,
+            "discount": discount or 0,
+            "total": total
         })
+    return orders
+
+
+@db_call
+def get_orders_page(period=None, date_from=None, date_to=None, before: tuple | None = None, limit: int = 20):
+    # Заказы от новых к старым, начиная сразу после курсора before = (timestamp, id)
+    # последнего заказа предыдущей страницы — без OFFSET, по индексу timestamp
+    conn = get_connection()
+    cur = conn.cursor()
+
+    where_clauses, params = _orders_filter(period, date_from, date_to)
+    where_clauses.append("timestamp IS NOT NULL")
+    if before:
+        where_clauses.append("(timestamp, id) < (?, ?)")
+        params += list(before)
+
+    cur.execute(f"""SELECT {_ORDER_COLUMNS} FROM orders WHERE {" AND ".join(where_clauses)}
+                    ORDER BY timestamp DESC, id DESC LIMIT ?""", (*params, limit))
+    return _orders_from_rows(cur, cur.fetchall())
 
-    conn.close()
+
+@db_call
+def count_orders(period=None, date_from=None, date_to=None) -> int:
+    conn = get_connection()
+    cur = conn.cursor()
+    where_clauses, params = _orders_filter(period, date_from, date_to)
+    where_clauses.append("timestamp IS NOT NULL")
+    cur.execute(f"SELECT COUNT(*) FROM orders WHERE {' AND '.join(where_clauses)}", params)
+    return cur.fetchone()[0]
+
+
+@db_call
+def get_orders_version() -> int:
+    # Растёт с каждым новым заказом (в любом процессе бота)
+    row = get_connection().execute("SELECT value FROM meta WHERE key = 'orders_version'").fetchone()
+    return row[0] if row else 0
+
+
+# Выгрузка заказов в CSV: строка на каждую позицию заказа (LEFT JOIN — заказ без
+# позиций тоже попадает). Идёт в отдельном потоке через своё соединение только
+# для чтения: поток БД не занят на время выгрузки, а WAL позволяет читать
+# параллельно с записью. Строки читаются порциями, файл пишется сразу на диск.
+EXPORT_CHUNK_SIZE = 500
+
+EXPORT_HEADER = [
+    "Заказ", "Дата", "Телефон", "Username", "Получение", "Адрес", "Готовность", "Оплата", "Сдача с",
+    "Комментарий", "Промокод", "Скидка", "Доставка", "К оплате",
+    "Категория", "Блюдо", "Цена", "Количество", "Бесплатно",
+]
+
+
+def _write_orders_csv(path: str, period=None, date_from=None, date_to=None) -> int:
+    where_clauses, params = _orders_filter(period, date_from, date_to)
+    where_clauses = [f"o.{clause}" for clause in where_clauses]
+    query = f"""SELECT o.id, o.timestamp, o.phone, o.username, o.delivery_type, o.delivery_address, o.prep_time,
+                       o.payment_method, o.cash_amount, o.comment, o.promo_code, o.discount, o.delivery_cost, o.total,
+                       i.category, i.name, i.price, i.quantity, i.is_promo
+                FROM orders o LEFT JOIN order_items i ON i.order_id = o.id
+                {"WHERE " + " AND ".join(where_clauses) if where_clauses else ""}
+                ORDER BY o.timestamp, o.id, i.id"""
+
+    # as_uri() экранирует "?", "#" и "%" в пути — иначе SQLite откроет не тот файл
+    conn = sqlite3.connect(pathlib.Path(DB_FILE).resolve().as_uri() + "?mode=ro", uri=True)
+    orders = 0
+    last_order_id = None
+    try:
+        cur = conn.execute(query, params)
+        # utf-8-sig и ";" — чтобы файл сразу открывался в Excel с русской локалью
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f, delimiter=";")
+            writer.writerow(EXPORT_HEADER)
+            while True:
+                rows = cur.fetchmany(EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    order_id, timestamp, *fields, is_promo = row
+                    if order_id != last_order_id:
+                        orders += 1
+                        last_order_id = order_id
+                    try:
+                        local = datetime.datetime.strptime(timestamp, TIMESTAMP_FORMAT) + LOCAL_TZ_OFFSET
+                        timestamp = local.strftime("%d.%m.%Y %H:%M")
+                    except (TypeError, ValueError):
+                        pass
+                    promo = "" if is_promo is None else ("да" if is_promo else "")
+                    writer.writerow([order_id, timestamp, *("" if v is None else v for v in fields), promo])
+    finally:
+        conn.close()
     return orders
 
+
+@timed(query=True)
+async def export_orders_csv(path: str, period=None, date_from=None, date_to=None) -> int:
+    # Пишет заказы за период в path, возвращает число заказов
+    return await asyncio.to_thread(_write_orders_csv, path, period, date_from, date_to)
+
+
+@db_call
 def get_user_orders(user_id: str):
-    conn = sqlite3.connect('bot.db')
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
-        SELECT prep_time, order_text, datetime(timestamp, '+8 hours') as local_time
+        SELECT prep_time, order_text, datetime(timestamp, '+8 hours') as local_time,
+               id, promo_code, discount, delivery_type, delivery_cost, total
         FROM orders
         WHERE user_id = ?
         ORDER BY timestamp DESC
         LIMIT 10
     """, (user_id,))
     rows = cursor.fetchall()
+    items = _load_order_items(cursor, [row[3] for row in rows])
     orders = []
     for row in rows:
         timestamp_str = "Неизвестно"
@@ -274,17 +922,17 @@ def get_user_orders(user_id: str):
             except ValueError:
                 timestamp_str = "Ошибка формата"
 
+        order_id, promo_code, discount, delivery_type, delivery_cost, total = row[3:]
         orders.append({
             'prep_time': row[0] or "Не указано",
-            'order_text': row[1],
+            'order_text': _order_text(row[1], items[order_id], promo_code, discount, delivery_type, delivery_cost, total),
             'timestamp': timestamp_str
         })
-    conn.close()
     return orders
 
 
 def migrate_db():
-    conn = sqlite3.connect('bot.db')
+    conn = get_connection()
     cursor = conn.cursor()
     
     # Получаем список существующих колонок
@@ -294,85 +942,216 @@ def migrate_db():
     # Добавляем timestamp БЕЗ дефолта (он будет заполняться явно в INSERT)
     if 'timestamp' not in columns:
         cursor.execute("ALTER TABLE orders ADD COLUMN timestamp DATETIME")
-        print("Добавлена колонка timestamp в таблицу orders (без дефолта)")
+        logger.info("Добавлена колонка timestamp в таблицу orders (без дефолта)")
     
     # Добавляем user_id БЕЗ дефолта
     if 'user_id' not in columns:
         cursor.execute("ALTER TABLE orders ADD COLUMN user_id TEXT")
-        print("Добавлена колонка user_id в таблицу orders")
+        logger.info("Добавлена колонка user_id в таблицу orders")
+    
+    # Старые заказы хранили только order_time (местное "дд.мм.ГГГГ ЧЧ:ММ"),
+    # переносим его в timestamp (UTC, "ГГГГ-ММ-ДД ЧЧ:ММ:СС") — он сортируется как строка
+    cursor.execute("SELECT id, order_time FROM orders WHERE timestamp IS NULL AND order_time IS NOT NULL")
+    backfill = []
+    for order_id, order_time in cursor.fetchall():
+        try:
+            local_dt = datetime.datetime.strptime(order_time, "%d.%m.%Y %H:%M")
+        except ValueError:
+            continue
+        backfill.append(((local_dt - LOCAL_TZ_OFFSET).strftime(TIMESTAMP_FORMAT), order_id))
+    if backfill:
+        cursor.executemany("UPDATE orders SET timestamp = ? WHERE id = ?", backfill)
+        logger.info("Заполнен timestamp у %d старых заказов", len(backfill))
+    
+    # Старые заказы: позиции и суммы разбираются из order_text. Если из разобранного
+    # получается ровно тот же текст, order_text больше не нужен; иначе (старые форматы
+    # с описаниями, без «× N») он остаётся для показа, а позиции — для отчётов.
+    # total IS NULL — признак ещё не разобранного заказа.
+    cursor.execute("SELECT id, order_text, delivery_type, delivery_cost FROM orders WHERE total IS NULL")
+    pending = cursor.fetchall()
+    if pending:
+        cursor.execute("SELECT c.name, m.name, m.id FROM menu_items m LEFT JOIN categories c ON c.id = m.category_id")
+        menu_ids = {}
+        for category, name, item_id in cursor.fetchall():
+            menu_ids[(category, name)] = item_id
+            menu_ids.setdefault((None, name), item_id)
+        cleared = 0
+        for order_id, order_text, delivery_type, delivery_cost in pending:
+            parsed = parse_order_text(order_text)
+            for item in parsed["items"]:
+                item["id"] = menu_ids.get((item["category"], item["name"])) or menu_ids.get((None, item["name"]))
+            total = parsed["total"]
+            if total is None:
+                total = items_subtotal(parsed["items"]) - parsed["discount"] + (delivery_cost or 0)
+            parsed.update(delivery_type=delivery_type, delivery_cost=delivery_cost or 0, total=total)
+            keep_text = order_text if render_order(parsed) != (order_text or "").strip() else None
+            cleared += keep_text is None
+            _insert_order_items(cursor, order_id, parsed["items"])
+            cursor.execute("UPDATE orders SET order_text = ?, promo_code = ?, discount = ?, total = ? WHERE id = ?",
+                           (keep_text, parsed["promo_code"], parsed["discount"], total, order_id))
+        logger.info("Разобран состав %d старых заказов, текст восстанавливается у %d", len(pending), cleared)
+    
+    # Суточные итоги для статистики — по всем заказам, один раз на версию
+    cursor.execute("SELECT value FROM meta WHERE key = 'sales_rollup_version'")
+    row = cursor.fetchone()
+    if not row or row[0] < SALES_ROLLUP_VERSION:
+        _rebuild_sales_rollups(cursor)
+        logger.info("Пересобраны суточные итоги продаж")
+    
+    # Фильтры по датам в админке и история в /profile — диапазонные сканы по индексам
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_timestamp ON orders (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_timestamp ON orders (user_id, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_used_promos_user_code ON used_promos (user_id, promo_code)")
     
     conn.commit()
-    conn.close()
 
 
+@db_call
+def create_broadcast(text: str, photo: str | None, admin_chat_id: int) -> dict:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM users")
+    total = cur.fetchone()[0]
+    cur.execute('''INSERT INTO broadcasts (text, photo, admin_chat_id, total, created_at)
+                   VALUES (?, ?, ?, ?, datetime('now'))''', (text, photo, admin_chat_id, total))
+    broadcast_id = cur.lastrowid
+    conn.commit()
+    return {"id": broadcast_id, "text": text, "photo": photo, "admin_chat_id": admin_chat_id,
+            "progress_message_id": None, "total": total, "last_rowid": 0, "sent": 0, "failed": 0}
+
+
+@db_call
+def get_unfinished_broadcasts() -> list:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""SELECT id, text, photo, admin_chat_id, progress_message_id, total, last_rowid, sent, failed
+                   FROM broadcasts WHERE status = 'running' ORDER BY id""")
+    columns = ["id", "text", "photo", "admin_chat_id", "progress_message_id", "total", "last_rowid", "sent", "failed"]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+@db_call
+def get_broadcast_recipients(after_rowid: int, limit: int) -> list:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT rowid, user_id FROM users WHERE rowid > ? ORDER BY rowid LIMIT ?", (after_rowid, limit))
+    return cur.fetchall()
+
+
+@db_call
+def update_broadcast(broadcast_id: int, **fields):
+    # fields: progress_message_id, status, last_rowid, sent, failed
+    conn = get_connection()
+    cur = conn.cursor()
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    cur.execute(f"UPDATE broadcasts SET {assignments} WHERE id = ?", (*fields.values(), broadcast_id))
+    conn.commit()
+
+
+@db_call
 def get_all_user_ids():
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cur = conn.cursor()
     cur.execute("SELECT user_id FROM users")
     user_ids = [row[0] for row in cur.fetchall()]
-    conn.close()
     return user_ids
 
 
+@db_call
 def create_promo(name: str, code: str, min_sum: int, promo_type: str, item_id: int = None, discount: int = None):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cur = conn.cursor()
     cur.execute('''INSERT INTO promos (name, code, min_sum, type, item_id, discount)
                    VALUES (?, ?, ?, ?, ?, ?)''', (name, code.upper(), min_sum, promo_type, item_id, discount))
     conn.commit()
-    conn.close()
 
+@db_call
 def get_promos():
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cur = conn.cursor()
     cur.execute("SELECT id, name, code, min_sum, type, item_id, discount FROM promos")
     promos = cur.fetchall()
-    conn.close()
     return promos
 
+@db_call
 def get_promo_by_code(code: str):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cur = conn.cursor()
     cur.execute("SELECT id, name, code, min_sum, type, item_id, discount FROM promos WHERE code = ?", (code.upper(),))
     promo = cur.fetchone()
-    conn.close()
     return promo
 
+@db_call
 def delete_promo(promo_id: int):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cur = conn.cursor()
     cur.execute("DELETE FROM promos WHERE id = ?", (promo_id,))
     conn.commit()
-    conn.close()
 
+@db_call
 def get_promo_stats(code: str):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cur = conn.cursor()
     cur.execute("SELECT COUNT(*) FROM used_promos WHERE promo_code = ?", (code.upper(),))
     count = cur.fetchone()[0]
-    conn.close()
     return count
 
+@db_call
 def is_promo_used_by_user(user_id: str, code: str):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cur = conn.cursor()
     cur.execute("SELECT 1 FROM used_promos WHERE user_id = ? AND promo_code = ?", (user_id, code.upper()))
     used = cur.fetchone() is not None
-    conn.close()
     return used
 
+@db_call
 def mark_promo_as_used(user_id: str, code: str, order_id: int):
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_connection()
     cur = conn.cursor()
     cur.execute('''INSERT INTO used_promos (user_id, promo_code, order_id)
                    VALUES (?, ?, ?)''', (user_id, code.upper(), order_id))
     conn.commit()
-    conn.close()
 
-def get_menu_item_by_id(item_id: int):
-    conn = sqlite3.connect(DB_FILE)
+@timed()
+async def get_menu_item_by_id(item_id: int):
+    await read_menu()
+    found = _menu_index.get(item_id)
+    if not found:
+        return None
+    item = found[1]
+    return {"name": item["name"], "price": item["price"], "desc": item["desc"]}
+
+
+@db_call
+def load_fsm_record(key: str, not_before: float):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT state, data, updated_at FROM fsm_storage WHERE key = ? AND updated_at >= ?", (key, not_before))
+    row = cur.fetchone()
+    if not row:
+        return None
+    return row[0], json.loads(row[1]) if row[1] else {}, row[2]
+
+
+@db_call
+def save_fsm_records(rows: list, deleted_keys: list):
+    # rows: [(key, state, data_json, updated_at)] — одна транзакция на пачку
+    conn = get_connection()
+    cur = conn.cursor()
+    if rows:
+        cur.executemany("""
+            INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+        """, rows)
+    if deleted_keys:
+        cur.executemany("DELETE FROM fsm_storage WHERE key = ?", [(key,) for key in deleted_keys])
+    conn.commit()
+
+
+@db_call
+def delete_expired_fsm_records(before: float) -> int:
+    conn = get_connection()
     cur = conn.cursor()
-    cur.execute("SELECT name, price, desc FROM menu_items WHERE id = ?", (item_id,))
-    item = cur.fetchone()
-    conn.close()
-    return {"name": item[0], "price": item[1], "desc": item[2]} if item else None
\ No newline at end of file
+    cur.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (before,))
+    conn.commit()
+    return cur.rowcount
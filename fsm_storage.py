@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from db import load_fsm_record, save_fsm_records, delete_expired_fsm_records
+
+logger = logging.getLogger(__name__)
+
+# Брошенные сессии (корзины) живут неделю с последнего изменения
+FSM_TTL_SECONDS = int(os.getenv("FSM_TTL_SECONDS", str(7 * 24 * 3600)))
+# Как часто пачкой сбрасываем изменения в БД
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "2"))
+# Через сколько простоя выгружаем сохранённую сессию из памяти
+FSM_MEMORY_IDLE_SECONDS = int(os.getenv("FSM_MEMORY_IDLE_SECONDS", "1800"))
+# Как часто чистим просроченные сессии
+FSM_SWEEP_INTERVAL = int(os.getenv("FSM_SWEEP_INTERVAL", "600"))
+
+
+class SQLiteStorage(BaseStorage):
+    # Хранилище FSM поверх таблицы fsm_storage в bot.db.
+    # Рабочая копия сессий держится в памяти, изменения копятся в _dirty и
+    # раз в FSM_FLUSH_INTERVAL пишутся одной транзакцией (и при остановке бота).
+
+    def __init__(
+        self,
+        ttl: int = FSM_TTL_SECONDS,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        memory_idle: int = FSM_MEMORY_IDLE_SECONDS,
+        sweep_interval: int = FSM_SWEEP_INTERVAL,
+    ):
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.memory_idle = memory_idle
+        self.sweep_interval = sweep_interval
+        self._records: dict[str, list] = {}  # key -> [state, data, updated_at]
+        self._dirty: set[str] = set()
+        self._worker: asyncio.Task | None = None
+        self._last_sweep = time.time()
+
+    async def _get_record(self, key: StorageKey) -> tuple[str, list]:
+        storage_key = self.key_builder.build(key)
+        record = self._records.get(storage_key)
+        if record is None:
+            loaded = await load_fsm_record(storage_key, time.time() - self.ttl)
+            # Пока ждали БД, запись мог создать параллельный апдейт этого пользователя
+            record = self._records.setdefault(storage_key, list(loaded) if loaded else [None, {}, time.time()])
+        return storage_key, record
+
+    def _touch(self, storage_key: str, record: list):
+        record[2] = time.time()
+        self._dirty.add(storage_key)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run_worker())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key, record = await self._get_record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._touch(storage_key, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, record = await self._get_record(key)
+        return record[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key, record = await self._get_record(key)
+        record[1] = dict(data)
+        self._touch(storage_key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, record = await self._get_record(key)
+        return record[1].copy()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        rows = []
+        deleted = []
+        for storage_key in dirty:
+            record = self._records.get(storage_key)
+            if record is None:
+                continue
+            state, data, updated_at = record
+            if state is None and not data:
+                # Пустую сессию (после state.clear()) в БД не храним
+                deleted.append(storage_key)
+                continue
+            try:
+                rows.append((storage_key, state, json.dumps(data, ensure_ascii=False), updated_at))
+            except (TypeError, ValueError) as e:
+                logger.error("FSM: данные %s не сериализуются в JSON и не будут сохранены: %s", storage_key, e)
+        try:
+            await save_fsm_records(rows, deleted)
+        except BaseException as e:
+            # Не теряем изменения — повторим при следующем сбросе
+            self._dirty |= dirty
+            if not isinstance(e, Exception):
+                raise
+            logger.error("FSM: ошибка записи сессий: %s", e)
+            return
+        for storage_key in deleted:
+            record = self._records.get(storage_key)
+            if storage_key not in self._dirty and record is not None and record[0] is None and not record[1]:
+                self._records.pop(storage_key, None)
+
+    async def sweep(self):
+        now = time.time()
+        self._last_sweep = now
+        for storage_key, record in list(self._records.items()):
+            if storage_key not in self._dirty and now - record[2] > self.memory_idle:
+                self._records.pop(storage_key, None)
+        removed = await delete_expired_fsm_records(now - self.ttl)
+        if removed:
+            logger.info("FSM: удалено %d просроченных сессий", removed)
+
+    async def _run_worker(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.time() - self._last_sweep >= self.sweep_interval:
+                await self.sweep()
+            if not self._dirty and not self._records:
+                return
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self.flush()
@@ -1,18 +1,27 @@
-from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command
+from aiogram import F, Bot
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
 from db import LOCAL_TZ_OFFSET
 
-from db import read_menu, write_menu, get_orders_filtered, get_all_user_ids, create_promo, get_promos, get_promo_by_code, delete_promo, get_promo_stats, get_menu_item_by_id
-from keyboards import admin_main_kb, admin_categories_kb, promo_type_kb, admin_promos_kb, admin_promo_actions_kb, admin_promo_categories_kb, admin_promo_items_kb
+from db import read_menu, add_category, delete_category, add_dish, delete_dish, get_orders_page, count_orders, get_orders_version, export_orders_csv, create_promo, get_promos, get_promo_by_code, delete_promo, get_promo_stats, get_menu_item_by_id, lookup_menu_item, lookup_menu_category, get_sales_report
+from keyboards import admin_main_kb, admin_categories_kb, promo_type_kb, admin_promos_kb, admin_promo_actions_kb, admin_promo_categories_kb, admin_promo_items_kb, admin_stats_kb, STATS_PERIODS, admin_metrics_kb
 from states import AdminStates
+from indexed_router import IndexedRouter
+from callbacks import AdminCategoryCallback, PromoCallback, PromoCategoryCallback, PromoItemCallback, OrdersPageCallback, StatsCallback
+from broadcast import start_broadcast
 from config import ADMIN_IDS
+from metrics import handler_summary, db_summary, gauges
+from profiler import start_profiling, finish_profiling, profiling_active, PROFILE_DEFAULT_UPDATES, PROFILE_MAX_SECONDS
 
 import datetime
+import logging
+import os
+import tempfile
 
-router = Router()
+router = IndexedRouter()
+logger = logging.getLogger(__name__)
 
 
 async def is_admin(user_id: int) -> bool:
@@ -44,7 +53,7 @@ async def admin_view_menu(callback: CallbackQuery):
     if not await is_admin(callback.from_user.id):
         return
     
-    menu_list = read_menu()
+    menu_list = await read_menu()
     text = "<b>Текущее меню</b>\n\n"
     
     if not menu_list:
@@ -74,9 +83,7 @@ async def admin_add_category(message: Message, state: FSMContext):
         return
     
     category = message.text.strip()
-    menu_list = read_menu()
-    menu_list.append({"category": category, "items": []})
-    write_menu(menu_list)
+    await add_category(category)
     
     await message.answer(f"Категория «{category}» добавлена!", reply_markup=admin_main_kb())
     await state.clear()
@@ -87,43 +94,36 @@ async def admin_delete_category_start(callback: CallbackQuery, state: FSMContext
     if not await is_admin(callback.from_user.id):
         return
     
-    if not read_menu():
+    if not await read_menu():
         await callback.message.edit_text("Меню пустое — нет категорий для удаления.", reply_markup=admin_main_kb())
         return
     
-    kb = admin_categories_kb("delete_cat_")
+    kb = await admin_categories_kb("del")
     await callback.message.edit_text("Выберите категорию для удаления:", reply_markup=kb)
     await state.set_state(AdminStates.choosing_delete_category)
 
 
-@router.callback_query(F.data.startswith("admin_delete_cat_"))
-async def admin_delete_category_confirm(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(AdminCategoryCallback.filter(F.action == "del"))
+async def admin_delete_category_confirm(callback: CallbackQuery, callback_data: AdminCategoryCallback, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
     
-    category = callback.data[len("admin_delete_cat_"):]
-    menu_list = read_menu()
-    found = False
-    
-    for i, cat_dict in enumerate(menu_list):
-        if cat_dict["category"] == category:
-            if cat_dict["items"]:
-                await callback.message.edit_text(
-                    f"Ошибка: категория «{category}» содержит блюда. Сначала удалите блюда.",
-                    reply_markup=admin_main_kb()
-                )
-            else:
-                menu_list.pop(i)
-                write_menu(menu_list)
-                await callback.message.edit_text(
-                    f"Категория «{category}» удалена!",
-                    reply_markup=admin_main_kb()
-                )
-            found = True
-            break
+    await read_menu()
+    cat_dict = lookup_menu_category(callback_data.category_id)
+    category = cat_dict["category"] if cat_dict else None
     
-    if not found:
+    if not cat_dict:
         await callback.message.edit_text("Категория не найдена.", reply_markup=admin_main_kb())
+    elif not await delete_category(cat_dict["id"]):
+        await callback.message.edit_text(
+            f"Ошибка: категория «{category}» содержит блюда. Сначала удалите блюда.",
+            reply_markup=admin_main_kb()
+        )
+    else:
+        await callback.message.edit_text(
+            f"Категория «{category}» удалена!",
+            reply_markup=admin_main_kb()
+        )
     
     await state.clear()
 
@@ -133,28 +133,33 @@ async def admin_add_dish_start(callback: CallbackQuery, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
     
-    if not read_menu():
+    if not await read_menu():
         await callback.message.edit_text("Меню пустое. Сначала добавьте категорию.", reply_markup=admin_main_kb())
         return
     
-    kb = admin_categories_kb("add_dish_cat_", include_new=True)
+    kb = await admin_categories_kb("add_dish", include_new=True)
     await callback.message.edit_text("Выберите категорию для добавления блюда:", reply_markup=kb)
     await state.set_state(AdminStates.choosing_add_dish_category)
 
 
-@router.callback_query(F.data.startswith("admin_add_dish_cat_"))
-async def admin_add_dish_category_selected(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(AdminCategoryCallback.filter(F.action == "add_dish"))
+async def admin_add_dish_category_selected(callback: CallbackQuery, callback_data: AdminCategoryCallback, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
     
-    data = callback.data[len("admin_add_dish_cat_"):]
-    
-    if data == "new":
+    if not callback_data.category_id:
         await callback.message.edit_text("Введите название новой категории:")
         await state.set_state(AdminStates.adding_new_category_for_dish)
         return
     
-    await state.update_data(category=data)
+    await read_menu()
+    cat_dict = lookup_menu_category(callback_data.category_id)
+    if not cat_dict:
+        await callback.message.edit_text("Категория не найдена.", reply_markup=admin_main_kb())
+        await state.clear()
+        return
+    
+    await state.update_data(category=cat_dict["category"])
     await callback.message.edit_text("Введите название блюда:")
     await state.set_state(AdminStates.adding_dish_name)
 
@@ -202,26 +207,11 @@ async def admin_add_dish_finish(message: Message, state: FSMContext):
     data = await state.get_data()
     desc = message.text.strip() if message.text.strip().lower() != "нет" else ""
     
-    menu_list = read_menu()
-    found = False
-    
-    for cat_dict in menu_list:
-        if cat_dict["category"] == data["category"]:
-            cat_dict["items"].append({
-                "name": data["name"],
-                "price": data["price"],
-                "desc": desc
-            })
-            found = True
-            break
-    
-    if not found:
-        menu_list.append({
-            "category": data["category"],
-            "items": [{"name": data["name"], "price": data["price"], "desc": desc}]
-        })
+    menu_list = await read_menu()
+    cat_dict = next((c for c in menu_list if c["category"] == data["category"]), None)
+    category_id = cat_dict["id"] if cat_dict else await add_category(data["category"])
     
-    write_menu(menu_list)
+    await add_dish(category_id, data["name"], data["price"], desc)
     
     await message.answer(
         f"Блюдо «{data['name']}» добавлено в категорию «{data['category']}»!",
@@ -235,28 +225,24 @@ async def admin_delete_dish_start(callback: CallbackQuery, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
     
-    if not read_menu():
+    if not await read_menu():
         await callback.message.edit_text("Меню пустое — нет блюд для удаления.", reply_markup=admin_main_kb())
         return
     
-    kb = admin_categories_kb("delete_dish_cat_")
+    kb = await admin_categories_kb("del_dish")
     await callback.message.edit_text("Выберите категорию для удаления блюда:", reply_markup=kb)
     await state.set_state(AdminStates.choosing_delete_dish_category)
 
 
-@router.callback_query(F.data.startswith("admin_delete_dish_cat_"))
-async def admin_delete_dish_show(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(AdminCategoryCallback.filter(F.action == "del_dish"))
+async def admin_delete_dish_show(callback: CallbackQuery, callback_data: AdminCategoryCallback, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
     
-    category = callback.data[len("admin_delete_dish_cat_"):]
-    menu_list = read_menu()
-    items = None
-    
-    for cat_dict in menu_list:
-        if cat_dict["category"] == category:
-            items = cat_dict["items"]
-            break
+    await read_menu()
+    cat_dict = lookup_menu_category(callback_data.category_id)
+    category = cat_dict["category"] if cat_dict else None
+    items = cat_dict["items"] if cat_dict else None
     
     if not items:
         await callback.message.edit_text("В этой категории нет блюд.", reply_markup=admin_main_kb())
@@ -270,7 +256,7 @@ async def admin_delete_dish_show(callback: CallbackQuery, state: FSMContext):
     text += "\nВведите номер блюда для удаления:"
     
     await callback.message.edit_text(text, parse_mode="HTML")
-    await state.update_data(delete_category=category, delete_items=items)
+    await state.update_data(delete_category=category, delete_item_ids=[item["id"] for item in items])
     await state.set_state(AdminStates.deleting_dish_num)
 
 
@@ -282,22 +268,21 @@ async def admin_delete_dish_finish(message: Message, state: FSMContext):
     try:
         num = int(message.text.strip()) - 1
         data = await state.get_data()
-        items = data["delete_items"]
+        item_ids = data["delete_item_ids"]
         
-        if num < 0 or num >= len(items):
+        if num < 0 or num >= len(item_ids):
             raise ValueError
         
-        removed = items.pop(num)
-        menu_list = read_menu()
-        
-        for cat_dict in menu_list:
-            if cat_dict["category"] == data["delete_category"]:
-                cat_dict["items"] = items
-                break
-        
-        write_menu(menu_list)
-        
-        await message.answer(f"Удалено: {removed['name']}", reply_markup=admin_main_kb())
+        removed = await get_menu_item_by_id(item_ids[num])
+        if not removed:
+            raise ValueError
+        if await delete_dish(item_ids[num]):
+            await message.answer(f"Удалено: {removed['name']}", reply_markup=admin_main_kb())
+        else:
+            await message.answer(
+                f"Ошибка: «{removed['name']}» выдаётся по промокоду. Сначала удалите промокод.",
+                reply_markup=admin_main_kb()
+            )
     
     except:
         await message.answer("Неверный номер!", reply_markup=admin_main_kb())
@@ -314,7 +299,7 @@ MAX_MESSAGE_LEN = 3800
 
 
 def format_order_block(order) -> str:
-    time_str = order.get("time", "—")
+    time_str = order.get("time") or "—"
     username = order.get("username", "Скрыт")
     phone = order.get("phone", "Не указан")
     delivery_type = order.get("delivery_type", "Не указан")
@@ -359,32 +344,52 @@ def format_order_block(order) -> str:
     return "\n".join(result)
 
 
-def split_orders_into_pages(orders, per_page=ORDERS_PER_PAGE) -> list[str]:
-    pages = []
-    current = []
-    current_len = 0
-
-    for order in orders:
+def take_orders_page(orders, per_page=ORDERS_PER_PAGE) -> tuple[str, int]:
+    # Текст страницы и сколько заказов в неё вошло: не больше per_page и не длиннее MAX_MESSAGE_LEN
+    blocks = []
+    length = 0
+    for order in orders[:per_page]:
         block = format_order_block(order)
-        block_len = len(block)
-
-        if current_len + block_len > MAX_MESSAGE_LEN and current:
-            pages.append("".join(current))
-            current = []
-            current_len = 0
-
-        current.append(block)
-        current_len += block_len
-
-        if len(current) >= per_page:
-            pages.append("".join(current))
-            current = []
-            current_len = 0
-
-    if current:
-        pages.append("".join(current))
-
-    return pages
+        if blocks and length + len(block) > MAX_MESSAGE_LEN:
+            break
+        blocks.append(block)
+        length += len(block)
+    return "".join(blocks), len(blocks)
+
+
+# Отрисованные страницы заказов: admin id -> сессия просмотра с текущим фильтром.
+# Страницы догружаются по курсору при листании вперёд и сбрасываются,
+# когда меняется фильтр или появляется новый заказ (meta.orders_version).
+_orders_sessions: dict[int, dict] = {}
+
+
+async def get_orders_session(admin_id: int, data: dict) -> dict:
+    key = (data.get("orders_period"), data.get("orders_date_from"), data.get("orders_date_to"))
+    version = await get_orders_version()
+    session = _orders_sessions.get(admin_id)
+    if session is None or session["key"] != key or session["version"] != version:
+        session = {
+            "key": key,
+            "version": version,
+            "count": await count_orders(*key),
+            "pages": [],
+            "cursor": None,   # (timestamp, id) последнего заказа на последней загруженной странице
+            "done": False,
+        }
+        _orders_sessions[admin_id] = session
+    return session
+
+
+async def load_orders_pages(session: dict, page: int):
+    # Догружает страницы до page включительно (или до конца заказов)
+    while len(session["pages"]) <= page and not session["done"]:
+        orders = await get_orders_page(*session["key"], before=session["cursor"], limit=ORDERS_PER_PAGE + 1)
+        text, used = take_orders_page(orders)
+        if used:
+            session["pages"].append(text)
+            last = orders[used - 1]
+            session["cursor"] = (last["timestamp"], last["id"])
+        session["done"] = used == len(orders)
 
 
 async def show_orders_page(
@@ -393,17 +398,11 @@ async def show_orders_page(
     page: int = 0
 ):
     data = await state.get_data()
-    period = data.get("orders_period")
-    date_from = data.get("orders_date_from")
-    date_to = data.get("orders_date_to")
+    session = await get_orders_session(event.from_user.id, data)
+    await load_orders_pages(session, max(page, 0))
+    pages = session["pages"]
 
-    orders = get_orders_filtered(
-        period=period,
-        date_from=date_from,
-        date_to=date_to
-    )
-
-    if not orders:
+    if not pages:
         text = "Заказов за выбранный период нет."
         kb = get_orders_filter_kb()
         
@@ -416,17 +415,16 @@ async def show_orders_page(
             await event.answer(text, reply_markup=kb, parse_mode="HTML")
         return
 
-    pages = split_orders_into_pages(orders)
-
     if page < 0:
         page = 0
     if page >= len(pages):
         page = len(pages) - 1
 
-    text = f"<b>Заказы</b>  (страница {page+1}/{len(pages)})\n\n"
+    text = f"<b>Заказы</b>  (страница {page+1}, всего заказов: {session['count']})\n\n"
     text += pages[page]
 
-    kb = get_orders_pagination_kb(page, len(pages))
+    has_next = page < len(pages) - 1 or not session["done"]
+    kb = get_orders_pagination_kb(page, has_next)
 
     if isinstance(event, CallbackQuery):
         try:
@@ -449,18 +447,19 @@ def get_orders_filter_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def get_orders_pagination_kb(page: int, total_pages: int) -> InlineKeyboardMarkup:
+def get_orders_pagination_kb(page: int, has_next: bool) -> InlineKeyboardMarkup:
     row1 = []
     if page > 0:
-        row1.append(InlineKeyboardButton(text="« Пред.", callback_data=f"orders_page_{page-1}"))
-    if page < total_pages - 1:
-        row1.append(InlineKeyboardButton(text="След. »", callback_data=f"orders_page_{page+1}"))
+        row1.append(InlineKeyboardButton(text="« Пред.", callback_data=OrdersPageCallback(page=page - 1).pack()))
+    if has_next:
+        row1.append(InlineKeyboardButton(text="След. »", callback_data=OrdersPageCallback(page=page + 1).pack()))
 
     row2 = [
         InlineKeyboardButton(text="← Назад к выбору периода", callback_data="orders_back_to_filter"),
     ]
 
     kb_lines = [row1] if row1 else []
+    kb_lines.append([InlineKeyboardButton(text="📥 Выгрузить в CSV", callback_data="orders_export")])
     kb_lines.append(row2)
 
     return InlineKeyboardMarkup(inline_keyboard=kb_lines)
@@ -563,25 +562,57 @@ async def process_date_to(message: Message, state: FSMContext):
         )
 
 
-@router.callback_query(F.data.startswith("orders_page_"))
-async def process_orders_pagination(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(OrdersPageCallback.filter())
+async def process_orders_pagination(callback: CallbackQuery, callback_data: OrdersPageCallback, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
 
     try:
-        page = int(callback.data.replace("orders_page_", ""))
-        await show_orders_page(callback, state, page=page)
-    except Exception as e:
-        print(f"Ошибка пагинации: {e}")
+        await show_orders_page(callback, state, page=callback_data.page)
+    except Exception:
+        logger.exception("Ошибка пагинации заказов")
         await callback.answer("Ошибка переключения страницы", show_alert=True)
 
 
+def orders_period_title(data: dict) -> str:
+    period = data.get("orders_period")
+    date_from = data.get("orders_date_from")
+    date_to = data.get("orders_date_to")
+    if date_from or date_to:
+        return f"{date_from or '…'} — {date_to or '…'}"
+    return {"today": "сегодня", "3days": "последние 3 дня", "week": "последняя неделя"}.get(period, "все заказы")
+
+
+@router.callback_query(F.data == "orders_export")
+async def export_orders(callback: CallbackQuery, state: FSMContext, bot: Bot):
+    if not await is_admin(callback.from_user.id):
+        return
+    await callback.answer("Готовлю файл…")
+
+    data = await state.get_data()
+    fd, path = tempfile.mkstemp(prefix="orders_", suffix=".csv")
+    os.close(fd)
+    try:
+        # Файл пишется в отдельном потоке порциями; в память целиком не загружается
+        count = await export_orders_csv(path, data.get("orders_period"), data.get("orders_date_from"), data.get("orders_date_to"))
+        if not count:
+            await callback.message.answer("Заказов за выбранный период нет.")
+            return
+        local_now = datetime.datetime.utcnow() + LOCAL_TZ_OFFSET
+        document = FSInputFile(path, filename=f"orders_{local_now:%Y%m%d_%H%M}.csv")
+        await bot.send_document(callback.message.chat.id, document,
+                                caption=f"Заказы: {orders_period_title(data)} — {count} шт.")
+    finally:
+        os.remove(path)
+
+
 @router.callback_query(F.data == "orders_back_to_filter")
 async def back_to_orders_filter(callback: CallbackQuery, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
 
     await state.clear()  # Очищаем состояние при возврате к выбору периода
+    _orders_sessions.pop(callback.from_user.id, None)
 
     text = "<b>Просмотр заказов</b>\n\nВыберите период:"
     kb = get_orders_filter_kb()
@@ -598,7 +629,7 @@ async def admin_broadcast(callback: CallbackQuery, state: FSMContext):
         return
     await callback.answer()
 
-    text = "📤 Введите сообщение для рассылки всем пользователям бота:"
+    text = "📤 Введите сообщение для рассылки всем пользователям бота (можно фото с подписью):"
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="← Отмена", callback_data="admin_back")]
     ])
@@ -606,27 +637,34 @@ async def admin_broadcast(callback: CallbackQuery, state: FSMContext):
     await state.set_state(AdminStates.waiting_broadcast_message)
 
 
+CAPTION_MAX_LEN = 1024
+
+
 @router.message(AdminStates.waiting_broadcast_message)
 async def process_broadcast_message(message: Message, state: FSMContext, bot: Bot):
     if not await is_admin(message.from_user.id):
         return
 
-    broadcast_message = message.text.strip()
-    if not broadcast_message:
+    # Сохраняем форматирование админа; фото отправляется с подписью
+    photo = message.photo[-1].file_id if message.photo else None
+    broadcast_message = message.html_text.strip()
+    if not broadcast_message and not photo:
         await message.answer("Сообщение не может быть пустым. Повторите ввод:")
         return
+    # Длинную подпись Telegram отклонит у каждого получателя — проверяем сразу.
+    # Лимит — по видимому тексту без HTML-тегов, в UTF-16 (эмодзи считаются за два)
+    caption_len = len((message.caption or "").encode("utf-16-le")) // 2
+    if photo and caption_len > CAPTION_MAX_LEN:
+        await message.answer(
+            f"Подпись к фото слишком длинная: {caption_len} символов, Telegram допускает "
+            f"не больше {CAPTION_MAX_LEN}. Сократите подпись или отправьте текст без фото:"
+        )
+        return
 
-    user_ids = get_all_user_ids()
-    sent_count = 0
-    for user_id in user_ids:
-        try:
-            await bot.send_message(int(user_id), broadcast_message)
-            sent_count += 1
-        except Exception as e:
-            print(f"Ошибка отправки пользователю {user_id}: {e}")
-
-    await message.answer(f"✅ Рассылка завершена. Отправлено {sent_count} пользователям.", reply_markup=admin_main_kb())
     await state.clear()
+    # Рассылка идёт в фоне: прогресс обновляется в отдельном сообщении
+    job = await start_broadcast(bot, message.chat.id, broadcast_message, photo)
+    await message.answer(f"Рассылка #{job['id']} запущена.", reply_markup=admin_main_kb())
 
 
 # Новое: подменю промокодов
@@ -634,16 +672,16 @@ async def process_broadcast_message(message: Message, state: FSMContext, bot: Bo
 async def admin_promos(callback: CallbackQuery, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
-    await callback.message.edit_text("Управление промокодами", reply_markup=admin_promos_kb())
+    await callback.message.edit_text("Управление промокодами", reply_markup=await admin_promos_kb())
     await state.set_state(AdminStates.managing_promos)
 
 # Новое: просмотр конкретного промокода
-@router.callback_query(F.data.startswith("admin_view_promo_"))
-async def admin_view_promo(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(PromoCallback.filter(F.action == "view"))
+async def admin_view_promo(callback: CallbackQuery, callback_data: PromoCallback, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
-    promo_id = int(callback.data[len("admin_view_promo_"):])
-    promos = get_promos()
+    promo_id = callback_data.promo_id
+    promos = await get_promos()
     promo = next((p for p in promos if p[0] == promo_id), None)
     if not promo:
         await callback.answer("Промокод не найден", show_alert=True)
@@ -651,35 +689,37 @@ async def admin_view_promo(callback: CallbackQuery, state: FSMContext):
     _, name, code, min_sum, promo_type, item_id, discount = promo
     text = f"Промокод: {name} ({code})\nУсловие: от {min_sum} ₽\nТип: {'Бесплатная позиция' if promo_type == 'item' else 'Скидка'}\n"
     if promo_type == 'item':
-        item = get_menu_item_by_id(item_id)
-        text += f"Позиция: {item['name']} (бесплатно)"
+        item = await get_menu_item_by_id(item_id)
+        if item:
+            text += f"Позиция: {item['name']} (бесплатно)"
+        else:
+            text += "Позиция: блюдо удалено из меню — промокод не сработает"
     else:
         text += f"Скидка: {discount} ₽"
     await callback.message.edit_text(text, reply_markup=admin_promo_actions_kb(promo_id))
 
 # Новое: статистика по промокоду
-@router.callback_query(F.data.startswith("admin_promo_stats_"))
-async def admin_promo_stats(callback: CallbackQuery):
+@router.callback_query(PromoCallback.filter(F.action == "stats"))
+async def admin_promo_stats(callback: CallbackQuery, callback_data: PromoCallback):
     if not await is_admin(callback.from_user.id):
         return
-    promo_id = int(callback.data[len("admin_promo_stats_"):])
-    promos = get_promos()
+    promo_id = callback_data.promo_id
+    promos = await get_promos()
     promo = next((p for p in promos if p[0] == promo_id), None)
     if not promo:
         await callback.answer("Промокод не найден", show_alert=True)
         return
     code = promo[2]
-    count = get_promo_stats(code)
+    count = await get_promo_stats(code)
     await callback.answer(f"Использовано: {count} раз в завершенных заказах", show_alert=True)
 
 # Новое: удаление промокода
-@router.callback_query(F.data.startswith("admin_delete_promo_"))
-async def admin_delete_promo(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(PromoCallback.filter(F.action == "del"))
+async def admin_delete_promo(callback: CallbackQuery, callback_data: PromoCallback, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
-    promo_id = int(callback.data[len("admin_delete_promo_"):])
-    delete_promo(promo_id)
-    await callback.message.edit_text("Промокод удален", reply_markup=admin_promos_kb())
+    await delete_promo(callback_data.promo_id)
+    await callback.message.edit_text("Промокод удален", reply_markup=await admin_promos_kb())
 
 # Новое: начало добавления промокода
 @router.callback_query(F.data == "admin_add_promo")
@@ -702,7 +742,7 @@ async def admin_add_promo_min_sum(message: Message, state: FSMContext):
     if not await is_admin(message.from_user.id):
         return
     code = message.text.strip().upper()
-    if get_promo_by_code(code):
+    if await get_promo_by_code(code):
         await message.answer("Промокод уже существует! Введите другой.")
         return
     await state.update_data(promo_code=code)
@@ -730,7 +770,7 @@ async def admin_add_promo_type_selected(callback: CallbackQuery, state: FSMConte
         await callback.message.edit_text("Введите сумму скидки (рублей, только цифры):")
         await state.set_state(AdminStates.adding_promo_discount)
     else:  # item
-        await callback.message.edit_text("Выберите категорию для позиции:", reply_markup=admin_promo_categories_kb())
+        await callback.message.edit_text("Выберите категорию для позиции:", reply_markup=await admin_promo_categories_kb())
         await state.set_state(AdminStates.choosing_promo_item_category)
 
 @router.message(AdminStates.adding_promo_discount)
@@ -741,46 +781,232 @@ async def admin_add_promo_finish_discount(message: Message, state: FSMContext):
         await message.answer("Ошибка: сумма должна быть числом!")
         return
     data = await state.get_data()
-    create_promo(data["promo_name"], data["promo_code"], data["promo_min_sum"], "discount", discount=int(message.text.strip()))
-    await message.answer("Промокод создан!", reply_markup=admin_promos_kb())
+    await create_promo(data["promo_name"], data["promo_code"], data["promo_min_sum"], "discount", discount=int(message.text.strip()))
+    await message.answer("Промокод создан!", reply_markup=await admin_promos_kb())
     await state.clear()
 
-@router.callback_query(F.data.startswith("admin_promo_cat_"))
-async def admin_promo_select_category(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(PromoCategoryCallback.filter())
+async def admin_promo_select_category(callback: CallbackQuery, callback_data: PromoCategoryCallback, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
-    category = callback.data[len("admin_promo_cat_"):]
-    menu_list = read_menu()
-    items = next((cat["items"] for cat in menu_list if cat["category"] == category), None)
+    await read_menu()
+    cat_dict = lookup_menu_category(callback_data.category_id)
+    items = cat_dict["items"] if cat_dict else None
     if not items:
         await callback.answer("Категория пустая")
         return
-    await state.update_data(promo_category=category, promo_items=items)
-    text = f"Выберите позицию в {category}:"
+    text = f"Выберите позицию в {cat_dict['category']}:"
     await callback.message.edit_text(text, reply_markup=admin_promo_items_kb(items))
 
-@router.callback_query(F.data.startswith("admin_promo_select_item_"))
-async def admin_add_promo_finish_item(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(PromoItemCallback.filter())
+async def admin_add_promo_finish_item(callback: CallbackQuery, callback_data: PromoItemCallback, state: FSMContext):
     if not await is_admin(callback.from_user.id):
         return
     data = await state.get_data()
-    items = data.get("promo_items")
-    try:
-        index = int(callback.data[len("admin_promo_select_item_"):])
-        item = items[index]
-    except:
+    await read_menu()
+    found = lookup_menu_item(callback_data.item_id)
+    if not found or "promo_code" not in data:
         await callback.answer("Ошибка выбора")
         return
-    # Получаем item_id из БД (нужно добавить id в read_menu, но для простоты предположим, что read_menu возвращает с id; иначе перепишите read_menu)
-    # Внимание: нужно обновить read_menu чтобы возвращать id для items!
-    # Для этого изменим read_menu:
-    # В read_menu: items = [{"id": row[0], "name": row[1], "price": row[2], "desc": row[3]} for row in cur.fetchall() где SELECT id, name, price, desc
-    # (Добавьте в db.py: cur.execute("SELECT id, name, price, desc FROM menu_items WHERE category_id = ? ORDER BY id", (cat_id,)))
-    item_id = item["id"]  # Предполагаем, что добавлено
-    create_promo(data["promo_name"], data["promo_code"], data["promo_min_sum"], "item", item_id=item_id)
-    await callback.message.edit_text(f"Промокод создан с позицией {item['name']}!", reply_markup=admin_promos_kb())
+    item = found[1]
+    await create_promo(data["promo_name"], data["promo_code"], data["promo_min_sum"], "item", item_id=item["id"])
+    await callback.message.edit_text(f"Промокод создан с позицией {item['name']}!", reply_markup=await admin_promos_kb())
     await state.clear()
 
 @router.callback_query(F.data == "admin_promo_categories")
 async def admin_promo_back_to_categories(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text("Выберите категорию для позиции:", reply_markup=admin_promo_categories_kb())
\ No newline at end of file
+    await callback.message.edit_text("Выберите категорию для позиции:", reply_markup=await admin_promo_categories_kb())
+
+
+# ────────────────────────────────────────────────
+#               СТАТИСТИКА ПРОДАЖ
+# ────────────────────────────────────────────────
+
+def stats_period_bounds(period: str, local_today: datetime.date) -> tuple[datetime.date | None, datetime.date]:
+    if period == "today":
+        return local_today, local_today
+    if period == "7d":
+        return local_today - datetime.timedelta(days=6), local_today
+    if period == "30d":
+        return local_today - datetime.timedelta(days=29), local_today
+    if period == "month":
+        return local_today.replace(day=1), local_today
+    if period == "year":
+        return local_today.replace(month=1, day=1), local_today
+    return None, local_today
+
+
+def format_sales_report(title: str, report: dict) -> str:
+    orders = report["orders"]
+    text = f"📊 <b>Статистика: {title}</b>\n\n"
+    if not orders:
+        return text + "Заказов за этот период нет."
+
+    text += f"Заказов: {orders}\n"
+    text += f"Выручка: {report['revenue']} ₽\n"
+    text += f"Средний чек: {report['revenue'] // orders} ₽\n"
+    text += f"Позиции: {report['items_revenue']} ₽, доставка: {report['delivery_revenue']} ₽\n"
+    text += f"🚚 Доставка: {report['delivery_orders']}  ·  🏃 Самовывоз: {report['pickup_orders']}\n"
+    if report["days"] > 1:
+        text += f"В среднем за день с заказами: {orders / report['days']:.1f} заказа\n"
+
+    if report["dishes"]:
+        text += "\n<b>Топ блюд</b>\n"
+        for num, dish in enumerate(report["dishes"], 1):
+            free = f", из них бесплатно {dish['free_quantity']}" if dish["free_quantity"] else ""
+            text += f"{num}. {dish['name']} — {dish['quantity']} шт.{free}, {dish['revenue']} ₽\n"
+
+    if report["promos"]:
+        text += f"\n<b>Промокоды</b> (заказов с промокодом: {report['promo_orders']})\n"
+        for promo in report["promos"]:
+            discount = f", скидка {promo['discount']} ₽" if promo["discount"] else ""
+            text += f"• {promo['code']} — использований: {promo['uses']}{discount}\n"
+    return text
+
+
+@router.callback_query(F.data == "admin_stats")
+async def admin_stats(callback: CallbackQuery, state: FSMContext):
+    if not await is_admin(callback.from_user.id):
+        return
+    await state.clear()
+    await callback.message.edit_text("<b>Статистика продаж</b>\n\nВыберите период:", reply_markup=admin_stats_kb(), parse_mode="HTML")
+
+
+@router.callback_query(StatsCallback.filter())
+async def admin_stats_report(callback: CallbackQuery, callback_data: StatsCallback):
+    if not await is_admin(callback.from_user.id):
+        return
+    period = callback_data.period if callback_data.period in STATS_PERIODS else "today"
+    local_today = (datetime.datetime.utcnow() + LOCAL_TZ_OFFSET).date()
+    day_from, day_to = stats_period_bounds(period, local_today)
+
+    # Отчёт строится по суточным итогам — за любой период это десятки-сотни строк
+    report = await get_sales_report(day_from, day_to)
+    text = format_sales_report(STATS_PERIODS[period].lower(), report)
+
+    try:
+        await callback.message.edit_text(text, reply_markup=admin_stats_kb(), parse_mode="HTML")
+    except TelegramBadRequest:
+        await callback.answer("Данные не изменились")
+
+
+# ────────────────────────────────────────────────
+#               МЕТРИКИ
+# ────────────────────────────────────────────────
+
+METRICS_TOP_HANDLERS = 12
+METRICS_TOP_DB = 8
+
+
+def format_ms(seconds: float) -> str:
+    return "&gt;10 с" if seconds == float("inf") else f"{seconds * 1000:.0f} мс"
+
+
+def format_metrics() -> str:
+    # Метрики текущего процесса (при WORKERS > 1 — только воркера этого админа)
+    text = "📈 <b>Метрики</b>\n\n<b>Хендлеры</b> (вызовов · p50 · p95 · запросов к БД · ❗ошибок · ⛔отклонено)\n"
+    handlers = handler_summary()
+    if not handlers:
+        text += "Пока нет данных.\n"
+    for row in handlers[:METRICS_TOP_HANDLERS]:
+        errors = f" · ❗{row['errors']}" if row["errors"] else ""
+        throttled = f" · ⛔{row['throttled']}" if row["throttled"] else ""
+        text += (f"• {row['name']}: {row['count']} · {format_ms(row['p50'])} · {format_ms(row['p95'])}"
+                 f" · {row['db_calls']:.1f}{errors}{throttled}\n")
+
+    calls = db_summary()
+    if calls:
+        text += "\n<b>БД</b> (вызовов · всего · p95)\n"
+        for row in calls[:METRICS_TOP_DB]:
+            errors = f" · ❗{row['errors']}" if row["errors"] else ""
+            text += f"• {row['name']}: {row['count']} · {row['total']:.2f} с · {format_ms(row['p95'])}{errors}\n"
+
+    values = gauges()
+    hits, misses = values.get("user_cache_hits", 0), values.get("user_cache_misses", 0)
+    if hits + misses:
+        text += f"\nКэш профилей: {hits / (hits + misses):.0%} попаданий, записей: {values.get('user_cache_size', 0)}\n"
+    rejected = values.get("throttle_rejected_messages", 0) + values.get("throttle_rejected_callbacks", 0)
+    if rejected:
+        text += (f"Отклонено частых действий: {rejected} (сообщений {values['throttle_rejected_messages']},"
+                 f" нажатий {values['throttle_rejected_callbacks']})\n")
+    if "notifications_queued" in values:
+        text += (f"Уведомления: доставлено {values['notifications_delivered']}, ошибок {values['notifications_failed']},"
+                 f" в очереди {values['notifications_pending']}\n")
+    text += "\np50/p95 — верхние границы корзин гистограммы"
+    return text
+
+
+@router.callback_query(F.data == "admin_metrics")
+async def admin_metrics(callback: CallbackQuery, state: FSMContext):
+    if not await is_admin(callback.from_user.id):
+        return
+    await state.clear()
+    try:
+        await callback.message.edit_text(format_metrics(), reply_markup=admin_metrics_kb(), parse_mode="HTML")
+    except TelegramBadRequest:
+        await callback.answer("Данные не изменились")
+
+
+# ────────────────────────────────────────────────
+#               ПРОФИЛИРОВАНИЕ
+# ────────────────────────────────────────────────
+
+PROFILE_HELP = (
+    "/perf — профилировать следующие {updates} обновлений\n"
+    "/perf 500 — следующие 500 обновлений\n"
+    "/perf 60s — все обновления за 60 секунд\n"
+    "/perf stop — остановить и прислать результат"
+)
+
+
+def parse_profile_args(args: str | None) -> tuple[int | None, float | None] | None:
+    # (обновлений, секунд) из аргумента /perf; None — аргумент не распознан
+    args = (args or "").strip().lower()
+    if not args:
+        return PROFILE_DEFAULT_UPDATES, None
+    try:
+        if args.endswith("s"):
+            seconds = float(args[:-1])
+            return (None, seconds) if seconds > 0 else None
+        updates = int(args)
+        return (updates, None) if updates > 0 else None
+    except ValueError:
+        return None
+
+
+def start_profile_for(bot: Bot, chat_id: int, updates: int | None, seconds: float | None) -> str:
+    if not start_profiling(bot, chat_id, updates=updates, seconds=seconds):
+        return "Профилирование уже идёт. Остановить: /perf stop"
+    if updates is not None:
+        scope = f"следующие {updates} обновлений (не дольше {PROFILE_MAX_SECONDS} с)"
+    else:
+        scope = f"все обновления за {min(seconds, PROFILE_MAX_SECONDS):g} с"
+    # При WORKERS > 1 профилируется только процесс, обработавший команду
+    return f"🔬 Профилирование запущено: {scope}. Файл придёт в этот чат."
+
+
+@router.message(Command("perf"))
+async def profile_command(message: Message, command: CommandObject, bot: Bot):
+    if not await is_admin(message.from_user.id):
+        return
+    if (command.args or "").strip().lower() == "stop":
+        if not profiling_active():
+            await message.answer("Профилирование не запущено.")
+            return
+        await finish_profiling()
+        return
+
+    parsed = parse_profile_args(command.args)
+    if parsed is None:
+        await message.answer(PROFILE_HELP.format(updates=PROFILE_DEFAULT_UPDATES))
+        return
+    await message.answer(start_profile_for(bot, message.chat.id, *parsed))
+
+
+@router.callback_query(F.data == "admin_profile")
+async def admin_profile(callback: CallbackQuery, bot: Bot):
+    if not await is_admin(callback.from_user.id):
+        return
+    text = start_profile_for(bot, callback.message.chat.id, PROFILE_DEFAULT_UPDATES, None)
+    await callback.message.answer(text + "\n\n" + PROFILE_HELP.format(updates=PROFILE_DEFAULT_UPDATES))
+    await callback.answer()
@@ -1,19 +1,25 @@
-from aiogram import Router, F, Bot
+from aiogram import F, Bot
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery, Contact, ReplyKeyboardRemove, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 from aiogram.filters.logic import or_f
 from aiogram.fsm.context import FSMContext
-from db import read_menu, append_order, read_users, save_user_phone, get_user_addresses, save_user_addresses, get_user_orders, get_promo_by_code, is_promo_used_by_user, mark_promo_as_used, get_menu_item_by_id
+from db import read_menu, append_order, get_user, save_user_phone, get_user_addresses, save_user_addresses, get_user_orders, get_promo_by_code, is_promo_used_by_user, mark_promo_as_used, lookup_menu_item, lookup_menu_category
 from keyboards import phone_kb, categories_kb, category_kb, cart_kb
+from cart import get_cart, cart_count, load_cart, cart_subtotal, cart_totals, empty_cart, with_item, with_discount, FREE_DELIVERY_MIN
+from order_format import group_by_category, line_title, render_order
 from states import UserStates
+from indexed_router import IndexedRouter
+from callbacks import CategoryCallback, DishCallback, AddressCallback
+from notifications import notify_admins
+from message_cleanup import schedule_delete
 from config import WELCOME_PHOTO_PATH
 import datetime
-from collections import defaultdict
+import logging
 from typing import Union
-import asyncio
 
-router = Router()
+router = IndexedRouter()
+logger = logging.getLogger(__name__)
 
 PICKUP_ADDRESS = "Братск, Центральный р-н, ул. Коммунальная, 15Б"
 
@@ -36,20 +42,29 @@ PICKUP_ORDER_END_TIME = datetime.time(17, 00)  # ← НОВОЕ: для само
 PICKUP_PREPARE_MINUTES = 30   # для самовывоза
 DELIVERY_PREPARE_MINUTES = 60  # для доставки — через час
 
-# Стоимость доставки
-FREE_DELIVERY_MIN = 1500
-DELIVERY_COST = 250
+# Минимальная сумма для доставки (стоимость доставки — в cart.py)
 MIN_ORDER_FOR_DELIVERY = 300
 
+# Через сколько секунд удалять подсказки после ввода промокода
+PROMO_ERROR_TTL = 5
+PROMO_SUCCESS_TTL = 2
+
+
+def next_slot_boundary(local_now: datetime.datetime) -> datetime.datetime:
+    # Начало следующего интервала TIME_STEP_MINUTES (10:00, 10:30, ...)
+    interval_start = local_now.replace(second=0, microsecond=0) - datetime.timedelta(
+        minutes=local_now.minute % TIME_STEP_MINUTES)
+    return interval_start + datetime.timedelta(minutes=TIME_STEP_MINUTES)
+
 
 def generate_time_options(min_delay_minutes: int = PICKUP_PREPARE_MINUTES):
     utc_now = datetime.datetime.utcnow()
     local_now = utc_now + LOCAL_TZ_OFFSET
     local_date = local_now.date()
 
-    # Минимальное время: текущее + delay, округление вверх до 30 мин
-    min_time = local_now + datetime.timedelta(minutes=min_delay_minutes)
-    min_time = min_time.replace(second=0, microsecond=0)
+    # Минимальное время: конец текущего интервала + delay, округление вверх до 30 мин.
+    # Так список слотов одинаков для всех в пределах одного интервала
+    min_time = next_slot_boundary(local_now) + datetime.timedelta(minutes=min_delay_minutes)
 
     extra_minutes = min_time.minute % TIME_STEP_MINUTES
     if extra_minutes > 0:
@@ -95,6 +110,49 @@ def generate_time_options(min_delay_minutes: int = PICKUP_PREPARE_MINUTES):
     return options
 
 
+# Клавиатуры слотов общие для всех покупателей: (задержка, «Ближайшее время») ->
+# (действует до, клавиатура). Пересобираются на границе следующего интервала
+_slots_kb_cache: dict[tuple[int, bool], tuple[datetime.datetime, InlineKeyboardMarkup]] = {}
+
+
+def time_slots_kb(min_delay_minutes: int, asap_allowed: bool) -> InlineKeyboardMarkup:
+    local_now = datetime.datetime.utcnow() + LOCAL_TZ_OFFSET
+    key = (min_delay_minutes, asap_allowed)
+    cached = _slots_kb_cache.get(key)
+    if cached and local_now < cached[0]:
+        return cached[1]
+
+    kb_rows = []
+
+    # Кнопка «Ближайшее время» только если сейчас открыто
+    if asap_allowed:
+        kb_rows.append([InlineKeyboardButton(text="🔥 Ближайшее время", callback_data="prep_time_asap")])
+
+    # Обычные слоты по 2 в ряд
+    row = []
+    for label, time_str in generate_time_options(min_delay_minutes=min_delay_minutes):
+        row.append(InlineKeyboardButton(text=label, callback_data=f"prep_time_{time_str}"))
+        if len(row) == 2:
+            kb_rows.append(row)
+            row = []
+    if row:
+        kb_rows.append(row)
+
+    kb_rows.append([InlineKeyboardButton(text="← Назад", callback_data="user_checkout")])
+    kb = InlineKeyboardMarkup(inline_keyboard=kb_rows)
+
+    _slots_kb_cache[key] = (next_slot_boundary(local_now), kb)
+    return kb
+
+
+def prep_time_prompt(min_delay_minutes: int, order_end_time: datetime.time) -> tuple[str, InlineKeyboardMarkup]:
+    # Текст и клавиатура выбора времени готовности (доставка и самовывоз)
+    local_time = (datetime.datetime.utcnow() + LOCAL_TZ_OFFSET).time()
+    kb = time_slots_kb(min_delay_minutes, asap_allowed=local_time < order_end_time)
+    message_text = f"Выберите время готовности заказа:\n\n<i>{get_restaurant_status_text()}</i>"
+    return message_text, kb
+
+
 def get_restaurant_status_text():
     utc_now = datetime.datetime.utcnow()
     local_now = utc_now + LOCAL_TZ_OFFSET
@@ -112,8 +170,7 @@ def get_restaurant_status_text():
 
 async def show_categories(msg_or_cb, state: FSMContext):
     data = await state.get_data()
-    cart = data.get("cart", [])
-    kb = categories_kb(len(cart))
+    kb = await categories_kb(cart_count(get_cart(data)))
     text = "🍲 <b>Сытный Дом</b>\n\nВыберите категорию меню:"
 
     if isinstance(msg_or_cb, CallbackQuery):
@@ -146,14 +203,14 @@ async def block_commands_during_order(message: Message):
     UserStates.waiting_cash_amount,
     UserStates.waiting_comment,
     UserStates.waiting_phone  # ← НОВОЕ: для отмены на этапе номера
-), F.text.lower() == "отмена")
+), F.text.lower() == "отмена", flags={"throttle": False})
 async def cancel_by_text(message: Message, state: FSMContext):
     await state.clear()
     await message.answer("Оформление заказа отменено.", reply_markup=ReplyKeyboardRemove())
     await show_categories(message, state)
 
 
-@router.message(Command("start"))
+@router.message(Command("start"), flags={"throttle": "heavy"})
 async def cmd_start(message: Message, state: FSMContext):
     current_state = await state.get_state()
 
@@ -162,25 +219,25 @@ async def cmd_start(message: Message, state: FSMContext):
         return
 
     user_id = str(message.from_user.id)
-    users = read_users()
+    user = await get_user(user_id)
 
     if WELCOME_PHOTO_PATH:
         try:
             if WELCOME_PHOTO_PATH.startswith(("http://", "https://")):
                 if WELCOME_PHOTO_PATH.startswith("http://"):
-                    print(f"Ошибка: http URL не поддерживается Telegram. Используйте https.")
+                    logger.warning("WELCOME_PHOTO_PATH: http URL не поддерживается Telegram, используйте https")
                 else:
                     await message.answer_photo(photo=WELCOME_PHOTO_PATH)
             else:
                 photo = FSInputFile(WELCOME_PHOTO_PATH)
                 await message.answer_photo(photo=photo)
         except FileNotFoundError:
-            print(f"Файл фото не найден: {WELCOME_PHOTO_PATH}")
+            logger.warning("Файл фото не найден: %s", WELCOME_PHOTO_PATH)
         except Exception as e:
-            print(f"Ошибка отправки фото: {e}")
+            logger.error("Ошибка отправки фото: %s", e)
 
-    if user_id in users:
-        await state.update_data(phone=users[user_id], cart=[])
+    if user:
+        await state.update_data(phone=user["phone"], **empty_cart())
         await show_categories(message, state)
     else:
         await message.answer(
@@ -199,11 +256,9 @@ async def get_phone(message: Message, state: FSMContext):
     
     user_id = str(message.from_user.id)
     
-    users = read_users()
-    users[user_id] = phone_clean  # сохраняем чистые цифры "79016406231"
-    save_user_phone(user_id, phone_clean)  # Исправьте на вашу функцию
+    await save_user_phone(user_id, phone_clean)  # сохраняем чистые цифры "79016406231"
     
-    await state.update_data(phone=phone_clean, cart=[])
+    await state.update_data(phone=phone_clean, **empty_cart())
     await message.answer(
         f"Спасибо! Номер сохранён: +{phone_clean}",  # показываем с +
         reply_markup=ReplyKeyboardRemove()
@@ -241,24 +296,17 @@ async def back_to_categories(callback: CallbackQuery, state: FSMContext):
     await show_categories(callback, state)
 
 
-@router.callback_query(F.data.startswith("user_cat_"))
-async def select_category(callback: CallbackQuery, state: FSMContext):
-    category = callback.data[len("user_cat_"):]
-    
-    menu_list = read_menu()
-    items = None
-    for cat_dict in menu_list:
-        if cat_dict["category"] == category:
-            items = cat_dict["items"]
-            break
+@router.callback_query(CategoryCallback.filter())
+async def select_category(callback: CallbackQuery, callback_data: CategoryCallback, state: FSMContext):
+    await read_menu()  # снимок меню должен быть загружен
+    cat_dict = lookup_menu_category(callback_data.category_id)
+    items = cat_dict["items"] if cat_dict else None
 
     if not items:
         await callback.answer("Категория пустая")
         return
 
-    await state.update_data(current_category=category, current_items=items)
-
-    text = f"<b>{category}</b>\n\n\n"
+    text = f"<b>{cat_dict['category']}</b>\n\n\n"
 
     for num, item in enumerate(items, 1):
         desc = f"\n{item.get('desc', '')}" if item.get('desc') else ""
@@ -268,85 +316,71 @@ async def select_category(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text(text, reply_markup=kb, parse_mode="HTML")
 
 
-@router.callback_query(F.data.startswith("user_add_"))
-async def add_to_cart(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    current_items = data.get("current_items")
-
-    if not current_items:
-        await callback.answer("Ошибка: категория не найдена.", show_alert=True)
-        return
-
-    try:
-        index = int(callback.data[len("user_add_"):])
-    except:
-        await callback.answer("Ошибка добавления")
-        return
-
-    if index >= len(current_items):
+@router.callback_query(DishCallback.filter(), flags={"throttle": "cart"})
+async def add_to_cart(callback: CallbackQuery, callback_data: DishCallback, state: FSMContext):
+    await read_menu()  # снимок меню должен быть загружен
+    found = lookup_menu_item(callback_data.item_id)
+    if not found:
         await callback.answer("Блюдо не найдено")
         return
 
-    item = current_items[index]
-    category = data.get("current_category", "Неизвестная категория")
-
-    cart = data.get("cart", [])
-    cart.append({**item, "category": category})
-    await state.update_data(cart=cart)
+    item = found[1]
+    data = await state.get_data()
+    await state.update_data(**with_item(data, item))
 
     await callback.answer(f"Добавлено: {item['name']}")
 
 
-@router.callback_query(F.data == "user_cart")
-async def show_cart(event: Union[CallbackQuery, Message], state: FSMContext):
+async def render_cart(state: FSMContext) -> tuple[str, InlineKeyboardMarkup] | None:
+    # Единый вид корзины для всех экранов; None — корзина пуста
     data = await state.get_data()
-    cart = data.get("cart", [])
-    if not cart:
-        if isinstance(event, CallbackQuery):
-            await event.answer("Корзина пуста", show_alert=True)
-        else:
-            await event.answer("Корзина пуста")
-        return
-
-    grouped = defaultdict(list)
-    subtotal = 0
-    for citem in cart:
-        grouped[citem["category"]].append(citem)
-        subtotal += int(citem["price"])
-
+    lines, update = await load_cart(data)
+    if update:
+        data.update(update)
+        await state.update_data(**update)
+    if not lines:
+        return None
+
+    totals = cart_totals(data)
     applied_promo = data.get("applied_promo")
-    discount = data.get("promo_discount", 0)
-    total = subtotal - discount
-
-    delivery_cost = 0 if total >= FREE_DELIVERY_MIN else DELIVERY_COST
-    final_total = total + delivery_cost
 
     text = "Ваша корзина\n\n"
 
-    for cat, citems in grouped.items():
+    for cat, citems in group_by_category(lines).items():
         text += f"{cat}\n"
         for item in citems:
-            desc = item.get('desc', '').strip()
-            price = item['price'] if not item.get('is_promo', False) else "бесплатно (промо)"
-            text += f"• {item['name']} — {price} \n"
+            desc = item['desc'].strip()
+            price = item['qty'] * item['price'] if not item['is_promo'] else "бесплатно (промо)"
+            text += f"• {line_title(item)} — {price} \n"
             if desc:
                 text += f"  {desc}\n"
         text += "\n"
 
-    text += f"Сумма заказа: {subtotal} ₽\n"
+    text += f"Сумма заказа: {totals['subtotal']} ₽\n"
     if applied_promo:
         text += f"Промокод применен: {applied_promo['code']}\n"
         if applied_promo['type'] == 'discount':
-            text += f"Скидка: {discount} ₽\n"
-    if delivery_cost == 0:
-        text += "Доставка: бесплатно (от 1500 ₽)\n"
+            text += f"Скидка: {totals['discount']} ₽\n"
+    if totals['delivery_cost'] == 0:
+        text += f"Доставка: бесплатно (от {FREE_DELIVERY_MIN} ₽)\n"
     else:
-        text += f"Доставка: {delivery_cost} ₽\n"
-    text += f"<b>К оплате с доставкой: {final_total} ₽</b>"
+        text += f"Доставка: {totals['delivery_cost']} ₽\n"
+    text += f"<b>К оплате с доставкой: {totals['total']} ₽</b>"
+
+    return text, cart_kb(bool(applied_promo))
 
-    has_promo = bool(applied_promo)
-    markup = cart_kb(has_promo)
 
+@router.callback_query(F.data == "user_cart")
+async def show_cart(event: Union[CallbackQuery, Message], state: FSMContext):
+    rendered = await render_cart(state)
+    if rendered is None:
+        if isinstance(event, CallbackQuery):
+            await event.answer("Корзина пуста", show_alert=True)
+        else:
+            await event.answer("Корзина пуста")
+        return
+
+    text, markup = rendered
     if isinstance(event, CallbackQuery):
         await event.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
         await state.update_data(last_cart_message_id=event.message.message_id)  # Сохраняем для future edit
@@ -362,16 +396,13 @@ async def enter_promo(callback: CallbackQuery, state: FSMContext):
     await state.update_data(promo_prompt_id=prompt_msg.message_id, last_cart_message_id=callback.message.message_id)
     await state.set_state(UserStates.waiting_promo_code)
 
-@router.message(UserStates.waiting_promo_code)
+@router.message(UserStates.waiting_promo_code, flags={"throttle": "promo"})
 async def apply_promo(message: Message, state: FSMContext):
-    import asyncio  # Добавьте в импорты файла, если нет
-
     code = message.text.strip().upper()
     data = await state.get_data()
-    cart = data.get("cart", [])
-    total = sum(int(item["price"]) for item in cart if not item.get('is_promo', False))  # без доставки и без promo item
+    total = cart_subtotal(data)  # без доставки и без promo item
 
-    promo = get_promo_by_code(code)
+    promo = await get_promo_by_code(code)
     bot = message.bot
     chat_id = message.chat.id
     prompt_id = data.get("promo_prompt_id")
@@ -399,14 +430,13 @@ async def apply_promo(message: Message, state: FSMContext):
         # Показываем новую корзину
         new_cart_msg = await message.answer("Корзина обновлена.")  # Временный placeholder
         await show_cart_as_edit(bot, chat_id, new_cart_msg.message_id, state)  # Но на самом деле edit placeholder на корзину
-        await asyncio.sleep(5)  # Ждем 5 сек
-        await error_msg.delete()  # Удаляем ошибку
+        schedule_delete(bot, chat_id, error_msg.message_id, PROMO_ERROR_TTL)  # Удалим ошибку через 5 сек
         return
 
     _, _, _, min_sum, promo_type, item_id, discount = promo
 
     user_id = str(message.from_user.id)
-    if is_promo_used_by_user(user_id, code):
+    if await is_promo_used_by_user(user_id, code):
         error_msg = await message.answer("Вы уже использовали этот промокод.")
         await state.set_state(None)
         if cart_msg_id:
@@ -416,8 +446,7 @@ async def apply_promo(message: Message, state: FSMContext):
                 pass
         new_cart_msg = await message.answer("Корзина обновлена.")
         await show_cart_as_edit(bot, chat_id, new_cart_msg.message_id, state)
-        await asyncio.sleep(5)
-        await error_msg.delete()
+        schedule_delete(bot, chat_id, error_msg.message_id, PROMO_ERROR_TTL)
         return
 
     if total < min_sum:
@@ -430,8 +459,7 @@ async def apply_promo(message: Message, state: FSMContext):
                 pass
         new_cart_msg = await message.answer("Корзина обновлена.")
         await show_cart_as_edit(bot, chat_id, new_cart_msg.message_id, state)
-        await asyncio.sleep(5)
-        await error_msg.delete()
+        schedule_delete(bot, chat_id, error_msg.message_id, PROMO_ERROR_TTL)
         return
 
     # Применяем
@@ -439,15 +467,9 @@ async def apply_promo(message: Message, state: FSMContext):
     await state.update_data(applied_promo=applied_promo)
 
     if promo_type == "item":
-        item = get_menu_item_by_id(item_id)
-        if item:
-            item["price"] = "0"
-            item["is_promo"] = True
-            item["category"] = "Промо"
-            cart.append(item)
-            await state.update_data(cart=cart)
+        await state.update_data(promo_item_id=item_id)
     else:  # discount
-        await state.update_data(promo_discount=discount)
+        await state.update_data(**with_discount(data, discount))
 
     success_msg = await message.answer("Промокод применен!")
     await state.set_state(None)
@@ -456,56 +478,16 @@ async def apply_promo(message: Message, state: FSMContext):
     if cart_msg_id:
         await show_cart_as_edit(bot, chat_id, cart_msg_id, state)
 
-    await asyncio.sleep(2)  # Ждем 2 сек
-    await success_msg.delete()  # Удаляем "Промокод применен!"
+    schedule_delete(bot, chat_id, success_msg.message_id, PROMO_SUCCESS_TTL)  # Удалим "Промокод применен!" через 2 сек
 
 
 async def show_cart_as_edit(bot: Bot, chat_id: int, message_id: int, state: FSMContext):
-    data = await state.get_data()
-    cart = data.get("cart", [])
-    if not cart:
+    rendered = await render_cart(state)
+    if rendered is None:
         await bot.send_message(chat_id, "Корзина пуста")  # Fallback если edit не сработает
         return
 
-    grouped = defaultdict(list)
-    subtotal = 0
-    for citem in cart:
-        grouped[citem["category"]].append(citem)
-        subtotal += int(citem["price"])
-
-    applied_promo = data.get("applied_promo")
-    discount = data.get("promo_discount", 0)
-    total = subtotal - discount
-
-    delivery_cost = 0 if total >= FREE_DELIVERY_MIN else DELIVERY_COST
-    final_total = total + delivery_cost
-
-    text = "Ваша корзина\n\n"
-
-    for cat, citems in grouped.items():
-        text += f"{cat}\n"
-        for item in citems:
-            desc = item.get('desc', '').strip()
-            price = item['price'] if not item.get('is_promo', False) else "бесплатно (промо)"
-            text += f"• {item['name']} — {price} \n"
-            if desc:
-                text += f"  {desc}\n"
-        text += "\n"
-
-    text += f"Сумма заказа: {subtotal} ₽\n"
-    if applied_promo:
-        text += f"Промокод применен: {applied_promo['code']}\n"
-        if applied_promo['type'] == 'discount':
-            text += f"Скидка: {discount} ₽\n"
-    if delivery_cost == 0:
-        text += "Доставка: бесплатно (от 1500 ₽)\n"
-    else:
-        text += f"Доставка: {delivery_cost} ₽\n"
-    text += f"<b>К оплате с доставкой: {final_total} ₽</b>"
-
-    has_promo = bool(applied_promo)
-    markup = cart_kb(has_promo)
-
+    text, markup = rendered
     try:
         await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=markup, parse_mode="HTML")
     except TelegramBadRequest:
@@ -530,7 +512,7 @@ async def process_delivery_type(callback: CallbackQuery, state: FSMContext):
     delivery_type = callback.data[len("delivery_type_"):]
 
     data = await state.get_data()
-    total = sum(int(item["price"]) for item in data.get("cart", []))
+    total = cart_subtotal(data)
 
     if delivery_type == "delivery" and total < MIN_ORDER_FOR_DELIVERY:
         await callback.answer(
@@ -539,22 +521,15 @@ async def process_delivery_type(callback: CallbackQuery, state: FSMContext):
         )
         return
 
-    delivery_cost = 0   
-    if delivery_type == "delivery":
-        if total >= FREE_DELIVERY_MIN:
-            delivery_cost = 0
-        else:
-            delivery_cost = DELIVERY_COST
-
-    await state.update_data(delivery_type=delivery_type, delivery_cost=delivery_cost)
+    await state.update_data(delivery_type=delivery_type)
 
     if delivery_type == "delivery":
         user_id = str(callback.from_user.id)
-        addresses = get_user_addresses(user_id)
+        addresses = await get_user_addresses(user_id)
 
         kb_rows = []
-        for addr in addresses:
-            kb_rows.append([InlineKeyboardButton(text=addr, callback_data=f"saved_address_{addr}")])
+        for index, addr in enumerate(addresses):
+            kb_rows.append([InlineKeyboardButton(text=addr, callback_data=AddressCallback(index=index).pack())])
         kb_rows.append([InlineKeyboardButton(text="Новый адрес", callback_data="new_address")])
         kb_rows.append([InlineKeyboardButton(text="← Назад", callback_data="user_checkout")])
         kb = InlineKeyboardMarkup(inline_keyboard=kb_rows)
@@ -562,39 +537,11 @@ async def process_delivery_type(callback: CallbackQuery, state: FSMContext):
         await callback.message.edit_text("Выберите адрес доставки:", reply_markup=kb)
         await state.set_state(UserStates.waiting_address_choice)
     else:  # самовывоз
-                await state.update_data(delivery_address=PICKUP_ADDRESS)
-
-                # Расчёт текущего местного времени для проверки открытости
-                utc_now = datetime.datetime.utcnow()
-                local_now = utc_now + LOCAL_TZ_OFFSET
-                local_time = local_now.time()
-
-                status_text = get_restaurant_status_text()
-                time_options = generate_time_options(min_delay_minutes=PICKUP_PREPARE_MINUTES)
-
-                kb_rows = []
-
-                # Кнопка «Ближайшее время» только если сейчас открыто
-                if local_time < PICKUP_ORDER_END_TIME:
-                    kb_rows.append([InlineKeyboardButton(text="🔥 Ближайшее время", callback_data="prep_time_asap")])
+        await state.update_data(delivery_address=PICKUP_ADDRESS)
 
-                # Обычные слоты по 2 в ряд
-                row = []
-                for label, time_str in time_options:
-                    row.append(InlineKeyboardButton(text=label, callback_data=f"prep_time_{time_str}"))
-                    if len(row) == 2:
-                        kb_rows.append(row)
-                        row = []
-                if row:
-                    kb_rows.append(row)
-
-                kb_rows.append([InlineKeyboardButton(text="← Назад", callback_data="user_checkout")])
-                kb = InlineKeyboardMarkup(inline_keyboard=kb_rows)
-
-                message_text = f"Выберите время готовности заказа:\n\n<i>{status_text}</i>"
-
-                await callback.message.edit_text(message_text, reply_markup=kb, parse_mode="HTML")
-                await state.set_state(UserStates.waiting_prep_time)
+        message_text, kb = prep_time_prompt(PICKUP_PREPARE_MINUTES, PICKUP_ORDER_END_TIME)
+        await callback.message.edit_text(message_text, reply_markup=kb, parse_mode="HTML")
+        await state.set_state(UserStates.waiting_prep_time)
 
 
 @router.callback_query(F.data == "new_address")
@@ -605,40 +552,17 @@ async def new_address_input(callback: CallbackQuery, state: FSMContext):
     await state.set_state(UserStates.waiting_address)
 
 
-@router.callback_query(F.data.startswith("saved_address_"))
-async def select_saved_address(callback: CallbackQuery, state: FSMContext):
-    address = callback.data[len("saved_address_"):]
+@router.callback_query(AddressCallback.filter())
+async def select_saved_address(callback: CallbackQuery, callback_data: AddressCallback, state: FSMContext):
+    addresses = await get_user_addresses(str(callback.from_user.id))
+    if callback_data.index >= len(addresses):
+        await callback.answer("Адрес не найден, выберите заново", show_alert=True)
+        return
+    address = addresses[callback_data.index]
 
     await state.update_data(delivery_address=address)
 
-    # Расчёт текущего местного времени
-    utc_now = datetime.datetime.utcnow()
-    local_now = utc_now + LOCAL_TZ_OFFSET
-    local_time = local_now.time()
-
-    status_text = get_restaurant_status_text()
-    time_options = generate_time_options(min_delay_minutes=DELIVERY_PREPARE_MINUTES)
-
-    kb_rows = []
-
-    # Кнопка «Ближайшее время» только если сейчас открыто
-    if local_time < ORDER_END_TIME:
-        kb_rows.append([InlineKeyboardButton(text="🔥 Ближайшее время", callback_data="prep_time_asap")])
-
-    # Обычные слоты по 2 в ряд
-    row = []
-    for label, time_str in time_options:
-        row.append(InlineKeyboardButton(text=label, callback_data=f"prep_time_{time_str}"))
-        if len(row) == 2:
-            kb_rows.append(row)
-            row = []
-    if row:
-        kb_rows.append(row)
-
-    kb_rows.append([InlineKeyboardButton(text="← Назад", callback_data="user_checkout")])
-    kb = InlineKeyboardMarkup(inline_keyboard=kb_rows)
-
-    message_text = f"Выберите время готовности заказа:\n\n<i>{status_text}</i>"
+    message_text, kb = prep_time_prompt(DELIVERY_PREPARE_MINUTES, ORDER_END_TIME)
 
     await callback.message.edit_text(message_text, reply_markup=kb, parse_mode="HTML")
     await state.set_state(UserStates.waiting_prep_time)
@@ -652,41 +576,14 @@ async def get_address(message: Message, state: FSMContext):
         return
 
     user_id = str(message.from_user.id)
-    addresses = get_user_addresses(user_id)
+    addresses = await get_user_addresses(user_id)
     if address not in addresses:
         addresses.append(address)
-        save_user_addresses(user_id, addresses)
+        await save_user_addresses(user_id, addresses)
 
     await state.update_data(delivery_address=address)
 
-    # Расчёт текущего местного времени
-    utc_now = datetime.datetime.utcnow()
-    local_now = utc_now + LOCAL_TZ_OFFSET
-    local_time = local_now.time()
-
-    status_text = get_restaurant_status_text()
-    time_options = generate_time_options(min_delay_minutes=DELIVERY_PREPARE_MINUTES)
-
-    kb_rows = []
-
-    # Кнопка «Ближайшее время» только если сейчас открыто
-    if local_time < ORDER_END_TIME:
-        kb_rows.append([InlineKeyboardButton(text="🔥 Ближайшее время", callback_data="prep_time_asap")])
-
-    # Обычные слоты по 2 в ряд
-    row = []
-    for label, time_str in time_options:
-        row.append(InlineKeyboardButton(text=label, callback_data=f"prep_time_{time_str}"))
-        if len(row) == 2:
-            kb_rows.append(row)
-            row = []
-    if row:
-        kb_rows.append(row)
-
-    kb_rows.append([InlineKeyboardButton(text="← Назад", callback_data="user_checkout")])
-    kb = InlineKeyboardMarkup(inline_keyboard=kb_rows)
-
-    message_text = f"Выберите время готовности заказа:\n\n<i>{status_text}</i>"
+    message_text, kb = prep_time_prompt(DELIVERY_PREPARE_MINUTES, ORDER_END_TIME)
 
     await message.answer(message_text, reply_markup=kb, parse_mode="HTML")
     await state.set_state(UserStates.waiting_prep_time)
@@ -750,25 +647,24 @@ async def get_cash_amount(message: Message, state: FSMContext):
 
 @router.message(UserStates.waiting_comment)
 async def get_comment(message: Message, state: FSMContext, bot: Bot):
-    from config import ADMIN_IDS
-
     comment = message.text.strip()
     if comment.lower() == "нет":
         comment = "Без комментария"
 
     data = await state.get_data()
-    if "cart" not in data or not data["cart"]:
+    lines, update = await load_cart(data)
+    if not lines:
         await message.answer("Ошибка: корзина пуста или не инициализирована. Оформление заказа отменено.")
         await state.clear()
         await show_categories(message, state)
         return
+    data.update(update)
     applied_promo = data.get("applied_promo")
-    discount = data.get("promo_discount", 0)
 
     # === БЕЗОПАСНОЕ получение телефона ===
     user_id_str = str(message.from_user.id)
-    users = read_users()
-    phone_raw = users.get(user_id_str)  # Может быть None
+    user = await get_user(user_id_str)
+    phone_raw = user["phone"] if user else None  # Может быть None
 
     if phone_raw is None or not phone_raw:
         phone_display = "Не указан"
@@ -788,70 +684,27 @@ async def get_comment(message: Message, state: FSMContext, bot: Bot):
     delivery_type = data.get("delivery_type", "delivery")
     delivery_address = data.get("delivery_address", "Не указан")
     prep_time = data.get("prep_time", "Не указано")
-    delivery_cost = data.get("delivery_cost", 0)
     payment_method = data.get("payment_method", "Не указано")
     cash_amount = data.get("cash_amount")
-    cart = data["cart"]
-
-    subtotal = sum(int(item["price"]) for item in cart)
-    total_items = sum(int(item["price"]) for item in cart)
-    final_total = total_items + delivery_cost
-
-    grouped = defaultdict(list)
-    for item in cart:
-        grouped[item["category"]].append(item)
-
-    # Текст заказа БЕЗ описаний (для админов и БД)
-    admin_order_text = "Заказ:\n"
-    for cat, items in grouped.items():
-        admin_order_text += f"<b>{cat}</b>\n"
-        for item in items:
-            price_text = f"{item['price']} ₽"
-            if item.get('is_promo', False):
-                code = applied_promo['code'] if applied_promo else ''
-                price_text = f"бесплатно по промокоду {code}"
-            admin_order_text += f"• {item['name']} — {price_text}\n"
-        admin_order_text += "\n"
-
-    admin_order_text += f"Сумма позиций: {subtotal} ₽\n"
-    if applied_promo and applied_promo['type'] == 'discount':
-        admin_order_text += f"Скидка по промокоду {applied_promo['code']}: {discount} ₽\n"
-    if delivery_type == "delivery":
-        if delivery_cost == 0:
-            admin_order_text += "Доставка: бесплатно\n"
-        else:
-            admin_order_text += f"Доставка: {delivery_cost} ₽\n"
-    admin_order_text += f"<b>К оплате: {final_total} ₽</b>"
-
-    # Текст заказа С описаниями (только для клиента)
-    client_order_text = "Заказ:\n"
-    for cat, items in grouped.items():
-        client_order_text += f"<b>{cat}</b>\n"
-        for item in items:
-            desc = item.get('desc', '').strip()
-            price_text = f"{item['price']} ₽"
-            if item.get('is_promo', False):
-                code = applied_promo['code'] if applied_promo else ''
-                price_text = f"бесплатно по промокоду {code}"
-            client_order_text += f"• {item['name']} — {price_text}\n"
-            if desc:
-                client_order_text += f"  {desc}\n"
-        client_order_text += "\n"
 
-    client_order_text += f"Сумма позиций: {subtotal} ₽\n"
-    if applied_promo and applied_promo['type'] == 'discount':
-        client_order_text += f"Скидка по промокоду {applied_promo['code']}: {discount} ₽\n"
-    if delivery_type == "delivery":
-        if delivery_cost == 0:
-            client_order_text += "Доставка: бесплатно\n"
-        else:
-            client_order_text += f"Доставка: {delivery_cost} ₽\n"
-    client_order_text += f"<b>К оплате: {final_total} ₽</b>"
+    totals = cart_totals(data)
+    delivery_cost = totals["delivery_cost"] if delivery_type == "delivery" else 0
+    order = {
+        "items": lines,
+        "promo_code": applied_promo['code'] if applied_promo else None,
+        "discount": totals["discount"],
+        "delivery_type": delivery_type,
+        "delivery_cost": delivery_cost,
+        "total": totals["subtotal"] - totals["discount"] + delivery_cost,
+    }
+
+    # Текст заказа БЕЗ описаний (для админов) и С описаниями (только для клиента)
+    admin_order_text = render_order(order)
+    client_order_text = render_order(order, with_desc=True)
 
     # Сохраняем в БД
-    local_now = (datetime.datetime.utcnow() + LOCAL_TZ_OFFSET).strftime("%d.%m.%Y %H:%M")
-    order_id = append_order(
-        admin_order_text,
+    order_id = await append_order(
+        lines,
         phone_for_db,
         delivery_type,
         delivery_address,
@@ -861,12 +714,15 @@ async def get_comment(message: Message, state: FSMContext, bot: Bot):
         delivery_cost=delivery_cost,
         payment_method=payment_method,
         cash_amount=cash_amount,
-        user_id=user_id_str
+        user_id=user_id_str,
+        promo_code=order["promo_code"],
+        discount=order["discount"],
+        total=order["total"]
         )
 
     # Mark promo used
     if applied_promo:
-        mark_promo_as_used(user_id_str, applied_promo['code'], order_id)
+        await mark_promo_as_used(user_id_str, applied_promo['code'], order_id)
 
     local_now = (datetime.datetime.utcnow() + LOCAL_TZ_OFFSET).strftime("%d.%m.%Y %H:%M")
     local_today = (datetime.datetime.utcnow() + LOCAL_TZ_OFFSET).date()
@@ -901,9 +757,6 @@ async def get_comment(message: Message, state: FSMContext, bot: Bot):
     admin_notification += f"🕒 Время оформления: {local_now}"
     # === КОНЕЦ ИСПРАВЛЕНИЯ ===
 
-    for admin_id in ADMIN_IDS:
-        await bot.send_message(admin_id, admin_notification, parse_mode="HTML")
-
     # Подтверждение клиенту
     client_confirmation = "✅ <b>Спасибо за заказ!</b>\n\n"
     client_confirmation += client_order_text + "\n\n"
@@ -922,6 +775,9 @@ async def get_comment(message: Message, state: FSMContext, bot: Bot):
     await message.answer(client_confirmation, parse_mode="HTML")
     await state.clear()
 
+    # Админам — в фоне и параллельно, клиент не ждёт доставки уведомлений
+    notify_admins(bot, admin_notification)
+
 
 @router.message(Command("clear_addresses"))
 async def clear_addresses(message: Message, state: FSMContext):
@@ -932,14 +788,14 @@ async def clear_addresses(message: Message, state: FSMContext):
         return
 
     user_id = str(message.from_user.id)
-    save_user_addresses(user_id, [])
+    await save_user_addresses(user_id, [])
     await message.answer("Список сохранённых адресов очищен.")
     await show_categories(message, state)
 
 
 @router.callback_query(F.data == "user_clear_cart")
 async def clear_cart(callback: CallbackQuery, state: FSMContext):
-    await state.update_data(cart=[], applied_promo=None, promo_discount=0)
+    await state.update_data(**empty_cart())
     await callback.answer("Корзина очищена", show_alert=False)
     await show_categories(callback, state)
 
@@ -947,9 +803,7 @@ async def clear_cart(callback: CallbackQuery, state: FSMContext):
 async def process_phone_update(message: Message, state: FSMContext, phone_clean: str):
     user_id = str(message.from_user.id)
     
-    users = read_users()
-    users[user_id] = phone_clean  # сохраняем чистые цифры
-    save_user_phone(user_id, phone_clean)
+    await save_user_phone(user_id, phone_clean)  # сохраняем чистые цифры
     
     phone_display = "+" + phone_clean  # для показа пользователю
     
@@ -984,8 +838,7 @@ async def cmd_profile(message: Message, state: FSMContext):
         return
 
     user_id = str(message.from_user.id)
-    users = read_users()
-    if user_id not in users:
+    if not await get_user(user_id):
         await message.answer("Вы не авторизованы. Начните с команды /start")
         return
 
@@ -1000,7 +853,7 @@ async def back_to_profile(callback: CallbackQuery):
 @router.callback_query(F.data == "profile_addresses")
 async def profile_addresses(callback: CallbackQuery):
     user_id = str(callback.from_user.id)
-    addresses = get_user_addresses(user_id)
+    addresses = await get_user_addresses(user_id)
 
     text = "🚗 <b>Сохранённые адреса доставки</b>\n\n"
     if not addresses:
@@ -1017,11 +870,11 @@ async def profile_addresses(callback: CallbackQuery):
     await callback.message.edit_text(text, reply_markup=kb, parse_mode="HTML")
 
 
-@router.callback_query(F.data == "profile_orders")
+@router.callback_query(F.data == "profile_orders", flags={"throttle": "heavy"})
 async def profile_orders(callback: CallbackQuery):
     user_id = str(callback.from_user.id)
 
-    orders = get_user_orders(user_id)
+    orders = await get_user_orders(user_id)
 
     text = "📋 <b>Ваши последние заказы</b> (до 10 шт.)\n\n"
     if not orders:
@@ -1051,8 +904,8 @@ async def profile_phone(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
     user_id = str(callback.from_user.id)
-    users = read_users()
-    phone_clean = users.get(user_id)  # Может быть None, если ключа нет
+    user = await get_user(user_id)
+    phone_clean = user["phone"] if user else None  # Может быть None, если профиля нет
 
     if phone_clean is None or not phone_clean:
         phone_display = "Не указан"
@@ -0,0 +1,104 @@
+import operator
+from typing import Any
+
+from aiogram import Router
+from aiogram.dispatcher.event.bases import UNHANDLED, SkipHandler
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
+from aiogram.filters.callback_data import CallbackQueryFilter
+from aiogram.types import CallbackQuery
+from magic_filter import MagicFilter
+from magic_filter.operations import CallOperation, ComparatorOperation, GetAttributeOperation
+
+# Обычный TelegramEventObserver на каждое нажатие кнопки по очереди проверяет
+# фильтры всех зарегистрированных хендлеров. Здесь хендлеры callback_query
+# раскладываются по индексу: F.data == "..." — по точному значению,
+# F.data.startswith("...") и CallbackData.filter() — по префиксу. На нажатие
+# проверяются только хендлеры, подходящие по индексу (и хендлеры без
+# распознанного фильтра по data), в порядке регистрации — как и в aiogram.
+
+
+def _data_key(filter_: Any) -> tuple[str, str] | None:
+    # ("exact", значение) / ("prefix", префикс) или None, если фильтр не про callback.data
+    if isinstance(filter_, CallbackQueryFilter):
+        callback_data = filter_.callback_data
+        return "prefix", callback_data.__prefix__ + callback_data.__separator__
+    if not isinstance(filter_, MagicFilter):
+        return None
+    ops = filter_._operations
+    if not ops or not isinstance(ops[0], GetAttributeOperation) or ops[0].name != "data":
+        return None
+    if len(ops) == 2 and isinstance(ops[1], ComparatorOperation) and ops[1].comparator is operator.eq \
+            and isinstance(ops[1].right, str):
+        return "exact", ops[1].right
+    if len(ops) == 3 and isinstance(ops[1], GetAttributeOperation) and ops[1].name == "startswith" \
+            and isinstance(ops[2], CallOperation) and not ops[2].kwargs \
+            and len(ops[2].args) == 1 and isinstance(ops[2].args[0], str):
+        return "prefix", ops[2].args[0]
+    return None
+
+
+class IndexedCallbackObserver(TelegramEventObserver):
+    def __init__(self, router: Router, event_name: str) -> None:
+        super().__init__(router=router, event_name=event_name)
+        self._order: dict[int, int] = {}                          # id(handler) -> порядковый номер
+        self._exact: dict[str, list[HandlerObject]] = {}
+        self._prefixes: dict[str, list[HandlerObject]] = {}
+        self._prefix_lengths: list[int] = []
+        self._unindexed: list[HandlerObject] = []
+
+    def register(self, callback, *filters, flags=None, **kwargs):
+        result = super().register(callback, *filters, flags=flags, **kwargs)
+        handler = self.handlers[-1]
+        self._order[id(handler)] = len(self.handlers)
+
+        key = next((k for k in map(_data_key, filters) if k), None)
+        if key is None:
+            self._unindexed.append(handler)
+        elif key[0] == "exact":
+            self._exact.setdefault(key[1], []).append(handler)
+        else:
+            self._prefixes.setdefault(key[1], []).append(handler)
+            self._prefix_lengths = sorted({len(prefix) for prefix in self._prefixes})
+        return result
+
+    def candidates(self, data: str | None) -> list[HandlerObject]:
+        if data is None:
+            return self._unindexed
+        found = list(self._exact.get(data, ()))
+        for length in self._prefix_lengths:
+            if length > len(data):
+                break
+            found.extend(self._prefixes.get(data[:length], ()))
+        if not found:
+            return self._unindexed
+        if self._unindexed:
+            found.extend(self._unindexed)
+        if len(found) > 1:
+            found.sort(key=lambda handler: self._order[id(handler)])
+        return found
+
+    async def trigger(self, event: CallbackQuery, **kwargs: Any) -> Any:
+        # Тот же цикл, что в TelegramEventObserver.trigger, но по кандидатам из индекса
+        for handler in self.candidates(event.data):
+            kwargs["handler"] = handler
+            result, data = await handler.check(event, **kwargs)
+            if result:
+                kwargs.update(data)
+                try:
+                    wrapped_inner = self.outer_middleware.wrap_middlewares(
+                        self._resolve_middlewares(),
+                        handler.call,
+                    )
+                    return await wrapped_inner(event, kwargs)
+                except SkipHandler:
+                    continue
+
+        return UNHANDLED
+
+
+class IndexedRouter(Router):
+    def __init__(self, *, name: str | None = None) -> None:
+        super().__init__(name=name)
+        self.callback_query = IndexedCallbackObserver(router=self, event_name="callback_query")
+        self.observers["callback_query"] = self.callback_query
@@ -1,6 +1,15 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 
 from db import read_menu, get_promos
+from callbacks import (
+    CategoryCallback,
+    DishCallback,
+    AdminCategoryCallback,
+    PromoCallback,
+    PromoCategoryCallback,
+    PromoItemCallback,
+    StatsCallback,
+)
 
 
 # Клавиатура запроса номера телефона
@@ -14,14 +23,14 @@ phone_kb = ReplyKeyboardMarkup(
 
 
 # Клавиатура категорий (без эмодзи)
-def categories_kb(cart_count: int = 0):
-    menu = read_menu()
+async def categories_kb(cart_count: int = 0):
+    menu = await read_menu()
     kb = []
 
     row = []
     for cat_dict in menu:
-        category = cat_dict["category"]
-        button = InlineKeyboardButton(text=category, callback_data=f"user_cat_{category}")
+        button = InlineKeyboardButton(text=cat_dict["category"],
+                                      callback_data=CategoryCallback(category_id=cat_dict["id"]).pack())
         row.append(button)
 
         if len(row) == 2:
@@ -41,9 +50,9 @@ def categories_kb(cart_count: int = 0):
 def category_kb(items: list):
     kb = []
 
-    for idx, item in enumerate(items):
+    for item in items:
         text = f"{item['name']} — {item['price']} ₽"
-        button = InlineKeyboardButton(text=text, callback_data=f"user_add_{idx}")
+        button = InlineKeyboardButton(text=text, callback_data=DishCallback(item_id=item["id"]).pack())
         kb.append([button])
 
     kb.append([
@@ -77,18 +86,48 @@ def admin_main_kb():
         [InlineKeyboardButton(text="📦 Просмотреть заказы", callback_data="admin_view_orders")],
         [InlineKeyboardButton(text="📢 Рассылка", callback_data="admin_broadcast")],
         [InlineKeyboardButton(text="🎫 Промокоды", callback_data="admin_promos")],
+        [InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats")],
+        [InlineKeyboardButton(text="📈 Метрики", callback_data="admin_metrics")],
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+
+# Периоды отчёта статистики: ключ -> подпись кнопки
+STATS_PERIODS = {
+    "today": "Сегодня",
+    "7d": "7 дней",
+    "30d": "30 дней",
+    "month": "Этот месяц",
+    "year": "Этот год",
+    "all": "Всё время",
+}
+
+
+def admin_stats_kb():
+    buttons = [InlineKeyboardButton(text=label, callback_data=StatsCallback(period=period).pack())
+               for period, label in STATS_PERIODS.items()]
+    kb = [buttons[i:i + 3] for i in range(0, len(buttons), 3)]
+    kb.append([InlineKeyboardButton(text="⬅ Назад в админ-панель", callback_data="admin_back")])
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+
+def admin_metrics_kb():
+    kb = [
+        [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_metrics")],
+        [InlineKeyboardButton(text="🔬 Профилировать", callback_data="admin_profile")],
+        [InlineKeyboardButton(text="⬅ Назад в админ-панель", callback_data="admin_back")],
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
-def admin_categories_kb(action_prefix: str, include_new: bool = False):
-    menu = read_menu()
+async def admin_categories_kb(action: str, include_new: bool = False):
+    menu = await read_menu()
     kb = []
     row = []
 
     for cat_dict in menu:
-        cat_name = cat_dict["category"]
-        button = InlineKeyboardButton(text=cat_name, callback_data=f"admin_{action_prefix}{cat_name}")
+        button = InlineKeyboardButton(text=cat_dict["category"],
+                                      callback_data=AdminCategoryCallback(action=action, category_id=cat_dict["id"]).pack())
         row.append(button)
 
         if len(row) == 2:
@@ -99,7 +138,7 @@ def admin_categories_kb(action_prefix: str, include_new: bool = False):
         kb.append(row)
 
     if include_new:
-        kb.append([InlineKeyboardButton(text="➕ Новая категория", callback_data=f"admin_{action_prefix}new")])
+        kb.append([InlineKeyboardButton(text="➕ Новая категория", callback_data=AdminCategoryCallback(action=action, category_id=0).pack())])
 
     kb.append([InlineKeyboardButton(text="⬅ Назад в админ-панель", callback_data="admin_back")])
 
@@ -128,12 +167,12 @@ def promo_type_kb():
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 # Новое: клавиатура списка промокодов (для админа)
-def admin_promos_kb():
-    promos = get_promos()
+async def admin_promos_kb():
+    promos = await get_promos()
     kb = []
     for promo in promos:
         promo_id, name, code = promo[0], promo[1], promo[2]
-        kb.append([InlineKeyboardButton(text=f"{name} ({code})", callback_data=f"admin_view_promo_{promo_id}")])
+        kb.append([InlineKeyboardButton(text=f"{name} ({code})", callback_data=PromoCallback(action="view", promo_id=promo_id).pack())])
     kb.append([InlineKeyboardButton(text="Добавить промокод", callback_data="admin_add_promo")])
     kb.append([InlineKeyboardButton(text="Назад в админ-панель", callback_data="admin_back")])
     return InlineKeyboardMarkup(inline_keyboard=kb)
@@ -141,20 +180,20 @@ def admin_promos_kb():
 # Новое: клавиатура для промокода (статистика, удалить)
 def admin_promo_actions_kb(promo_id: int):
     kb = [
-        [InlineKeyboardButton(text="Показать статистику", callback_data=f"admin_promo_stats_{promo_id}")],
-        [InlineKeyboardButton(text="Удалить", callback_data=f"admin_delete_promo_{promo_id}")],
+        [InlineKeyboardButton(text="Показать статистику", callback_data=PromoCallback(action="stats", promo_id=promo_id).pack())],
+        [InlineKeyboardButton(text="Удалить", callback_data=PromoCallback(action="del", promo_id=promo_id).pack())],
         [InlineKeyboardButton(text="Назад к промокодам", callback_data="admin_promos")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 # Новое: клавиатура категорий для выбора item в промо (аналогично user)
-def admin_promo_categories_kb():
-    menu = read_menu()
+async def admin_promo_categories_kb():
+    menu = await read_menu()
     kb = []
     row = []
     for cat_dict in menu:
-        category = cat_dict["category"]
-        button = InlineKeyboardButton(text=category, callback_data=f"admin_promo_cat_{category}")
+        button = InlineKeyboardButton(text=cat_dict["category"],
+                                      callback_data=PromoCategoryCallback(category_id=cat_dict["id"]).pack())
         row.append(button)
         if len(row) == 2:
             kb.append(row)
@@ -167,9 +206,9 @@ def admin_promo_categories_kb():
 # Новое: клавиатура блюд для промо (аналогично category_kb)
 def admin_promo_items_kb(items: list):
     kb = []
-    for idx, item in enumerate(items):
+    for item in items:
         text = f"{item['name']} — {item['price']} ₽"
-        button = InlineKeyboardButton(text=text, callback_data=f"admin_promo_select_item_{idx}")
+        button = InlineKeyboardButton(text=text, callback_data=PromoItemCallback(item_id=item["id"]).pack())
         kb.append([button])
     kb.append([InlineKeyboardButton(text="← Назад к категориям", callback_data="admin_promo_categories")])
     return InlineKeyboardMarkup(inline_keyboard=kb)
\ No newline at end of file
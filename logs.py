@@ -0,0 +1,167 @@
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+from aiogram import BaseMiddleware, Dispatcher
+
+from config import LOG_LEVEL, LOG_FORMAT, LOG_UPDATE_SAMPLE
+
+# Структурные логи: по строке JSON на запись в stdout. Форматирование и запись
+# идут в отдельном потоке (QueueHandler → QueueListener), event loop только
+# кладёт запись в очередь. Записи, сделанные во время обработки обновления,
+# получают update_id, user_id и имя хендлера из contextvars.
+#
+# Частые события пишутся выборочно: logger.info(..., extra={"sample": 0.01})
+# оставляет примерно каждую сотую запись. WARNING и выше не отбрасываются.
+# Так же прореживаются записи о каждом обновлении от aiogram («Update id=... is
+# handled») и о каждом запросе к aiohttp-серверу вебхука (access log).
+
+# Стандартные атрибуты LogRecord — всё остальное пришло через extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+_CONTEXT_FIELDS = ("update_id", "user_id", "handler")
+SAMPLED_LOGGERS = ("aiogram.event", "aiohttp.access")
+
+_context: contextvars.ContextVar[dict | None] = contextvars.ContextVar("log_context", default=None)
+_listener: logging.handlers.QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != "sample":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    # Выполняется в вызывающем потоке, пока контекст обновления ещё доступен
+    def __init__(self, static: dict):
+        super().__init__()
+        self.static = static
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in self.static.items():
+            setattr(record, key, value)
+        context = _context.get()
+        if context is None and record.exc_info and record.exc_info[1] is not None:
+            # Ошибку хендлера aiogram пишет уже после выхода из middleware
+            context = getattr(record.exc_info[1], "_log_context", None)
+        if context:
+            for key in _CONTEXT_FIELDS:
+                if context.get(key) is not None and not hasattr(record, key):
+                    setattr(record, key, context[key])
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample", None)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < rate
+
+
+class SampleRate(logging.Filter):
+    # Фильтр логгера: помечает его INFO-записи и ниже для выборочной записи
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and not hasattr(record, "sample"):
+            record.sample = self.rate
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Стандартный prepare форматирует запись целиком в вызывающем потоке (под
+        # межпроцессную очередь); здесь очередь в пределах процесса — фиксируем только
+        # текст сообщения, JSON и трейсбек соберёт поток логов
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(**static):
+    # static — поля, добавляемые к каждой записи процесса (например, worker=N)
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "text":
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        output.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(SamplingFilter())
+    handler.addFilter(ContextFilter(static))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    for name in SAMPLED_LOGGERS:
+        logging.getLogger(name).addFilter(SampleRate(LOG_UPDATE_SAMPLE))
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def update_context() -> dict | None:
+    # Поля обновления, которое сейчас обрабатывается в этой задаче
+    return _context.get()
+
+
+def stop_logging():
+    # Дописывает всё, что осталось в очереди
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class UpdateContextMiddleware(BaseMiddleware):
+    # Внешний middleware на dp.update: id обновления и пользователя для всех записей.
+    # Контекст сбрасывается на выходе — обновления, переданные подряд в одной задаче
+    # (dp.feed_update в бенчмарках), не получают поля предыдущего. Ошибку хендлера
+    # aiogram пишет в лог уже после middleware, поэтому контекст прикрепляется
+    # к исключению, и ContextFilter берёт поля оттуда.
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        context = {"update_id": event.update_id, "user_id": user.id if user else None, "handler": None}
+        token = _context.set(context)
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            e._log_context = context
+            raise
+        finally:
+            _context.reset(token)
+
+
+class HandlerContextMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        context = _context.get()
+        if context is not None:
+            context["handler"] = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+def setup_log_context(dp: Dispatcher):
+    dp.update.outer_middleware(UpdateContextMiddleware())
+    dp.message.middleware(HandlerContextMiddleware())
+    dp.callback_query.middleware(HandlerContextMiddleware())
@@ -0,0 +1,68 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+# Отложенное удаление служебных сообщений («Промокод применен!» и т.п.).
+# Хендлер только ставит задание и сразу завершается; удаляет фоновая задача,
+# которая спит до ближайшего срока из кучи.
+
+CLEANUP_SHUTDOWN_TIMEOUT = 5  # секунд на удаление оставшихся сообщений при остановке
+
+_heap: list[tuple[float, int, Bot, int, int]] = []
+_seq = itertools.count()
+_wakeup: asyncio.Event | None = None
+_worker: asyncio.Task | None = None
+
+
+async def _delete(bot: Bot, chat_id: int, message_id: int):
+    try:
+        await bot.delete_message(chat_id, message_id)
+    except TelegramAPIError:
+        pass  # уже удалено пользователем или слишком старое
+
+
+async def _run_worker():
+    while True:
+        _wakeup.clear()
+        now = time.monotonic()
+        due = []
+        while _heap and _heap[0][0] <= now:
+            _, _, bot, chat_id, message_id = heapq.heappop(_heap)
+            due.append(_delete(bot, chat_id, message_id))
+        if due:
+            await asyncio.gather(*due)
+            continue
+        timeout = _heap[0][0] - now if _heap else None
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+def schedule_delete(bot: Bot, chat_id: int, message_id: int, delay: float):
+    global _wakeup, _worker
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    if _worker is None or _worker.done():
+        _worker = asyncio.create_task(_run_worker())
+    heapq.heappush(_heap, (time.monotonic() + delay, next(_seq), bot, chat_id, message_id))
+    _wakeup.set()  # новый срок может оказаться раньше текущего ожидания
+
+
+async def stop_cleanup():
+    # При остановке бота удаляем всё, что ещё ждёт своей очереди
+    global _worker
+    if _worker is not None:
+        _worker.cancel()
+        _worker = None
+    pending = [_delete(bot, chat_id, message_id) for _, _, bot, chat_id, message_id in _heap]
+    _heap.clear()
+    if pending:
+        try:
+            await asyncio.wait_for(asyncio.gather(*pending), CLEANUP_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,238 @@
+import bisect
+import contextvars
+import logging
+import time
+from collections import defaultdict
+from typing import Callable
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiohttp import web
+
+from config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Метрики процесса: задержка, число обновлений и ошибок по каждому хендлеру,
+# время и число вызовов функций db.py (в целом и в расчёте на хендлер).
+# Отдаются в текстовом формате Prometheus на METRICS_HOST:METRICS_PORT/metrics
+# и показываются админу на экране «📈 Метрики». При WORKERS > 1 у каждого
+# воркера свой порт: METRICS_PORT + номер воркера.
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UNHANDLED = "unhandled"
+THROTTLED = "throttled"   # отклонённые throttling-ом обновления — отдельно от задержек хендлеров
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # последняя корзина — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # Оценка сверху: граница корзины, в которую попадает q-й квантиль
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+_handler_latency: dict[str, Histogram] = defaultdict(Histogram)
+_handler_errors: dict[str, int] = defaultdict(int)
+_handler_db_calls: dict[str, int] = defaultdict(int)
+_handler_throttled: dict[str, int] = defaultdict(int)
+_db_latency: dict[str, Histogram] = defaultdict(Histogram)
+_db_errors: dict[str, int] = defaultdict(int)
+_gauges: dict[str, Callable[[], dict]] = {}
+_worker = 0
+
+# Хендлер текущего обновления: {"handler": имя, "db_calls": n}. Задаётся во внешнем
+# middleware, имя дописывает внутренний — когда роутер уже выбрал хендлер.
+_current_update: contextvars.ContextVar[dict | None] = contextvars.ContextVar("current_update", default=None)
+
+
+def set_worker(index: int):
+    global _worker
+    _worker = index
+
+
+def register_gauges(prefix: str, collect):
+    # collect() -> {имя: число}; вызывается при каждом чтении метрик
+    _gauges[prefix] = collect
+
+
+def observe_db(name: str, seconds: float, failed: bool = False, query: bool = True):
+    _db_latency[name].observe(seconds)
+    if failed:
+        _db_errors[name] += 1
+    current = _current_update.get()
+    if query and current is not None:
+        current["db_calls"] += 1
+
+
+def observe_throttled(handler: str):
+    _handler_throttled[handler] += 1
+    current = _current_update.get()
+    if current is not None:
+        current["handler"] = THROTTLED
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    # Внешний middleware на dp.update: время обработки обновления целиком
+    async def __call__(self, handler, event, data):
+        current = {"handler": UNHANDLED, "db_calls": 0}
+        token = _current_update.set(current)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            _handler_errors[current["handler"]] += 1
+            raise
+        finally:
+            _handler_latency[current["handler"]].observe(time.perf_counter() - started)
+            _handler_db_calls[current["handler"]] += current["db_calls"]
+            _current_update.reset(token)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    # Внутренний middleware: вызывается уже для конкретного хендлера
+    async def __call__(self, handler, event, data):
+        current = _current_update.get()
+        if current is not None:
+            current["handler"] = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+def setup_metrics(dp: Dispatcher):
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    # Внутренние middleware диспетчера действуют и во вложенных роутерах
+    dp.message.middleware(HandlerNameMiddleware())
+    dp.callback_query.middleware(HandlerNameMiddleware())
+    dp.startup.register(start_metrics_server)
+    dp.shutdown.register(stop_metrics_server)
+
+
+# --- Чтение ---
+
+def handler_summary() -> list[dict]:
+    # По хендлерам, самые частые первыми
+    rows = []
+    for name, hist in _handler_latency.items():
+        rows.append({
+            "name": name,
+            "count": hist.count,
+            "errors": _handler_errors.get(name, 0),
+            "avg": hist.sum / hist.count if hist.count else 0.0,
+            "p50": hist.quantile(0.5),
+            "p95": hist.quantile(0.95),
+            "db_calls": _handler_db_calls.get(name, 0) / hist.count if hist.count else 0.0,
+            "throttled": _handler_throttled.get(name, 0),
+        })
+    rows.sort(key=lambda row: -row["count"])
+    return rows
+
+
+def db_summary() -> list[dict]:
+    # По функциям db.py, больше всего суммарного времени — первыми
+    rows = [{"name": name, "count": hist.count, "errors": _db_errors.get(name, 0),
+             "total": hist.sum, "p95": hist.quantile(0.95)}
+            for name, hist in _db_latency.items()]
+    rows.sort(key=lambda row: -row["total"])
+    return rows
+
+
+def gauges() -> dict:
+    values = {}
+    for prefix, collect in _gauges.items():
+        for name, value in collect().items():
+            values[f"{prefix}_{name}"] = value
+    return values
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(metric: str, label: str, histograms: dict) -> list[str]:
+    lines = [f"# TYPE {metric} histogram"]
+    for name, hist in sorted(histograms.items()):
+        labels = f'worker="{_worker}",{label}="{_label(name)}"'
+        seen = 0
+        for bound, count in zip(BUCKETS, hist.counts):
+            seen += count
+            lines.append(f'{metric}_bucket{{{labels},le="{bound:g}"}} {seen}')
+        lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {hist.count}')
+        lines.append(f"{metric}_sum{{{labels}}} {hist.sum:.6f}")
+        lines.append(f"{metric}_count{{{labels}}} {hist.count}")
+    return lines
+
+
+def _counter_lines(metric: str, label: str, counters: dict) -> list[str]:
+    lines = [f"# TYPE {metric} counter"]
+    for name, value in sorted(counters.items()):
+        lines.append(f'{metric}{{worker="{_worker}",{label}="{_label(name)}"}} {value}')
+    return lines
+
+
+def render_prometheus() -> str:
+    lines = []
+    lines += _histogram_lines("sd_bot_handler_duration_seconds", "handler", _handler_latency)
+    lines += _counter_lines("sd_bot_handler_errors_total", "handler", _handler_errors)
+    lines += _counter_lines("sd_bot_handler_db_calls_total", "handler", _handler_db_calls)
+    lines += _counter_lines("sd_bot_handler_throttled_total", "handler", _handler_throttled)
+    lines += _histogram_lines("sd_bot_db_call_duration_seconds", "function", _db_latency)
+    lines += _counter_lines("sd_bot_db_call_errors_total", "function", _db_errors)
+    for name, value in sorted(gauges().items()):
+        lines.append(f"# TYPE sd_bot_{name} gauge")
+        lines.append(f'sd_bot_{name}{{worker="{_worker}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+# --- HTTP ---
+
+_runner: web.AppRunner | None = None
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render_prometheus().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server():
+    global _runner
+    if not METRICS_PORT or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = METRICS_PORT + _worker
+    try:
+        await web.TCPSite(runner, METRICS_HOST, port).start()
+    except OSError as e:
+        # Метрики не должны мешать боту: порт занят — работаем без эндпоинта
+        logger.warning("Не удалось открыть метрики на %s:%s: %s", METRICS_HOST, port, e)
+        await runner.cleanup()
+        return
+    _runner = runner
+    logger.info("Метрики: http://%s:%s/metrics", METRICS_HOST, port)
+
+
+async def stop_metrics_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from config import ADMIN_IDS
+from metrics import register_gauges
+
+logger = logging.getLogger(__name__)
+
+# Таймаут запроса к Telegram. После таймаута сообщение могло уже дойти, поэтому
+# такая попытка не повторяется — таймаут берётся с запасом
+NOTIFY_TIMEOUT = int(os.getenv("NOTIFY_TIMEOUT", "60"))
+NOTIFY_ATTEMPTS = 3
+NOTIFY_CONCURRENCY = 20   # одновременно рассылаемых уведомлений
+NOTIFY_DRAIN_TIMEOUT = 15  # сколько ждём недоставленные уведомления при остановке
+
+_queue: asyncio.Queue | None = None
+_worker: asyncio.Task | None = None
+_in_flight: set[asyncio.Task] = set()
+
+_stats = {
+    "queued": 0,
+    "delivered": 0,
+    "failed": 0,
+    "retries": 0,
+    "timeouts": 0,
+    "delivery_seconds_total": 0.0,
+}
+
+
+def notification_stats() -> dict:
+    stats = dict(_stats)
+    stats["pending"] = (_queue.qsize() if _queue else 0) + len(_in_flight)
+    return stats
+
+
+register_gauges("notifications", notification_stats)
+
+
+async def _send_to_admin(bot: Bot, admin_id: int, text: str, enqueued_at: float):
+    # Повторяем только то, что точно не дошло: сетевые ошибки, 5xx и RetryAfter
+    for attempt in range(NOTIFY_ATTEMPTS):
+        if attempt:
+            _stats["retries"] += 1
+        try:
+            await bot.send_message(admin_id, text, parse_mode="HTML", request_timeout=NOTIFY_TIMEOUT)
+            _stats["delivered"] += 1
+            _stats["delivery_seconds_total"] += time.monotonic() - enqueued_at
+            return
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except TelegramNetworkError as e:
+            if isinstance(e.__context__, asyncio.TimeoutError):
+                # Запрос ушёл, ответа не дождались — повтор может продублировать уведомление
+                _stats["timeouts"] += 1
+                logger.error("Таймаут уведомления админа %s, не повторяем", admin_id)
+                break
+            logger.warning("Ошибка уведомления админа %s (попытка %d): %s", admin_id, attempt + 1, e)
+        except TelegramServerError as e:
+            logger.warning("Ошибка уведомления админа %s (попытка %d): %s", admin_id, attempt + 1, e)
+        except Exception as e:
+            # Заблокировал бота, неверный id, ошибка в тексте — повторять бессмысленно
+            logger.error("Не удалось уведомить админа %s: %s", admin_id, e)
+            break
+        await asyncio.sleep(2 ** attempt)
+    _stats["failed"] += 1
+
+
+async def _fan_out(bot: Bot, text: str, enqueued_at: float):
+    await asyncio.gather(*(_send_to_admin(bot, admin_id, text, enqueued_at) for admin_id in ADMIN_IDS))
+
+
+async def _run_worker():
+    semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+    while True:
+        bot, text, enqueued_at = await _queue.get()
+        await semaphore.acquire()
+        task = asyncio.create_task(_fan_out(bot, text, enqueued_at))
+        _in_flight.add(task)
+
+        def _done(t, semaphore=semaphore):
+            _in_flight.discard(t)
+            semaphore.release()
+            _queue.task_done()
+
+        task.add_done_callback(_done)
+
+
+def notify_admins(bot: Bot, text: str):
+    # Не ждёт отправки: уведомление уходит всем админам параллельно в фоне
+    global _queue, _worker
+    if _queue is None:
+        _queue = asyncio.Queue()
+    if _worker is None or _worker.done():
+        _worker = asyncio.create_task(_run_worker())
+    _stats["queued"] += 1
+    _queue.put_nowait((bot, text, time.monotonic()))
+
+
+async def stop_notifications():
+    # При остановке бота даём дослать уже принятые заказы
+    global _worker
+    if _queue is not None:
+        try:
+            await asyncio.wait_for(_queue.join(), NOTIFY_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Не доставлено уведомлений при остановке: %d", notification_stats()["pending"])
+    if _worker is not None:
+        _worker.cancel()
+        _worker = None
@@ -0,0 +1,94 @@
+import re
+from collections import defaultdict
+
+# Текст заказа («Заказ: ... К оплате») собирается из позиций по запросу —
+# в БД лежат только order_items и суммы. Для старых заказов, у которых есть
+# лишь готовый order_text, здесь же его разбор обратно в позиции.
+#
+# Позиция: {"category", "name", "qty", "price", "is_promo"}, для экрана
+# клиента — ещё "desc". Заказ: {"items", "promo_code", "discount",
+# "delivery_type", "delivery_cost", "total"}.
+
+
+def group_by_category(lines: list[dict]) -> dict:
+    grouped = defaultdict(list)
+    for line in lines:
+        grouped[line["category"]].append(line)
+    return grouped
+
+
+def line_title(line: dict) -> str:
+    return f"{line['name']} × {line['qty']}" if line["qty"] > 1 else line["name"]
+
+
+def items_subtotal(items: list[dict]) -> int:
+    return sum(item["qty"] * item["price"] for item in items if not item["is_promo"])
+
+
+def render_order(order: dict, with_desc: bool = False) -> str:
+    code = order.get("promo_code") or ""
+    discount = order.get("discount") or 0
+    delivery_cost = order.get("delivery_cost") or 0
+
+    text = "Заказ:\n"
+    for cat, items in group_by_category(order["items"]).items():
+        text += f"<b>{cat}</b>\n"
+        for item in items:
+            price_text = f"{item['qty'] * item['price']} ₽"
+            if item['is_promo']:
+                price_text = f"бесплатно по промокоду {code}"
+            text += f"• {line_title(item)} — {price_text}\n"
+            desc = (item.get('desc') or "").strip()
+            if with_desc and desc:
+                text += f"  {desc}\n"
+        text += "\n"
+
+    text += f"Сумма позиций: {items_subtotal(order['items'])} ₽\n"
+    if discount:
+        text += f"Скидка по промокоду {code}: {discount} ₽\n"
+    if order.get("delivery_type") == "delivery":
+        if delivery_cost == 0:
+            text += "Доставка: бесплатно\n"
+        else:
+            text += f"Доставка: {delivery_cost} ₽\n"
+    text += f"<b>К оплате: {order['total']} ₽</b>"
+    return text
+
+
+# --- Разбор старых order_text ---
+
+_CATEGORY_RE = re.compile(r"^<b>(.+?)</b>(.*)$")
+_ITEM_RE = re.compile(r"^• (.+?)(?: × (\d+))? — (?:(\d+) ₽|бесплатно по промокоду (\S*))\s*$")
+_DISCOUNT_RE = re.compile(r"^Скидка по промокоду (\S+): (\d+) ₽$")
+_TOTAL_RE = re.compile(r"^(?:<b>К оплате: (\d+) ₽</b>|Итого: (\d+) ₽)$")
+
+
+def parse_order_text(text: str) -> dict:
+    # Позиции, промокод, скидка и итог из текста заказа любого из прежних форматов.
+    # Повторы одного блюда (старый формат без «× N») остаются отдельными позициями.
+    order = {"items": [], "promo_code": None, "discount": 0, "total": None}
+    category = ""
+    for raw in (text or "").split("\n"):
+        line = raw.rstrip()
+        match = _CATEGORY_RE.match(line)
+        if match and not _TOTAL_RE.match(line):
+            category, line = match.group(1), match.group(2)  # бывало: "<b>Категория</b>• Блюдо — ..."
+        match = _ITEM_RE.match(line)
+        if match:
+            name, qty, amount, code = match.groups()
+            qty = int(qty or 1)
+            is_promo = amount is None
+            if is_promo:
+                order["promo_code"] = order["promo_code"] or code or None
+            price = 0 if is_promo else int(amount) // qty
+            order["items"].append({"category": category, "name": name, "qty": qty, "price": price, "is_promo": is_promo})
+            continue
+        match = _DISCOUNT_RE.match(line)
+        if match:
+            order["promo_code"] = match.group(1)
+            order["discount"] = int(match.group(2))
+            continue
+        match = _TOTAL_RE.match(line)
+        if match:
+            order["total"] = int(match.group(1) or match.group(2))
+    return order
@@ -0,0 +1,231 @@
+import asyncio
+import datetime
+import gc
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import FSInputFile
+
+from logs import update_context
+
+logger = logging.getLogger(__name__)
+
+# Профилирование по запросу админа (/perf): следующие N обновлений или окно
+# в T секунд. Поток-сэмплер каждые PROFILE_INTERVAL секунд снимает стек каждого
+# обрабатываемого обновления: цепочку await от диспетчера до места, где задача
+# сейчас ждёт (БД, Telegram, sleep), а если задача в этот момент выполняется —
+# ещё и синхронные вызовы на вершине стека потока event loop. Так видно и
+# процессорное время, и ожидание. Итог — файл в формате folded stacks
+# («хендлер;кадр;кадр N»), который принимают flamegraph.pl и speedscope.
+#
+# Пока профилирование выключено, middleware только проверяет одну переменную.
+
+PROFILE_INTERVAL = 0.005      # секунд между сэмплами
+PROFILE_DEFAULT_UPDATES = 200
+PROFILE_MAX_UPDATES = 5000
+PROFILE_MAX_SECONDS = 300     # предел для любого режима
+PROFILE_TOP = 10              # хендлеров в подписи к файлу
+
+
+def _frame_name(code) -> str:
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}.{code.co_qualname}"
+
+
+def _await_chain(task: asyncio.Task, loop_frame) -> list[str] | None:
+    # Стек задачи от корня к листу. loop_frame — текущий кадр потока event loop
+    coro = task.get_coro()
+    names = []
+    frame = None
+    while coro is not None:
+        if hasattr(coro, "cr_frame"):
+            frame, running, nxt = coro.cr_frame, coro.cr_running, coro.cr_await
+        elif hasattr(coro, "gi_frame"):
+            frame, running, nxt = coro.gi_frame, coro.gi_running, coro.gi_yieldfrom
+        elif hasattr(coro, "ag_frame"):
+            frame, running, nxt = coro.ag_frame, coro.ag_running, coro.ag_await
+        elif type(coro).__name__ == "coroutine_wrapper":
+            # await объекта с __await__ (методы Bot API в aiogram) — корутина внутри обёртки
+            coro = next((ref for ref in gc.get_referents(coro) if hasattr(ref, "cr_frame")), None)
+            continue
+        else:
+            kind = "Future" if isinstance(coro, asyncio.Future) or type(coro).__name__ == "FutureIter" else type(coro).__name__
+            names.append(f"[await {kind}]")
+            return names
+        if frame is None:
+            return None   # задача уже завершилась
+        # Имя корутины, а не кода: обёртки с functools.wraps (db_call) получают имя функции
+        module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+        name = f"{module}.{getattr(coro, '__qualname__', frame.f_code.co_qualname)}"
+        if not names or names[-1] != name:
+            names.append(name)
+        if running:
+            # Задача выполняется прямо сейчас — дописываем синхронные вызовы над ней
+            above = []
+            current = loop_frame
+            while current is not None and current is not frame:
+                above.append(_frame_name(current.f_code))
+                current = current.f_back
+            if current is frame:
+                names.extend(reversed(above))
+            return names
+        coro = nxt
+    return names
+
+
+class ProfileSession:
+    def __init__(self, bot: Bot, chat_id: int, updates: int | None, seconds: float):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.updates_left = updates
+        self.seconds = seconds
+        self.started_at = time.monotonic()
+        self.updates = 0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.by_handler: Counter = Counter()
+        self.tasks: dict[asyncio.Task, dict] = {}   # задача -> {стек: сэмплов}
+        self._loop_thread = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._timer: asyncio.Task | None = None
+        self.finished = False
+
+    def start(self):
+        self._thread.start()
+        self._timer = asyncio.create_task(self._deadline())
+
+    async def _deadline(self):
+        await asyncio.sleep(self.seconds)
+        await finish_profiling()
+
+    def _sample_loop(self):
+        while not self._stop.wait(PROFILE_INTERVAL):
+            loop_frame = sys._current_frames().get(self._loop_thread)
+            self.samples += 1
+            for task, counts in tuple(self.tasks.items()):
+                try:
+                    chain = _await_chain(task, loop_frame)
+                except Exception:
+                    # Стек задачи меняется прямо во время обхода — пропускаем сэмпл
+                    continue
+                if chain:
+                    stack = ";".join(chain)
+                    counts[stack] = counts.get(stack, 0) + 1
+
+    def add_update(self, handler: str, counts: dict):
+        # Хендлер известен только после маршрутизации — сэмплы приписываются ему в конце
+        self.updates += 1
+        for stack, count in dict(counts).items():
+            self.stacks[f"{handler};{stack}"] += count
+            self.by_handler[handler] += count
+
+    def stop_sampling(self):
+        self._stop.set()
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+
+    def join(self):
+        self._thread.join()
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def caption(self) -> str:
+        elapsed = time.monotonic() - self.started_at
+        text = (f"Профиль: {self.updates} обновлений за {elapsed:.0f} с, "
+                f"сэмплов {self.samples} по {PROFILE_INTERVAL * 1000:g} мс\n")
+        total = sum(self.by_handler.values()) or 1
+        for handler, count in self.by_handler.most_common(PROFILE_TOP):
+            text += f"• {handler}: {count * PROFILE_INTERVAL:.2f} с ({count / total:.0%})\n"
+        return text + "Файл — folded stacks для flamegraph.pl или speedscope.app"
+
+
+_session: ProfileSession | None = None
+_finishing: set[asyncio.Task] = set()
+
+
+def profiling_active() -> bool:
+    return _session is not None
+
+
+def start_profiling(bot: Bot, chat_id: int, updates: int | None = None, seconds: float | None = None) -> bool:
+    # updates — профилировать столько обновлений, seconds — столько секунд (что наступит раньше)
+    global _session
+    if _session is not None:
+        return False
+    seconds = min(seconds or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+    if updates is not None:
+        updates = max(1, min(updates, PROFILE_MAX_UPDATES))
+    _session = ProfileSession(bot, chat_id, updates, seconds)
+    _session.start()
+    logger.info("Профилирование запущено", extra={"updates": updates, "seconds": seconds, "chat_id": chat_id})
+    return True
+
+
+async def finish_profiling(deliver: bool = True):
+    # Останавливает сэмплер и отправляет файл тому, кто запускал профилирование
+    global _session
+    session, _session = _session, None
+    if session is None or session.finished:
+        return
+    session.finished = True
+    session.stop_sampling()
+    if not deliver:
+        return
+    await asyncio.to_thread(session.join)   # сэмплер дописывает последний сэмпл
+    if not session.stacks:
+        await session.bot.send_message(session.chat_id, "Профилирование завершено: обновлений не было.")
+        return
+
+    fd, path = tempfile.mkstemp(prefix="profile_", suffix=".folded")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(session.write, path)
+        document = FSInputFile(path, filename=f"profile_{datetime.datetime.now():%Y%m%d_%H%M%S}.folded")
+        await session.bot.send_document(session.chat_id, document, caption=session.caption())
+    except Exception:
+        logger.exception("Не удалось отправить профиль")
+    finally:
+        os.remove(path)
+
+
+async def stop_profiler():
+    await finish_profiling(deliver=False)
+
+
+class ProfilerMiddleware(BaseMiddleware):
+    # Внешний middleware на dp.update; регистрируется после logs.setup_log_context,
+    # чтобы имя хендлера бралось из контекста логов
+    async def __call__(self, handler, event, data):
+        session = _session
+        if session is None:
+            return await handler(event, data)
+
+        task = asyncio.current_task()
+        counts = session.tasks[task] = {}
+        try:
+            return await handler(event, data)
+        finally:
+            session.tasks.pop(task, None)
+            context = update_context() or {}
+            session.add_update(context.get("handler") or "(без хендлера)", counts)
+            if session.updates_left is not None:
+                session.updates_left -= 1
+                if session.updates_left == 0:
+                    finishing = asyncio.create_task(finish_profiling())
+                    _finishing.add(finishing)
+                    finishing.add_done_callback(_finishing.discard)
+
+
+def setup_profiler(dp: Dispatcher):
+    dp.update.outer_middleware(ProfilerMiddleware())
+    dp.shutdown.register(stop_profiler)
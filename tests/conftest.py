@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Модули бота лежат в корне репозитория, без пакета
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# До импорта config/db: тесты не трогают bot.db и не открывают порт метрик
+os.environ["DB_FILE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="sd_bot_tests_"), "bot.db")
+os.environ["METRICS_PORT"] = "0"
+
+
+def _close_connection(db):
+    with db._conn_lock:
+        if db._conn is not None:
+            db._conn.close()
+            db._conn = None
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    # Пустая БД с текущей схемой; функции вызываются синхронно через .sync
+    import db
+    _close_connection(db)
+    monkeypatch.setattr(db, "DB_FILE", str(tmp_path / "bot.db"))
+    db.init_db()
+    db.migrate_db()
+    yield db
+    _close_connection(db)
@@ -0,0 +1,90 @@
+import asyncio
+
+from cart import (
+    DELIVERY_COST,
+    FREE_DELIVERY_MIN,
+    add_item,
+    cart_count,
+    cart_totals,
+    empty_cart,
+    get_cart,
+    load_cart,
+    with_discount,
+    with_item,
+)
+
+
+def test_get_cart_converts_legacy_list():
+    # Старый формат: по полной копии блюда на каждое добавление, промо-позиция — в общем списке
+    legacy = [
+        {"id": 7, "name": "XXL", "price": "619", "desc": ""},
+        {"id": 3, "name": "Плов", "price": 250, "desc": ""},
+        {"id": 7, "name": "XXL", "price": "619", "desc": ""},
+        {"id": 5, "name": "Мексиканская", "price": 0, "is_promo": True},
+        {"name": "Без id", "price": 100},
+    ]
+
+    assert get_cart({"cart": legacy}) == {"7": {"qty": 2, "price": 619}, "3": {"qty": 1, "price": 250}}
+
+
+def test_get_cart_empty_state():
+    assert get_cart({}) == {}
+    assert get_cart({"cart": None}) == {}
+
+
+def test_add_item_keeps_first_price_and_does_not_mutate():
+    cart = {"7": {"qty": 1, "price": 619}}
+
+    updated = add_item(cart, {"id": 7, "price": 700})
+    updated = add_item(updated, {"id": 3, "price": "250"})
+
+    assert updated == {"7": {"qty": 2, "price": 619}, "3": {"qty": 1, "price": 250}}
+    assert cart == {"7": {"qty": 1, "price": 619}}
+    assert cart_count(updated) == 3
+
+
+def test_with_item_moves_running_totals():
+    data = empty_cart()
+    data.update(with_item(data, {"id": 7, "price": 619}))
+    data.update(with_item(data, {"id": 7, "price": 619}))
+    data.update(with_item(data, {"id": 3, "price": 250}))
+
+    assert data["cart_subtotal"] == 1488
+    assert cart_totals(data) == {"subtotal": 1488, "discount": 0, "delivery_cost": DELIVERY_COST,
+                                 "total": 1488 + DELIVERY_COST}
+
+    data.update(with_item(data, {"id": 3, "price": 250}))
+
+    assert cart_totals(data) == {"subtotal": 1738, "discount": 0, "delivery_cost": 0, "total": 1738}
+
+
+def test_discount_can_bring_back_delivery_cost():
+    data = {**empty_cart(), "cart": {"7": {"qty": 1, "price": FREE_DELIVERY_MIN}}, "cart_subtotal": FREE_DELIVERY_MIN}
+    data.update(with_discount(data, 100))
+
+    assert cart_totals(data) == {"subtotal": FREE_DELIVERY_MIN, "discount": 100, "delivery_cost": DELIVERY_COST,
+                                 "total": FREE_DELIVERY_MIN - 100 + DELIVERY_COST}
+
+
+def test_totals_for_state_saved_before_running_totals():
+    data = {"cart": {"7": {"qty": 2, "price": 619}, "3": {"qty": 1, "price": 250}}, "promo_discount": 0}
+
+    assert cart_totals(data) == {"subtotal": 1488, "discount": 0, "delivery_cost": DELIVERY_COST,
+                                 "total": 1488 + DELIVERY_COST}
+
+
+def test_load_cart_drops_dishes_removed_from_menu(database):
+    category_id = database.add_category.sync("Шаурма")
+    kept = database.add_dish.sync(category_id, "XXL", "619")
+    removed = database.add_dish.sync(category_id, "Мексиканская", "419")
+    data = empty_cart()
+    data.update(with_item(data, {"id": kept, "price": 619}))
+    data.update(with_item(data, {"id": removed, "price": 419}))
+    assert asyncio.run(load_cart(data))[1] == {}
+
+    database.delete_dish.sync(removed)
+    lines, changes = asyncio.run(load_cart(data))
+
+    assert [(line["id"], line["name"], line["qty"]) for line in lines] == [(kept, "XXL", 1)]
+    assert changes == {"cart": {str(kept): {"qty": 1, "price": 619}}, "cart_subtotal": 619,
+                       "delivery_cost": DELIVERY_COST}
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=42, chat_id=1, user_id=1)
+OTHER_KEY = StorageKey(bot_id=42, chat_id=2, user_id=2)
+
+
+def stored_rows(database) -> dict:
+    rows = database.get_connection().execute("SELECT key, state, data FROM fsm_storage").fetchall()
+    return {key: (state, data) for key, state, data in rows}
+
+
+def test_changes_reach_db_only_on_flush(database):
+    async def run():
+        storage = SQLiteStorage(flush_interval=3600)
+        await storage.set_state(KEY, "Order:address")
+        await storage.set_data(KEY, {"cart": {"7": {"qty": 2, "price": 619}}})
+        assert stored_rows(database) == {}
+        await storage.close()
+
+        restarted = SQLiteStorage()
+        return await restarted.get_state(KEY), await restarted.get_data(KEY)
+
+    assert asyncio.run(run()) == ("Order:address", {"cart": {"7": {"qty": 2, "price": 619}}})
+
+
+def test_cleared_session_is_deleted(database):
+    async def run():
+        storage = SQLiteStorage(flush_interval=3600)
+        await storage.set_state(KEY, "Order:address")
+        await storage.set_data(OTHER_KEY, {"promo_discount": 100})
+        await storage.flush()
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        await storage.close()
+        return storage
+
+    storage = asyncio.run(run())
+
+    assert list(stored_rows(database).values()) == [(None, '{"promo_discount": 100}')]
+    assert storage.key_builder.build(KEY) not in storage._records
+
+
+def test_expired_sessions_are_not_loaded_and_swept(database):
+    async def run():
+        storage = SQLiteStorage(ttl=60, flush_interval=3600)
+        await storage.set_data(KEY, {"old": True})
+        await storage.set_data(OTHER_KEY, {"fresh": True})
+        await storage.close()
+        conn = database.get_connection()
+        conn.execute("UPDATE fsm_storage SET updated_at = ? WHERE key = ?",
+                     (time.time() - 120, storage.key_builder.build(KEY)))
+        conn.commit()
+
+        restarted = SQLiteStorage(ttl=60, flush_interval=3600)
+        loaded = await restarted.get_data(KEY), await restarted.get_data(OTHER_KEY)
+        await restarted.sweep()
+        return loaded
+
+    assert asyncio.run(run()) == ({}, {"fresh": True})
+    assert list(stored_rows(database).values()) == [(None, '{"fresh": true}')]
+
+
+def test_sweep_unloads_idle_sessions_but_keeps_unsaved(database):
+    async def run():
+        storage = SQLiteStorage(memory_idle=0, flush_interval=3600)
+        await storage.set_data(KEY, {"saved": True})
+        await storage.flush()
+        await storage.set_data(OTHER_KEY, {"unsaved": True})
+        await asyncio.sleep(0.01)
+        await storage.sweep()
+        loaded = set(storage._records)
+        await storage.close()
+        return storage, loaded
+
+    storage, loaded = asyncio.run(run())
+
+    assert loaded == {storage.key_builder.build(OTHER_KEY)}
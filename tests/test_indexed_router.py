@@ -0,0 +1,109 @@
+import asyncio
+import itertools
+
+import pytest
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.state import State, StatesGroup
+
+from indexed_router import IndexedRouter
+
+
+class ItemCallback(CallbackData, prefix="i"):
+    item_id: int
+
+
+class Editing(StatesGroup):
+    name = State()
+
+
+DATA = [
+    "menu", "menu_x", "cat_1", "cat_", "catalog", "cart_clear", "cart", "i:5", "i:x", "i:50",
+    "skip_me", "state_only", "other", "", "ca",
+]
+
+_update_ids = itertools.count(1)
+
+
+def register_handlers(router: Router, seen: list):
+    # Одни и те же хендлеры в одном порядке: точные значения, пересекающиеся префиксы,
+    # CallbackData, хендлеры без фильтра по data и хендлер, пропускающий событие
+    def handler(name):
+        async def callback(query):
+            seen.append(name)
+        return callback
+
+    async def skipping(query):
+        seen.append("skipping")
+        raise SkipHandler
+
+    router.callback_query.register(handler("cat_prefix_first"), F.data.startswith("cat_"))
+    router.callback_query.register(handler("menu_exact"), F.data == "menu")
+    router.callback_query.register(skipping, F.data == "skip_me")
+    router.callback_query.register(handler("c_prefix"), F.data.startswith("ca"))
+    router.callback_query.register(handler("item"), ItemCallback.filter(F.item_id > 10))
+    router.callback_query.register(handler("cart_exact"), F.data == "cart")
+    router.callback_query.register(handler("in_state"), Editing.name)
+    router.callback_query.register(handler("contains_x"), F.data.contains("x"))
+    router.callback_query.register(handler("menu_prefix"), F.data.startswith("menu"))
+    router.callback_query.register(handler("item_any"), ItemCallback.filter())
+    router.callback_query.register(handler("fallback"))
+
+
+def callback_update(data: str, user_id: int = 1) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "chat_instance": "1",
+            "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": user_id, "type": "private"}, "text": "-"},
+        },
+    }
+
+
+def dispatch_all(router_cls, state: State | None = None) -> list[list[str]]:
+    async def run():
+        dp = Dispatcher()
+        seen = []
+        router = router_cls()
+        register_handlers(router, seen)
+        dp.include_router(router)
+        bot = Bot("42:TEST")
+        if state is not None:
+            await dp.fsm.get_context(bot, chat_id=1, user_id=1).set_state(state)
+        handled = []
+        for data in DATA:
+            seen.clear()
+            await dp.feed_raw_update(bot, callback_update(data))
+            handled.append(list(seen))
+        await bot.session.close()
+        return handled
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("state", [None, Editing.name], ids=["no-state", "in-state"])
+def test_same_handler_as_plain_router(state):
+    indexed = dispatch_all(IndexedRouter, state)
+
+    assert indexed == dispatch_all(Router, state)
+    # Порядок регистрации, а не точность совпадения: "cat_1" берёт первый префикс
+    handled = dict(zip(DATA, indexed))
+    assert handled["cat_1"] == ["cat_prefix_first"]
+    assert handled["skip_me"] == ["skipping", "in_state" if state else "fallback"]
+
+
+def test_candidates_in_registration_order():
+    router = IndexedRouter()
+    register_handlers(router, [])
+    observer = router.callback_query
+
+    # Без совпадений по индексу — только хендлеры без фильтра по data
+    assert len(observer.candidates("zzz")) == 3
+    assert observer.candidates("zzz") == observer.candidates(None)
+    # Совпадения по индексу и неиндексированные — вперемешку, как были зарегистрированы
+    positions = [observer.handlers.index(handler) for handler in observer.candidates("cat_1")]
+    assert positions == [0, 3, 6, 7, 10]
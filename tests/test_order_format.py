@@ -0,0 +1,108 @@
+import pytest
+
+from order_format import parse_order_text, render_order
+
+
+def item(category, name, price, qty=1, is_promo=False):
+    return {"category": category, "name": name, "qty": qty, "price": price, "is_promo": is_promo}
+
+
+# Текущий формат: то, что render_order собирает из order_items
+CURRENT_ORDERS = [
+    pytest.param({
+        "items": [item("🌯 Шаурма", "Мексиканская 🔥", 419, qty=3), item("🌯 Шаурма", "XXL", 619),
+                  item("🔥 Горячее", "Плов", 250)],
+        "delivery_type": "pickup", "delivery_cost": 0, "total": 2126,
+    }, id="pickup"),
+    pytest.param({
+        "items": [item("🌯 Шаурма", "С креветкой", 499)],
+        "delivery_type": "delivery", "delivery_cost": 250, "total": 749,
+    }, id="paid-delivery"),
+    pytest.param({
+        "items": [item("🌯 Шаурма", "XXL", 619, qty=3), item("Промо", "Мексиканская 🔥", 0, is_promo=True)],
+        "promo_code": "TEST10", "delivery_type": "delivery", "delivery_cost": 0, "total": 1857,
+    }, id="free-item-promo"),
+    pytest.param({
+        "items": [item("🥪 Сэндвичи", "Курица и сыр", 219, qty=2)],
+        "promo_code": "MINUS100", "discount": 100, "delivery_type": "delivery", "delivery_cost": 250, "total": 588,
+    }, id="discount-promo"),
+]
+
+
+@pytest.mark.parametrize("order", CURRENT_ORDERS)
+def test_render_parse_round_trip(order):
+    text = render_order(order)
+    parsed = parse_order_text(text)
+
+    assert parsed["items"] == order["items"]
+    assert parsed["promo_code"] == order.get("promo_code")
+    assert parsed["discount"] == order.get("discount", 0)
+    assert parsed["total"] == order["total"]
+    rendered = render_order({**parsed, "delivery_type": order["delivery_type"],
+                             "delivery_cost": order["delivery_cost"]})
+    assert rendered == text
+
+
+def test_parse_category_glued_to_first_item():
+    # Самый старый формат: первая позиция на одной строке с категорией, «Итого:»
+    text = ("Заказ:\n<b>🌯 Шаурма</b>• Мексиканская 🔥 — 419 ₽\n• С креветкой — 499 ₽\n\n"
+            "<b>🔥 Горячее</b>• Плов — 250 ₽\n\nИтого: 1168 ₽")
+
+    parsed = parse_order_text(text)
+
+    assert parsed["items"] == [item("🌯 Шаурма", "Мексиканская 🔥", 419), item("🌯 Шаурма", "С креветкой", 499),
+                               item("🔥 Горячее", "Плов", 250)]
+    assert parsed["total"] == 1168
+
+
+def test_parse_skips_description_lines():
+    text = ("Заказ:\n<b>🌯 Шаурма</b>\n• Классическая — 349 ₽\n  Курица, 349 гр.\n\n"
+            "<b>🍽️ Особое</b>\n• Сырные палочки — 109 ₽\n\nИтого за товары: 458 ₽\n"
+            "Доставка: 250 ₽\n<b>К оплате: 708 ₽</b>")
+
+    parsed = parse_order_text(text)
+
+    assert parsed["items"] == [item("🌯 Шаурма", "Классическая", 349), item("🍽️ Особое", "Сырные палочки", 109)]
+    assert parsed["total"] == 708
+
+
+def test_parse_repeated_lines_and_promo_block():
+    # Формат без «× N»: каждое добавление — отдельная строка; бесплатная позиция в блоке «Промо»
+    text = ("Заказ:\n<b>🌯 Шаурма</b>\n• XXL — 619 ₽\n• XXL — 619 ₽\n• XXL — 619 ₽\n\n"
+            "<b>Промо</b>\n• Мексиканская 🔥 — бесплатно по промокоду TEST10\n\n"
+            "Сумма позиций: 1857 ₽\n<b>К оплате: 1857 ₽</b>")
+
+    parsed = parse_order_text(text)
+
+    assert parsed["items"] == [item("🌯 Шаурма", "XXL", 619)] * 3 + [item("Промо", "Мексиканская 🔥", 0, is_promo=True)]
+    assert parsed["promo_code"] == "TEST10"
+    assert parsed["total"] == 1857
+
+
+def test_parse_quantity_gives_unit_price():
+    parsed = parse_order_text("Заказ:\n<b>Суши</b>\n• Филадельфия × 3 — 1200 ₽\n\n<b>К оплате: 1200 ₽</b>")
+
+    assert parsed["items"] == [item("Суши", "Филадельфия", 400, qty=3)]
+
+
+def test_parse_empty_text():
+    assert parse_order_text(None) == {"items": [], "promo_code": None, "discount": 0, "total": None}
+
+
+def test_migrate_backfills_legacy_orders(database):
+    current = render_order(CURRENT_ORDERS[2].values[0])
+    legacy = ("Заказ:\n<b>🌯 Шаурма</b>\n• Классическая — 349 ₽\n  Курица, 349 гр.\n\n"
+              "Итого за товары: 349 ₽\nДоставка: 250 ₽\n<b>К оплате: 599 ₽</b>")
+    conn = database.get_connection()
+    conn.executemany("INSERT INTO orders (order_text, order_time, delivery_type, delivery_cost) VALUES (?, ?, ?, ?)",
+                     [(current, "01.03.2025 12:30", "delivery", 0), (legacy, "02.03.2025 19:05", "delivery", 250)])
+    conn.commit()
+
+    database.migrate_db()
+
+    rows = conn.execute("SELECT id, order_text, promo_code, total FROM orders ORDER BY id").fetchall()
+    # Текст текущего формата восстанавливается из позиций, старый с описаниями — остаётся
+    assert [(text is None, code, total) for _, text, code, total in rows] == [(True, "TEST10", 1857), (False, None, 599)]
+    items = conn.execute("SELECT order_id, name, price, quantity, is_promo FROM order_items ORDER BY id").fetchall()
+    assert items == [(rows[0][0], "XXL", 619, 3, 0), (rows[0][0], "Мексиканская 🔥", 0, 1, 1),
+                     (rows[1][0], "Классическая", 349, 1, 0)]
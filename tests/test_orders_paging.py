@@ -0,0 +1,55 @@
+import pytest
+
+ITEMS = [{"id": None, "category": "Шаурма", "name": "XXL", "price": 619, "qty": 1, "is_promo": False}]
+
+# Время (UTC) каждого заказа по порядку вставки: три заказа в одну секунду,
+# ещё два — в другую, и один без времени (не попадает в выборку)
+TIMESTAMPS = [
+    "2025-03-01 04:00:00",
+    "2025-03-02 10:00:00",
+    "2025-03-02 10:00:00",
+    "2025-03-02 10:00:00",
+    "2025-03-01 04:00:00",
+    "2025-03-03 12:30:00",
+    None,
+]
+
+
+@pytest.fixture
+def order_ids(database):
+    ids = [database.append_order.sync(ITEMS, "+79990000000", "pickup", "") for _ in TIMESTAMPS]
+    conn = database.get_connection()
+    conn.executemany("UPDATE orders SET timestamp = ? WHERE id = ?", list(zip(TIMESTAMPS, ids)))
+    conn.commit()
+    return ids
+
+
+def read_all_pages(database, limit, **filters):
+    pages = []
+    cursor = None
+    while True:
+        orders = database.get_orders_page.sync(**filters, before=cursor, limit=limit)
+        if not orders:
+            return pages
+        pages.append([order["id"] for order in orders])
+        cursor = (orders[-1]["timestamp"], orders[-1]["id"])
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 10])
+def test_pages_cover_equal_timestamps_once(database, order_ids, limit):
+    # Новые первыми, при одинаковом времени — больший id первым
+    expected = [order_ids[5], order_ids[3], order_ids[2], order_ids[1], order_ids[4], order_ids[0]]
+
+    pages = read_all_pages(database, limit)
+
+    assert [order_id for page in pages for order_id in page] == expected
+    assert all(len(page) == limit for page in pages[:-1])
+    assert database.count_orders.sync() == len(expected)
+
+
+def test_pages_respect_date_filter(database, order_ids):
+    # 02.03.2025 по местному времени (UTC+8): с 01.03 16:00 до 02.03 16:00 UTC
+    pages = read_all_pages(database, 2, date_from="02.03.2025", date_to="02.03.2025")
+
+    assert pages == [[order_ids[3], order_ids[2]], [order_ids[1]]]
+    assert database.count_orders.sync(date_from="02.03.2025", date_to="02.03.2025") == 3
@@ -0,0 +1,106 @@
+import asyncio
+import itertools
+
+import pytest
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.types import CallbackQuery
+
+import throttling
+from throttling import THROTTLE_CALLBACK_TEXT, THROTTLE_LIMITS, setup_throttling, take_token
+
+_ids = itertools.count(1)
+
+
+@pytest.fixture(autouse=True)
+def fresh_buckets(monkeypatch):
+    monkeypatch.setattr(throttling, "_buckets", {})
+    monkeypatch.setattr(throttling, "_warned", {})
+    monkeypatch.setitem(THROTTLE_LIMITS, "test", (2.0, 3))
+
+
+def test_burst_then_refill_at_rate():
+    assert [take_token(1, "test", 100.0) for _ in range(4)] == [True, True, True, False]
+    # 2 токена в секунду: через 0.25 с полтокена — мало, через 0.5 с — один
+    assert take_token(1, "test", 100.25) is False
+    assert take_token(1, "test", 100.5) is True
+    assert take_token(1, "test", 100.5) is False
+    # Долгий простой не копит больше burst
+    assert [take_token(1, "test", 200.0) for _ in range(4)] == [True, True, True, False]
+
+
+def test_buckets_are_per_user_and_limit():
+    for _ in range(3):
+        take_token(1, "test", 0.0)
+
+    assert take_token(1, "test", 0.0) is False
+    assert take_token(2, "test", 0.0) is True
+    assert take_token(1, "promo", 0.0) is True
+
+
+def test_sweep_forgets_only_full_buckets():
+    take_token(1, "test", 0.0)
+    for _ in range(3):
+        take_token(2, "test", 0.9)
+
+    throttling._sweep(1.0)
+
+    assert set(throttling._buckets) == {(2, "test")}
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {
+        "update_id": next(_ids),
+        "callback_query": {
+            "id": str(next(_ids)),
+            "chat_instance": "1",
+            "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": user_id, "type": "private"}, "text": "-"},
+        },
+    }
+
+
+def press(monkeypatch, presses: list[tuple[int, str]]) -> tuple[list, list]:
+    handled, answered = [], []
+
+    async def answer(self, text=None, **kwargs):
+        answered.append((self.from_user.id, text))
+
+    monkeypatch.setattr(CallbackQuery, "answer", answer)
+    monkeypatch.setattr(throttling, "ADMIN_IDS", [99])
+
+    async def run():
+        dp = Dispatcher()
+        setup_throttling(dp)
+        router = Router()
+
+        @router.callback_query(F.data == "limited", flags={"throttle": "test"})
+        async def limited(query):
+            handled.append((query.from_user.id, query.data))
+
+        @router.callback_query(F.data == "free", flags={"throttle": False})
+        async def free(query):
+            handled.append((query.from_user.id, query.data))
+
+        dp.include_router(router)
+        bot = Bot("42:TEST")
+        for user_id, data in presses:
+            await dp.feed_raw_update(bot, callback_update(user_id, data))
+        await bot.session.close()
+
+    asyncio.run(run())
+    return handled, answered
+
+
+def test_rejected_press_is_answered_and_skips_handler(monkeypatch):
+    handled, answered = press(monkeypatch, [(1, "limited")] * 5)
+
+    assert handled == [(1, "limited")] * 3
+    assert answered == [(1, THROTTLE_CALLBACK_TEXT)] * 2
+
+
+def test_admins_and_opted_out_handlers_are_not_limited(monkeypatch):
+    handled, answered = press(monkeypatch, [(99, "limited")] * 5 + [(1, "free")] * 20)
+
+    assert handled == [(99, "limited")] * 5 + [(1, "free")] * 20
+    assert answered == []
@@ -0,0 +1,115 @@
+import logging
+import time
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message
+
+from config import (
+    ADMIN_IDS,
+    THROTTLE_MESSAGE_RATE,
+    THROTTLE_MESSAGE_BURST,
+    THROTTLE_CALLBACK_RATE,
+    THROTTLE_CALLBACK_BURST,
+)
+from metrics import observe_throttled, register_gauges
+
+logger = logging.getLogger(__name__)
+
+# Ограничение частоты действий пользователя: token bucket на пользователя и лимит.
+# Лимит по умолчанию — "message" или "callback" по типу события; хендлер может
+# выбрать другой флагом: @router.callback_query(..., flags={"throttle": "cart"}),
+# или отключить ограничение: flags={"throttle": False}. Лишнее нажатие получает
+# короткий ответ на callback, лишнее сообщение отбрасывается — хендлер, БД и
+# FSM не трогаются. Админы не ограничиваются.
+
+# Лимит: (токенов в секунду, максимальный запас)
+THROTTLE_LIMITS = {
+    "message": (THROTTLE_MESSAGE_RATE, THROTTLE_MESSAGE_BURST),
+    "callback": (THROTTLE_CALLBACK_RATE, THROTTLE_CALLBACK_BURST),
+    "cart": (3.0, 10),      # добавление блюд — можно быстро набрать несколько
+    "promo": (0.1, 3),      # подбор промокодов: три попытки сразу, дальше одна в 10 с
+    "heavy": (0.2, 3),      # /start с фото, история заказов
+}
+
+THROTTLE_CALLBACK_TEXT = "⏳ Слишком часто, подождите немного"
+THROTTLE_MESSAGE_TEXT = "⏳ Слишком много сообщений подряд. Подождите несколько секунд."
+THROTTLE_WARN_INTERVAL = 10   # секунд между предупреждениями на отброшенные сообщения
+THROTTLE_SWEEP_INTERVAL = 60  # как часто забывать полные (давно не тронутые) корзины
+
+_buckets: dict[tuple[int, str], list] = {}   # (user_id, лимит) -> [токены, время обновления]
+_warned: dict[int, float] = {}               # user_id -> когда предупреждали о сообщениях
+_rejected = {"message": 0, "callback": 0}
+_last_sweep = time.monotonic()
+
+
+def take_token(user_id: int, limit: str, now: float) -> bool:
+    rate, burst = THROTTLE_LIMITS[limit]
+    bucket = _buckets.get((user_id, limit))
+    if bucket is None:
+        _buckets[(user_id, limit)] = [burst - 1, now]
+        return True
+    tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if tokens < 1:
+        bucket[0] = tokens
+        return False
+    bucket[0] = tokens - 1
+    return True
+
+
+def _sweep(now: float):
+    global _last_sweep
+    _last_sweep = now
+    for key, bucket in list(_buckets.items()):
+        rate, burst = THROTTLE_LIMITS[key[1]]
+        if bucket[0] + (now - bucket[1]) * rate >= burst:
+            del _buckets[key]
+    for user_id, warned_at in list(_warned.items()):
+        if now - warned_at > THROTTLE_WARN_INTERVAL:
+            del _warned[user_id]
+
+
+def throttle_stats() -> dict:
+    return {"rejected_messages": _rejected["message"], "rejected_callbacks": _rejected["callback"],
+            "buckets": len(_buckets)}
+
+
+register_gauges("throttle", throttle_stats)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Внутренний middleware: хендлер уже выбран, его флаги доступны
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id in ADMIN_IDS:
+            return await handler(event, data)
+
+        kind = "callback" if isinstance(event, CallbackQuery) else "message"
+        limit = get_flag(data, "throttle", default=kind)
+        if limit is False:
+            return await handler(event, data)
+        if limit not in THROTTLE_LIMITS:
+            limit = kind
+
+        now = time.monotonic()
+        if now - _last_sweep > THROTTLE_SWEEP_INTERVAL:
+            _sweep(now)
+        if take_token(user.id, limit, now):
+            return await handler(event, data)
+
+        _rejected[kind] += 1
+        observe_throttled(data["handler"].callback.__name__)
+        logger.info("Отклонено частое действие", extra={"limit": limit, "sample": 0.1})
+        if isinstance(event, CallbackQuery):
+            await event.answer(THROTTLE_CALLBACK_TEXT)
+        elif isinstance(event, Message) and now - _warned.get(user.id, float("-inf")) > THROTTLE_WARN_INTERVAL:
+            _warned[user.id] = now
+            await event.answer(THROTTLE_MESSAGE_TEXT)
+        return None
+
+
+def setup_throttling(dp: Dispatcher):
+    # После middleware логов и метрик: отклонённое событие уже знает свой хендлер
+    dp.message.middleware(ThrottlingMiddleware())
+    dp.callback_query.middleware(ThrottlingMiddleware())
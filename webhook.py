@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    MAX_CONCURRENT_UPDATES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    # Как SimpleRequestHandler: отвечает Telegram сразу и обрабатывает обновление в фоне,
+    # но держит в обработке не больше max_concurrent обновлений. Пока лимит исчерпан,
+    # ответ на запрос задерживается — Telegram сам притормаживает отправку.
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrent: int, **kwargs):
+        super().__init__(dispatcher, bot, **kwargs)
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        await self._semaphore.acquire()
+        try:
+            update = await request.json(loads=bot.session.json_loads)
+        except Exception:
+            self._semaphore.release()
+            raise
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        task.add_done_callback(lambda _: self._semaphore.release())
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+
+def build_app(dp: Dispatcher, bot: Bot, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET,
+              max_concurrent: int = MAX_CONCURRENT_UPDATES) -> web.Application:
+    app = web.Application()
+    LimitedRequestHandler(dp, bot, max_concurrent, secret_token=secret or None).register(app, path=path)
+    # Хуки dp.startup / dp.shutdown вызываются при запуске и остановке aiohttp-приложения
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def _set_webhook(bot: Bot, dispatcher: Dispatcher):
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        max_connections=min(MAX_CONCURRENT_UPDATES, 100),  # Telegram допускает 1..100
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    logger.info("Webhook установлен: %s", WEBHOOK_URL + WEBHOOK_PATH)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    if WEBHOOK_URL:
+        dp.startup.register(_set_webhook)
+    else:
+        # Без публичного адреса вебхук в Telegram не регистрируется —
+        # удобно для локальной проверки через benchmarks/fake_telegram.py
+        logger.warning("WEBHOOK_URL не задан: сервер принимает обновления, но вебхук не регистрируется")
+
+    runner = web.AppRunner(build_app(dp, bot))
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    # SIGTERM (docker stop) и Ctrl+C — штатная остановка: runner.cleanup() вызывает
+    # dp.shutdown, где сбрасываются сессии FSM, досылаются уведомления и
+    # останавливаются рассылки
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info("Webhook-сервер слушает %s:%s%s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
+    try:
+        await stop.wait()
+        logger.info("Остановка webhook-сервера")
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        await runner.cleanup()
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import multiprocessing
+import secrets
+import signal
+import threading
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiohttp import web
+
+from config import (
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    MAX_CONCURRENT_UPDATES,
+)
+from metrics import set_worker
+from logs import setup_logging, stop_logging
+
+logger = logging.getLogger(__name__)
+
+# Режим нескольких процессов: главный процесс (ingress) получает обновления
+# через getUpdates или вебхук и раздаёт их воркерам по user id. Все обновления
+# одного пользователя попадают в один и тот же воркер — его FSM и кэш профиля
+# живут только там. Внутри воркера обновления разных пользователей обрабатываются
+# параллельно, а одного пользователя — строго по очереди, в порядке поступления
+# (следующее ждёт завершения предыдущего). БД и FSM-хранилище общие
+# (SQLite в режиме WAL), меню воркеры сверяют через meta.menu_version.
+
+WORKER_STOP_TIMEOUT = 30   # секунд на завершение воркера при остановке
+POLLING_TIMEOUT = 30
+WORKER_PENDING_FACTOR = 4  # принятых обновлений на воркер: MAX_CONCURRENT_UPDATES * 4
+
+
+def update_user_id(update: dict) -> int:
+    # id пользователя (или чата) из сырого обновления; 0 — если его нет (например, poll)
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            owner = event.get(field)
+            if isinstance(owner, dict) and "id" in owner:
+                return owner["id"]
+    return 0
+
+
+# --- Воркер ---
+
+def _pump(queue, loop: asyncio.AbstractEventLoop, inbox: asyncio.Queue):
+    # Блокирующее чтение межпроцессной очереди — в отдельном потоке
+    while True:
+        update = queue.get()
+        loop.call_soon_threadsafe(inbox.put_nowait, update)
+        if update is None:
+            return
+
+
+async def _process(dp: Dispatcher, bot: Bot, update: dict, previous: asyncio.Task | None,
+                   semaphore: asyncio.Semaphore):
+    if previous is not None:
+        # Предыдущее обновление того же пользователя должно завершиться первым
+        await asyncio.wait({previous})
+    async with semaphore:
+        await _feed(dp, bot, update)
+
+
+def _forget(last_by_user: dict, user_id: int, task: asyncio.Task):
+    # Очередь пользователя пуста — после этого обновления новых не пришло
+    if last_by_user.get(user_id) is task:
+        del last_by_user[user_id]
+
+
+async def _feed(dp: Dispatcher, bot: Bot, update: dict):
+    try:
+        result = await dp.feed_raw_update(bot, update)
+        if isinstance(result, TelegramMethod):
+            await dp.silent_call_request(bot=bot, result=result)
+    except Exception:
+        logger.exception("Ошибка обработки обновления %s", update.get("update_id"))
+
+
+async def _serve_worker(index: int, queue, create_bot, create_dispatcher):
+    set_worker(index)
+    bot = create_bot()
+    dp = create_dispatcher(background_jobs=index == 0)
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot])
+
+    inbox = asyncio.Queue()
+    threading.Thread(target=_pump, args=(queue, asyncio.get_running_loop(), inbox),
+                     name=f"worker-{index}-inbox", daemon=True).start()
+
+    # Слот семафора берётся только когда очередь пользователя дошла до обновления,
+    # чтобы ждущие своей очереди обновления не занимали слоты других пользователей.
+    # pending ограничивает все принятые обновления: остальные ждут в очереди процесса
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPDATES)
+    pending = asyncio.Semaphore(MAX_CONCURRENT_UPDATES * WORKER_PENDING_FACTOR)
+    tasks: set[asyncio.Task] = set()
+    last_by_user: dict[int, asyncio.Task] = {}   # user id -> последнее его обновление
+    try:
+        while True:
+            update = await inbox.get()
+            if update is None:
+                break
+            await pending.acquire()
+            user_id = update_user_id(update)
+            previous = last_by_user.get(user_id) if user_id else None
+            task = asyncio.create_task(_process(dp, bot, update, previous, semaphore))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: pending.release())
+            if user_id:
+                last_by_user[user_id] = task
+                task.add_done_callback(lambda done, uid=user_id: _forget(last_by_user, uid, done))
+        await asyncio.gather(*tasks)
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot])
+        await bot.session.close()
+
+
+def _worker_main(index: int, queue, create_bot, create_dispatcher):
+    # Ctrl+C и SIGTERM обрабатывает ingress: он дошлёт воркерам сигнал остановки в очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    setup_logging(worker=index)
+    from db import close_db
+    try:
+        asyncio.run(_serve_worker(index, queue, create_bot, create_dispatcher))
+    finally:
+        close_db()
+        stop_logging()
+
+
+# --- Ingress ---
+
+class Ingress:
+    def __init__(self, workers: int, create_bot, create_dispatcher):
+        # spawn, а не fork: в родителе уже открыто соединение SQLite и работают потоки
+        ctx = multiprocessing.get_context("spawn")
+        self.queues = [ctx.Queue() for _ in range(workers)]
+        self.processes = [
+            ctx.Process(target=_worker_main, args=(i, queue, create_bot, create_dispatcher),
+                        name=f"worker-{i}", daemon=True)
+            for i, queue in enumerate(self.queues)
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def route(self, update: dict):
+        self.queues[update_user_id(update) % len(self.queues)].put(update)
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning("%s не завершился за %d с — останавливаем принудительно", process.name, WORKER_STOP_TIMEOUT)
+                process.terminate()
+
+
+async def _poll_updates(bot: Bot, ingress: Ingress, allowed_updates: list, stop: asyncio.Event):
+    await bot.delete_webhook()
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Ошибка getUpdates: %s", e)
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            ingress.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+async def _serve_webhook(bot: Bot, ingress: Ingress, allowed_updates: list, stop: asyncio.Event):
+    # Как webhook.LimitedRequestHandler: не больше MAX_CONCURRENT_UPDATES запросов
+    # в обработке, остальные ждут — Telegram сам притормаживает отправку
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPDATES)
+
+    async def handle(request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if WEBHOOK_SECRET and not secrets.compare_digest(token, WEBHOOK_SECRET):
+            return web.Response(body="Unauthorized", status=401)
+        async with semaphore:
+            ingress.route(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                              max_connections=min(MAX_CONCURRENT_UPDATES, 100), allowed_updates=allowed_updates)
+    logger.info("Webhook-сервер слушает %s:%s%s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_ingress(workers: int, create_bot, create_dispatcher, mode: str = BOT_MODE):
+    bot = create_bot()
+    allowed_updates = create_dispatcher(background_jobs=False).resolve_used_update_types()
+    ingress = Ingress(workers, create_bot, create_dispatcher)
+    ingress.start()
+    logger.info("Запущено воркеров: %d", workers)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    receive = _serve_webhook if mode == "webhook" else _poll_updates
+    receiver = asyncio.create_task(receive(bot, ingress, allowed_updates, stop))
+    stopping = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait({receiver, stopping}, return_when=asyncio.FIRST_COMPLETED)
+        if receiver.done():
+            # Приём обновлений упал (порт занят, ошибка вебхука) — не ждём сигнала впустую
+            receiver.result()
+    finally:
+        stopping.cancel()
+        receiver.cancel()
+        await asyncio.gather(receiver, stopping, return_exceptions=True)
+        await asyncio.to_thread(ingress.stop)
+        await bot.session.close()